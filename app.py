@@ -2,116 +2,113 @@ import streamlit as st
 import os
 import shutil
 import asyncio
-from src.book_loader import BookLoader
-from src.ai_director import AIDirector
-from src.audio_engine import AudioEngine
+import time
+from src.book_loader import Book, BookLoader, loader_version
+from src.ai_director import AIDirector, DEFAULT_BATCH_TOKEN_BUDGET
+from src.tts_cache import TTSCache
+from src.director_cache import DirectorCache
+from src.book_cache import BookCache
 from src.config import configure_ffmpeg
-from src.utils import clear_temp_folder
-from pydub import AudioSegment
+from src.utils import clear_jobs_folder
+from src.chapter_render import ChapterRenderer, OUTPUT_FORMATS
+from src.job_manifest import JobManifest
+from src.metrics import Metrics, activate
+from src.pipeline import ProgressReporter, process_generation
+from src.segmenter import segmenter_settings
 
 # 初始化
 configure_ffmpeg()
 
+# 流式解析时每次页面重跑最多解析多久 (秒)，解析出的章节随即可选
+PARSE_TIME_SLICE = 0.5
 
-def merge_audio_files(file_paths, output_path):
-    combined = AudioSegment.empty()
-    progress_bar = st.progress(0)
-    status = st.empty()
 
-    total = len(file_paths)
-    for i, f in enumerate(file_paths):
-        if f and os.path.exists(f):
-            try:
-                combined += AudioSegment.from_mp3(f)
-            except Exception:
-                pass
-        if i % 5 == 0:
-            status.text(f"正在拼接: {i}/{total}")
-            progress_bar.progress((i + 1) / total)
-
-    combined.export(output_path, format="mp3")
-    status.text("拼接完成！")
-    return output_path
-
-
-# --- 核心异步逻辑：封装整个生成过程 ---
-async def process_generation(chapters, selected_indices, use_ai, director, ai_concurrency):
-    """
-    将章节遍历和音频生成逻辑封装在同一个 Async Loop 中，
-    确保 AudioEngine 的 Semaphore 与当前 Loop 绑定。
-    """
-    # 在 Loop 内部初始化 Engine，防止 Semaphore 报错
-    engine = AudioEngine()
-    final_audio_files = []
-
-    total_chapters = len(selected_indices)
-    global_progress = st.progress(0)
-    status_text = st.empty()
-
-    # 创建 AI 并发限制信号量
-    ai_semaphore = asyncio.Semaphore(ai_concurrency)
-
-    # 内部辅助函数：并发执行 AI 标注
-    async def process_ai_segment(segment):
-        async with ai_semaphore:
-            # 将同步的 director.direct_scene 放入线程池执行，避免阻塞事件循环
-            loop = asyncio.get_running_loop()
-            return await loop.run_in_executor(None, director.direct_scene, segment)
-
-    for idx, chap_idx in enumerate(selected_indices):
-        chapter = chapters[chap_idx]
-        status_text.markdown(f"### 正在处理: **{chapter.title}** ({idx + 1}/{total_chapters})")
-
-        # 1. 文本切分
-        raw_text = chapter.content
-        text_segments = [raw_text[i:i + 800] for i in range(0, len(raw_text), 800)]
-
-        chapter_scripts = []
-        chapter_progress = st.progress(0)
-
-        # === 阶段 A: AI 剧本标注 (并发加速) ===
-        if use_ai:
-            status_text.markdown(f"### 🧠 AI 导演正在分析剧本 (并发数: {ai_concurrency})...")
+@st.cache_resource
+def get_tts_cache():
+    """TTS 缓存在进程内只初始化一次 (避免每次 rerun 重新扫描缓存目录)"""
+    return TTSCache()
 
-            # 创建所有分段的 AI 任务
-            ai_tasks = [process_ai_segment(seg) for seg in text_segments]
 
-            # 执行并发并等待结果 (保持顺序)
-            # 为了显示进度，我们可以使用 as_completed，但为了保持顺序，直接 gather 更简单
-            # 如果需要进度条，可以简单地分批或者直接等待
-            chapter_scripts = await asyncio.gather(*ai_tasks)
+@st.cache_resource
+def get_director_cache():
+    """AI 导演结果缓存 (SQLite)，进程内共享同一个连接"""
+    return DirectorCache()
 
-            # 简单的 AI 完成进度更新
-            chapter_progress.progress(0.3)  # 假设 AI 占 30% 进度
-        else:
-            # 普通模式：直接构造默认脚本
-            chapter_scripts = [[{"text": seg, "role": "narrator", "params": {}}] for seg in text_segments]
-            chapter_progress.progress(0.1)
 
-        # === 阶段 B: 音频生成 (并发 TTS) ===
-        status_text.markdown(f"### 🎙️ 正在录制音频 ({chapter.title})...")
-        chapter_audio_segments = []
+@st.cache_resource
+def get_book_cache():
+    """书籍解析结果缓存 (SQLite)，进程内共享同一个连接"""
+    return BookCache()
 
-        # 遍历每个段落的脚本进行 TTS
-        total_segments = len(text_segments)
-        for seg_i, script in enumerate(chapter_scripts):
-            tasks = []
-            for script_idx, item in enumerate(script):
-                unique_id = (idx * 10000) + (seg_i * 100) + script_idx
-                tasks.append(engine.generate_segment(item, unique_id))
 
-            if tasks:
-                segment_files = await asyncio.gather(*tasks)
-                chapter_audio_segments.extend([f for f in segment_files if f])
+class StreamlitReporter(ProgressReporter):
+    """把流水线进度渲染到 Streamlit 页面"""
 
-            # 更新章节进度 (从 30% 到 100%)
-            current_progress = 0.3 + (0.7 * (seg_i + 1) / total_segments)
-            chapter_progress.progress(min(current_progress, 1.0))
+    def __init__(self):
+        self.progress_bar = st.progress(0)
+        self.status_text = st.empty()
 
-        final_audio_files.extend(chapter_audio_segments)
-        global_progress.progress((idx + 1) / total_chapters)
+    def stage(self, text):
+        self.status_text.markdown(f"### {text}")
 
-    return final_audio_files
+    def progress(self, done, total, status):
+        self.progress_bar.progress(min(done / total, 1.0) if total else 1.0)
+        if status is None:
+            return
+        ai_info = ""
+        if status["ai"]:
+            ai = status["ai"]
+            ai_info = f"  |  AI 并发: {ai['in_flight']}/{ai['limit']} (限流 {ai['throttles']} 次)"
+        self.status_text.markdown(
+            f"### 🧠 导演: {status['directing'] or '-'}  |  🎙️ 录制: {status['recording'] or '-'}\n"
+            f"TTS 队列: {status['tts_waiting']} 等待 / {status['tts_in_flight']} 进行中 "
+            f"(并发上限 {status['tts_limit']})  |  TTS 请求: {status['tts_requests']} "
+            f"(由 {status['script_items']} 个条目合并){ai_info}"
+        )
+
+    def merge_progress(self, done, total):
+        self.status_text.text(f"正在渲染章节: {done}/{total}")
+        self.progress_bar.progress(done / total)
+
+    def warning(self, text, details=None):
+        st.warning(text)
+        if details:
+            with st.expander("查看详情"):
+                st.text("\n".join(details))
+
+
+# 成书格式对应的播放器 MIME 类型
+AUDIO_MIME_TYPES = {"mp3": "audio/mpeg", "mka": "audio/x-matroska", "m4b": "audio/mp4"}
+
+
+def render_book(renderer, title):
+    """等待逐章渲染完成并封装成书 (各章在生成过程中已陆续渲染)"""
+    reporter = StreamlitReporter()
+    rendered = renderer.finish(reporter.merge_progress, title=title, warning_callback=reporter.warning)
+    reporter.status_text.text("渲染完成！")
+    return rendered
+
+
+def show_metrics(job_metrics, job_dir):
+    """展示本次任务的关键指标，并提供 Prometheus 文本与 Chrome Trace 时间线下载"""
+    prom_path, trace_path = job_metrics.write(job_dir)
+    summary = job_metrics.summary()
+    with st.expander("📈 性能指标"):
+        st.markdown(
+            f"- 总耗时: {summary['elapsed']:.1f}s，TTS 吞吐 {summary['tts_chars_per_second']} 字/秒\n"
+            f"- LLM: {summary['llm_requests']} 次请求，重试 {summary['llm_retries']} 次，"
+            f"降级为旁白 {summary['llm_fallbacks']} 次，缓存命中 {summary['llm_cache_hits']} 次，"
+            f"峰值并发 {summary['llm_in_flight_peak']}\n"
+            f"- TTS: {summary['tts_requests']} 次请求，重试 {summary['tts_retries']} 次，"
+            f"失败 {summary['tts_failures']} 个，缓存命中 {summary['tts_cache_hits']} 次，"
+            f"峰值并发 {summary['tts_in_flight_peak']}"
+        )
+        st.table([{"阶段": name, "平均耗时 (秒)": seconds} for name, seconds in summary["mean_seconds"].items()])
+        col1, col2 = st.columns(2)
+        with open(prom_path, "rb") as f:
+            col1.download_button("Prometheus 指标", f, file_name="metrics.prom")
+        with open(trace_path, "rb") as f:
+            col2.download_button("时间线 (chrome://tracing)", f, file_name="trace.json")
 
 
 def main():
@@ -129,6 +126,11 @@ def main():
         base_url = st.text_input("Base URL", value="https://api.deepseek.com", help="例如: https://api.deepseek.com")
         model_name = st.text_input("模型名称", value="deepseek-chat")
         output_name = st.text_input("输出文件名", value="final_book")
+        output_format = st.selectbox(
+            "输出格式",
+            OUTPUT_FORMATS,
+            help="mka / m4b 带章节标记，播放器可按章跳转；m4b 需逐章编码为 AAC。所有格式都另外保留逐章 MP3。"
+        )
 
         use_ai = st.toggle("启用 AI 导演模式", value=True, help="开启后将使用 LLM 分析情感和角色。")
 
@@ -136,79 +138,204 @@ def main():
             st.markdown("---")
             st.markdown("**🚀 加速设置**")
             ai_concurrency = st.slider(
-                "AI 思考并发数",
+                "AI 并发上限",
                 min_value=1,
-                max_value=20,
-                value=5,
-                help="DeepSeek 不限制并发，调高此数值可大幅加快剧本分析速度。建议 5-10。"
+                max_value=64,
+                value=32,
+                help="实际并发会根据成功率、限流 (429) 和响应延迟自动调整，此处仅为上限。"
+            )
+            use_batch = st.toggle(
+                "批量导演模式",
+                value=False,
+                help="将多个片段打包进一次请求，减少请求次数与重复的 System Prompt 开销。"
+            )
+            batch_token_budget = st.number_input(
+                "单次请求文本 token 上限",
+                min_value=500,
+                max_value=16000,
+                value=DEFAULT_BATCH_TOKEN_BUDGET,
+                step=500
+            ) if use_batch else None
+            stream_director = st.toggle(
+                "流式导演 (更快出声)",
+                value=False,
+                help="边生成剧本边录音，每条台词生成完毕即送去 TTS。开启后忽略批量模式。"
             )
         else:
             ai_concurrency = 1  # 不用 AI 时此值无效
+            batch_token_budget = None
+            stream_director = False
+
+        spool_audio = st.toggle(
+            "音频写入单个缓冲文件",
+            value=False,
+            help="TTS 音频直接追加进一个假脱机文件，不再为每个片段创建小文件，适合超长书籍。"
+        )
 
         if not api_key and use_ai:
             st.warning("启用 AI 模式需要填写 API Key")
 
+        if use_ai and st.button("🗑️ 清除当前模型的剧本缓存"):
+            removed = get_director_cache().invalidate(model_name=model_name)
+            st.info(f"已清除 {removed} 条缓存")
+
+        if st.button("🧹 清理断点续跑任务"):
+            clear_jobs_folder()
+            st.info("已删除所有任务清单与分段音频")
+
+        if st.button("🧹 清理书籍解析缓存"):
+            removed = get_book_cache().clear()
+            st.info(f"已清除 {removed} 本书的解析结果")
+
     # --- 1. 文件上传与解析 ---
     if "book_chapters" not in st.session_state:
         st.session_state.book_chapters = None
 
     uploaded_file = st.file_uploader("📂 拖入书籍文件", type=["epub", "docx", "pdf", "txt"])
 
+    if uploaded_file is None:
+        st.session_state.book_chapters = None
+        st.session_state.book_stream = None
+        st.session_state.pop("book_fingerprint", None)
+        st.session_state.pop("selected_chapters", None)
+
     if uploaded_file and st.session_state.book_chapters is None:
-        with st.spinner("正在解析书籍结构..."):
+        # 任务清单与解析缓存都按原始文件内容识别，解析尚未结束时也能稳定续跑
+        st.session_state.book_fingerprint = JobManifest.fingerprint_bytes(uploaded_file.getvalue())
+        book_cache = get_book_cache()
+        st.session_state.book_cache_key = book_cache.make_key(st.session_state.book_fingerprint)
+        cached_chapters = book_cache.get(st.session_state.book_cache_key)
+
+        if cached_chapters is not None:
+            st.session_state.book_chapters = cached_chapters
+            st.success(f"已从缓存载入！共 {len(cached_chapters)} 个章节")
+        else:
             try:
-                chapters = BookLoader.load_book(uploaded_file)
-                st.session_state.book_chapters = chapters
-                st.success(f"解析成功！共识别到 {len(chapters)} 个章节")
-                st.rerun()  # 刷新以显示章节选择
+                st.session_state.book_stream = BookLoader.iter_book(uploaded_file)
+                st.session_state.book_chapters = Book()
             except Exception as e:
                 st.error(f"解析失败: {e}")
 
+    # 流式解析：每次重跑解析一小段，已解析出的章节立即可以选择和生成
+    parsing = st.session_state.get("book_stream") is not None
+    if parsing:
+        deadline = time.monotonic() + PARSE_TIME_SLICE
+        try:
+            for chapter in st.session_state.book_stream:
+                st.session_state.book_chapters.append(chapter)
+                if time.monotonic() > deadline:
+                    break
+            else:
+                parsing = False
+                st.session_state.book_stream = None
+                # 写入缓存后换成 mmap 版本，会话内只保留标题与偏移索引
+                book_cache = get_book_cache()
+                book_cache.put(st.session_state.book_cache_key, st.session_state.book_chapters)
+                st.session_state.book_chapters = book_cache.get(st.session_state.book_cache_key)
+                st.success(f"解析成功！共识别到 {len(st.session_state.book_chapters)} 个章节")
+        except Exception as e:
+            parsing = False
+            st.session_state.book_stream = None
+            st.error(f"解析失败: {e}")
+        if parsing:
+            st.info(f"正在解析书籍结构... 已识别 {len(st.session_state.book_chapters)} 个章节，可先选择已解析的章节开始制作")
+
     # --- 2. 章节选择与生成 ---
+    start_clicked = False
     if st.session_state.book_chapters:
         chapters = st.session_state.book_chapters
-        chapter_titles = [f"{i + 1}. {c.title}" for i, c in enumerate(chapters)]
 
+        # 解析过程中选项列表会变长，手动保存选择，避免控件重建时丢失
         selected_indices = st.multiselect(
             "📜 请选择要生成的章节 (支持多选)",
             options=list(range(len(chapters))),
-            format_func=lambda x: chapter_titles[x]
+            default=st.session_state.get("selected_chapters", []),
+            format_func=lambda x: f"{x + 1}. {chapters.title(x)}"
         )
+        st.session_state.selected_chapters = selected_indices
 
-        if st.button("🎬 开始制作有声剧") and selected_indices:
+        start_clicked = st.button("🎬 开始制作有声剧")
+        if start_clicked and selected_indices:
             if use_ai and not api_key:
                 st.error("请先在侧边栏配置 API Key")
                 st.stop()
 
             # 准备工作
-            director = AIDirector(api_key, base_url, model_name) if use_ai else None
-
-            # --- 主处理循环 ---
+            director_cache = get_director_cache()
+            director = AIDirector(
+                api_key, base_url, model_name, cache=director_cache, max_concurrency=ai_concurrency
+            ) if use_ai else None
+
+            tts_cache = get_tts_cache()
+
+            # 断点续跑：同一本书 + 相同导演设置复用同一个任务清单
+            job_settings = {
+                "use_ai": use_ai,
+                "model": model_name if use_ai else None,
+                "prompt": director.prompt_version if use_ai else None,
+                "segmenter": segmenter_settings(),
+                "loader": loader_version(),
+            }
+            manifest = JobManifest(JobManifest.make_job_id(st.session_state.book_fingerprint, job_settings))
+            resumed = manifest.summary()
+            if resumed.get("done"):
+                st.info(f"检测到未完成的任务，已完成 {resumed['done']} 个音频片段，将从中断处继续。")
+
+            # --- 主处理循环 (每章录完立即在进程池中渲染) ---
+            job_metrics = Metrics(output_name)
+            output_filename = f"{output_name}.{output_format}"
+            renderer = ChapterRenderer(output_filename, output_format)
             try:
-                final_audio_files = asyncio.run(
-                    process_generation(chapters, selected_indices, use_ai, director, ai_concurrency)
-                )
+                with activate(job_metrics):
+                    final_audio_files = asyncio.run(
+                        process_generation(chapters, selected_indices, use_ai, director, tts_cache,
+                                           batch_token_budget, stream_director, manifest, StreamlitReporter(),
+                                           spool_audio=spool_audio,
+                                           on_chapter_done=lambda idx, files: renderer.submit(
+                                               idx, chapters.title(selected_indices[idx]), files))
+                    )
             except Exception as e:
+                renderer.cancel()
                 st.error(f"生成过程中发生错误: {e}")
                 # 打印完整堆栈方便调试
                 import traceback
                 st.code(traceback.format_exc())
                 st.stop()
 
+            cache_stats = tts_cache.stats()
+            st.caption(
+                f"TTS 缓存: 命中 {cache_stats['hits']} / 未命中 {cache_stats['misses']} "
+                f"(命中率 {cache_stats['hit_rate']:.0%})"
+            )
+            if use_ai:
+                director_stats = director_cache.stats()
+                st.caption(
+                    f"剧本缓存: 命中 {director_stats['hits']} / 未命中 {director_stats['misses']} "
+                    f"(命中率 {director_stats['hit_rate']:.0%})"
+                )
+
             # --- 3. 最终合并 ---
             if final_audio_files:
                 st.text("正在合成最终母带 (Rendering)...")
-                output_filename = output_name + '.mp3'
-                final_path = merge_audio_files(final_audio_files, output_filename)
+                with activate(job_metrics):
+                    rendered = render_book(renderer, output_name)
+                final_path = rendered["output"]
 
+                manifest.set_meta("output", final_path)
                 st.success("✨ 制作完成！")
-                st.audio(final_path)
+                st.audio(final_path, format=AUDIO_MIME_TYPES[output_format])
                 with open(final_path, "rb") as f:
                     st.download_button("⬇️ 下载有声剧", f, file_name=output_filename)
+                st.caption(f"逐章 MP3 ({len(rendered['chapters'])} 章) 已保存到 {renderer.chapter_dir}")
             else:
+                renderer.cancel()
                 st.warning("未能生成任何音频，请检查文本内容。")
 
-    clear_temp_folder()
+            show_metrics(job_metrics, manifest.job_dir)
+
+    # 还有章节未解析完时继续下一段 (刚完成生成时保留结果页面，等用户下次操作再继续)
+    if parsing and not start_clicked:
+        st.rerun()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+"""
+章节标题匹配基准：对比逐个 re.match 七个模式 (旧实现) 与合并预编译匹配器的吞吐。
+
+用法: python benchmarks/bench_chapter_matcher.py [大小MB，默认 50]
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.book_loader import BookLoader  # noqa: E402
+
+SENTENCES = [
+    "他推开门，屋里一片漆黑，只有窗外透进来的一点月光。",
+    "“你终于来了。”老人缓缓抬起头，声音沙哑。",
+    "第二天一早，镇上的人都在议论昨晚发生的事情。",
+    "The rain kept falling as she walked down the empty street.",
+    "Chapter after chapter, the story unfolded in ways no one expected.",
+    "三年之后，他再次回到了这座城市。",
+    "作为一名剑客，他从未想过会有这样一天。",
+    "1999年的夏天格外炎热，蝉鸣声此起彼伏。",
+]
+TITLES = ["第{n}章 风起云涌", "Chapter {n}: The Beginning", "{n} 故事开始", "番外 {n}", "Part II", "后记"]
+
+# 重构前 BookLoader.CHAPTER_PATTERNS 的模式列表
+LEGACY_CHAPTER_PATTERNS = [
+    r'(^第[0-9一二三四五六七八九十百千]+[章|节|回|卷|部|篇].*)',
+    r'(^Chapter\s+\d+.*)',
+    r'(^Part\s+[One|Two|Three|I|II|III|IV|V|VI].*)',
+    r'(^[0-9一二三四五六七八九十百]+\s+[\u4e00-\u9fa5]{2,})',
+    r'(^前言|^序言|^引子|^楔子|^尾声|^后记|^番外|^终章|^结语|^Prologue|^Epilogue|^Introduction|^Preface)',
+    r'(^目录|^Table of Contents)',
+    r'(^作者.*|^致谢.*)'
+]
+
+
+def make_lines(size_mb, seed=42):
+    rng = random.Random(seed)
+    lines = []
+    size = 0
+    target = size_mb * 1024 * 1024
+    n = 0
+    while size < target:
+        if rng.random() < 0.01:
+            n += 1
+            line = rng.choice(TITLES).format(n=n)
+        else:
+            line = "".join(rng.choice(SENTENCES) for _ in range(rng.randint(1, 6)))
+        lines.append(line)
+        size += len(line.encode("utf-8")) + 1
+    return lines, size
+
+
+def legacy_is_chapter_title(text, custom_titles=None):
+    """重构前的实现：每行逐个 re.match 所有模式"""
+    text = text.strip()
+    if not text:
+        return False
+    if custom_titles and text in custom_titles:
+        return True
+    if len(text) > 50:
+        return False
+    for pattern in LEGACY_CHAPTER_PATTERNS:
+        if re.match(pattern, text, re.IGNORECASE):
+            return True
+    return False
+
+
+def run(label, func, lines, size):
+    start = time.perf_counter()
+    results = [func(line) for line in lines]
+    elapsed = time.perf_counter() - start
+    mb = size / 1024 / 1024
+    print(f"{label:<10} {elapsed:8.3f}s  {len(lines) / elapsed:>12,.0f} 行/秒  {elapsed * 1000 / mb:8.2f} ms/MB")
+    return results
+
+
+def main():
+    size_mb = float(sys.argv[1]) if len(sys.argv) > 1 else 50
+    lines, size = make_lines(size_mb)
+    print(f"合成文本: {size / 1024 / 1024:.1f} MB, {len(lines):,} 行")
+
+    before = run("逐个匹配", legacy_is_chapter_title, lines, size)
+    after = run("合并匹配", BookLoader._is_chapter_title, lines, size)
+    assert before == after, "新旧匹配结果不一致"
+    print(f"识别出 {sum(after):,} 个标题，新旧结果一致")
+
+
+if __name__ == "__main__":
+    main()
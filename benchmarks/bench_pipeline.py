@@ -0,0 +1,231 @@
+"""
+端到端基准：合成书籍 -> 解析 -> AI 导演 (本地假 LLM) -> TTS (假 edge_tts) -> 拼接。
+每个用例在独立子进程和临时工作目录中运行，峰值 RSS 互不干扰；结果写成 JSON，便于对比回归。
+
+用法:
+    python benchmarks/bench_pipeline.py --formats txt epub --sizes small medium
+    python benchmarks/bench_pipeline.py --llm-concurrency 8 --tts-error-rate 0.02 --compare old.json
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import books  # noqa: E402
+from fakes import BackendProfile, FakeLLMServer, make_fake_communicate  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+# 对比时超过该比例的变差视为回归
+REGRESSION_THRESHOLD = 0.10
+# 越小越好的指标
+COMPARED_METRICS = ("parse_s", "pipeline_s", "merge_s", "total_s", "peak_rss_mb", "llm_calls", "tts_calls")
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 计，macOS 以字节计
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(book_path, options):
+    """在子进程中执行一个完整用例，返回指标"""
+    import edge_tts
+
+    from src.ai_director import AIDirector
+    from src.book_loader import BookLoader
+    from src.chapter_render import ChapterRenderer
+    from src.job_manifest import JobManifest
+    from src.metrics import Metrics, activate
+    from src.pipeline import process_generation
+
+    book_path = os.path.abspath(book_path)
+    os.chdir(tempfile.mkdtemp(prefix="book2voice-bench-"))
+    tts_profile = BackendProfile(**options["tts"])
+    edge_tts.Communicate = make_fake_communicate(tts_profile)
+
+    job_metrics = Metrics(os.path.basename(book_path))
+    with FakeLLMServer(BackendProfile(**options["llm"])) as server, activate(job_metrics):
+        started = time.perf_counter()
+        with open(book_path, "rb") as f:
+            chapters = BookLoader.load_book(f)
+        parse_s = time.perf_counter() - started
+
+        use_ai = not options["no_ai"]
+        director = AIDirector("bench", server.base_url, "bench", max_concurrency=options["llm_budget"]) \
+            if use_ai else None
+        with open(book_path, "rb") as f:
+            book_fingerprint = JobManifest.fingerprint_bytes(f.read())
+        manifest = JobManifest(JobManifest.make_job_id(book_fingerprint, {"bench": True}))
+
+        renderer = ChapterRenderer(f"bench_output.{options['format']}", options["format"])
+        pipeline_started = time.perf_counter()
+        audio_files = asyncio.run(process_generation(
+            chapters, list(range(len(chapters))), use_ai, director, None,
+            options["batch_tokens"], options["stream"], manifest, spool_audio=options["spool"],
+            on_chapter_done=lambda idx, files: renderer.submit(idx, chapters[idx].title, files)
+        ))
+        pipeline_s = time.perf_counter() - pipeline_started
+
+        # 章节在生成过程中已陆续渲染，这里只剩最后几章与封装
+        merge_started = time.perf_counter()
+        output = renderer.finish(title="bench")["output"]
+        merge_s = time.perf_counter() - merge_started
+
+    return {
+        "chapters": len(chapters),
+        "chars": sum(len(c.content) for c in chapters),
+        "segments": len(audio_files),
+        "parse_s": round(parse_s, 3),
+        "pipeline_s": round(pipeline_s, 3),
+        "merge_s": round(merge_s, 3),
+        "total_s": round(time.perf_counter() - started, 3),
+        "llm_calls": server.profile.calls,
+        "llm": server.profile.stats(),
+        "tts_calls": tts_profile.calls,
+        "tts": tts_profile.stats(),
+        "output_bytes": os.path.getsize(output),
+        "peak_rss_mb": _peak_rss_mb(),
+        "metrics": job_metrics.summary(),
+        "trace": os.path.abspath(job_metrics.write(manifest.job_dir)[1]),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """与基线结果逐项对比，打印变化并返回回归项列表"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {case["case"]: case for case in json.load(f)["cases"]}
+
+    regressions = []
+    print(f"\n与基线对比: {baseline_path}")
+    for case in results["cases"]:
+        old = baseline.get(case["case"])
+        if old is None or "error" in case or "error" in old:
+            continue
+        cells = []
+        for metric in COMPARED_METRICS:
+            before, after = old.get(metric), case.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            mark = "  ⚠️" if change > REGRESSION_THRESHOLD else ""
+            cells.append(f"{metric} {before} -> {after} ({change:+.0%}){mark}")
+            if mark:
+                regressions.append((case["case"], metric, before, after))
+        print(f"  {case['case']}:\n    " + "\n    ".join(cells))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="book2voice 端到端基准 (本地假 LLM / TTS)")
+    parser.add_argument("--formats", nargs="+", default=list(books.FORMATS), choices=books.FORMATS)
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium"], choices=list(books.SIZES))
+    parser.add_argument("--books-dir", default=os.path.join(tempfile.gettempdir(), "book2voice-bench-books"))
+    parser.add_argument("--output", help="结果 JSON 路径 (默认 benchmarks/results/pipeline-<时间>.json)")
+    parser.add_argument("--compare", help="用于对比的基线结果 JSON")
+    parser.add_argument("--no-ai", action="store_true", help="不经过 AI 导演 (纯旁白)")
+    parser.add_argument("--stream", action="store_true", help="流式导演")
+    parser.add_argument("--batch-tokens", type=int, default=None, help="批量导演的 token 预算")
+    parser.add_argument("--spool", action="store_true", help="TTS 音频写入假脱机文件")
+    parser.add_argument("--format", default="mp3", choices=("mp3", "mka", "m4b"), help="成书格式")
+    parser.add_argument("--llm-budget", type=int, default=32, help="AI 并发上限")
+    for prefix, latency in (("llm", 0.3), ("tts", 0.1)):
+        parser.add_argument(f"--{prefix}-latency", type=float, default=latency, help="单次调用耗时 (秒)")
+        parser.add_argument(f"--{prefix}-jitter", type=float, default=latency / 3, help="耗时抖动 (秒)")
+        parser.add_argument(f"--{prefix}-error-rate", type=float, default=0.0, help="5xx 错误概率")
+        parser.add_argument(f"--{prefix}-concurrency", type=int, default=0, help="服务端并发上限，超出返回 429")
+        parser.add_argument(f"--{prefix}-rpm", type=int, default=0, help="每分钟请求上限")
+    return parser.parse_args(argv)
+
+
+def _profile_options(args, prefix):
+    return {
+        "latency": getattr(args, f"{prefix}_latency"),
+        "jitter": getattr(args, f"{prefix}_jitter"),
+        "error_rate": getattr(args, f"{prefix}_error_rate"),
+        "max_concurrency": getattr(args, f"{prefix}_concurrency"),
+        "rpm": getattr(args, f"{prefix}_rpm"),
+        "seed": 1,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {
+        "no_ai": args.no_ai,
+        "stream": args.stream,
+        "batch_tokens": args.batch_tokens,
+        "spool": args.spool,
+        "format": args.format,
+        "llm_budget": args.llm_budget,
+        "llm": _profile_options(args, "llm"),
+        "tts": _profile_options(args, "tts"),
+    }
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": options,
+        "cases": [],
+    }
+
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        for fmt in args.formats:
+            name = f"{fmt}/{size}"
+            book_path = books.ensure_book(args.books_dir, fmt, size)
+            print(f"▶ {name} ({os.path.getsize(book_path) / 1024:.0f} KB)", flush=True)
+            # 每个用例一个全新进程，保证峰值 RSS 只属于该用例
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                try:
+                    metrics = pool.submit(run_case, book_path, options).result()
+                except Exception as e:
+                    metrics = {"error": repr(e)}
+            results["cases"].append({"case": name, **metrics})
+            if "error" in metrics:
+                print(f"  失败: {metrics['error']}")
+            else:
+                print(f"  解析 {metrics['parse_s']}s | 流水线 {metrics['pipeline_s']}s | 拼接 {metrics['merge_s']}s"
+                      f" | LLM {metrics['llm_calls']} 次 | TTS {metrics['tts_calls']} 次"
+                      f" | 峰值 RSS {metrics['peak_rss_mb']} MB")
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare)
+        if regressions:
+            print(f"发现 {len(regressions)} 项回归 (变差超过 {REGRESSION_THRESHOLD:.0%})")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
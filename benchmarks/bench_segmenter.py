@@ -0,0 +1,89 @@
+"""
+切分基准：对比固定 800 字切片与按句切分 + 预算打包的片段数、请求数与断句质量。
+
+用法: python benchmarks/bench_segmenter.py [书籍文件 ...]
+不给文件时使用合成的对白小说文本。
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.book_loader import BookLoader, Chapter  # noqa: E402
+from src.segmenter import SENTENCE_ENDS, CLOSE_QUOTES, director_segments, split_script_item  # noqa: E402
+
+LEGACY_SLICE_SIZE = 800
+
+NARRATION = [
+    "夜色渐深，街上的行人越来越少。",
+    "他站在窗前，望着远处的灯火出神，心里盘算着明天的事情。",
+    "风从山谷里吹来，带着潮湿的泥土气息。",
+    "The old house creaked as the wind pushed against its walls.",
+]
+DIALOGUE = [
+    "“你真的要走吗？”她低声问道，“外面这么冷。”",
+    "“我没有选择。”他摇了摇头，“这件事必须今晚解决！”",
+    "“等等……你听到了吗？”",
+    "\"Are you sure about this?\" she asked. \"There is no going back.\"",
+]
+
+
+def synthetic_chapters(count=40, seed=7):
+    rng = random.Random(seed)
+    chapters = []
+    for i in range(count):
+        paragraphs = []
+        for _ in range(rng.randint(60, 160)):
+            pool = DIALOGUE if rng.random() < 0.4 else NARRATION
+            paragraphs.append("".join(rng.choice(pool) for _ in range(rng.randint(1, 4))))
+        chapters.append(Chapter(title=f"第{i + 1}章", content="\n".join(paragraphs)))
+    return chapters
+
+
+def legacy_slices(text):
+    return [text[i:i + LEGACY_SLICE_SIZE] for i in range(0, len(text), LEGACY_SLICE_SIZE)]
+
+
+def cuts_mid_sentence(segment):
+    tail = segment.rstrip()
+    return bool(tail) and tail[-1] not in SENTENCE_ENDS and tail[-1] not in CLOSE_QUOTES and tail[-1] not in '."'
+
+
+def report(name, chapters):
+    old = [legacy_slices(c.content) for c in chapters]
+    start = time.perf_counter()
+    new = [director_segments(c.content) for c in chapters]
+    elapsed = time.perf_counter() - start
+
+    old_flat = [s for chapter in old for s in chapter]
+    new_flat = [s for chapter in new for s in chapter]
+    # 纯旁白模式下每个片段即一个 TTS 条目，超长条目会被拆成多次请求
+    new_tts = sum(len(split_script_item({"text": s})) for s in new_flat)
+    chars = sum(len(c.content) for c in chapters)
+
+    print(f"== {name}: {len(chapters)} 章, {chars:,} 字, 切分耗时 {elapsed * 1000:.1f} ms")
+    print(f"{'':12}{'片段/章':>10}{'LLM 请求':>10}{'TTS 请求':>10}{'平均字数':>10}{'断在句中':>10}")
+    for label, per_chapter, flat, tts in [
+        ("固定 800 字", old, old_flat, len(old_flat)),
+        ("按句打包", new, new_flat, new_tts),
+    ]:
+        broken = sum(1 for s in flat if cuts_mid_sentence(s))
+        print(f"{label:12}{statistics.mean(len(c) for c in per_chapter):>10.1f}{len(flat):>10}{tts:>10}"
+              f"{statistics.mean(len(s) for s in flat):>10.0f}{broken / len(flat):>10.0%}")
+
+
+def main():
+    paths = sys.argv[1:]
+    if not paths:
+        report("合成对白小说", synthetic_chapters())
+        return
+    for path in paths:
+        with open(path, "rb") as f:
+            report(os.path.basename(path), BookLoader.load_book(f))
+
+
+if __name__ == "__main__":
+    main()
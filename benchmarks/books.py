@@ -0,0 +1,114 @@
+"""
+生成基准测试用的合成书籍 (TXT / EPUB / DOCX / PDF)，内容为带对白的中文小说。
+相同参数 (格式、章节数、每章字数、随机种子) 总是生成完全相同的文件。
+"""
+import os
+import random
+
+import docx
+import fitz  # PyMuPDF
+from ebooklib import epub
+
+NARRATION = [
+    "夜色渐深，街上的行人越来越少。",
+    "他站在窗前，望着远处的灯火出神，心里盘算着明天的事情。",
+    "风从山谷里吹来，带着潮湿的泥土气息。",
+    "屋檐下的灯笼被吹得左右摇晃，投下斑驳的影子。",
+    "远处传来几声犬吠，随即又归于沉寂。",
+]
+DIALOGUE = [
+    "“你真的要走吗？”她低声问道，“外面这么冷。”",
+    "“我没有选择。”他摇了摇头，“这件事必须今晚解决！”",
+    "“等等……你听到了吗？”",
+    "“别怕，有我在。”",
+]
+
+# 预设规模：(章节数, 每章字数)
+SIZES = {
+    "small": (10, 2000),
+    "medium": (60, 4000),
+    "large": (300, 6000),
+}
+FORMATS = ("txt", "epub", "docx", "pdf")
+
+
+def make_chapters(chapter_count, chars_per_chapter, seed=1):
+    """返回 [(标题, [段落, ...]), ...]"""
+    rng = random.Random(seed)
+    chapters = []
+    for i in range(chapter_count):
+        paragraphs, length = [], 0
+        while length < chars_per_chapter:
+            pool = DIALOGUE if rng.random() < 0.35 else NARRATION
+            paragraph = "".join(rng.choice(pool) for _ in range(rng.randint(1, 4)))
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+        chapters.append((f"第{i + 1}章 风起之时", paragraphs))
+    return chapters
+
+
+def write_txt(chapters, path):
+    with open(path, "w", encoding="utf-8") as f:
+        for title, paragraphs in chapters:
+            f.write(title + "\n")
+            f.write("\n".join(paragraphs) + "\n\n")
+
+
+def write_epub(chapters, path):
+    book = epub.EpubBook()
+    book.set_identifier(os.path.basename(path))
+    book.set_title("基准测试书籍")
+    book.set_language("zh")
+    items = []
+    for i, (title, paragraphs) in enumerate(chapters):
+        item = epub.EpubHtml(title=title, file_name=f"chap_{i:04d}.xhtml", lang="zh")
+        body = "".join(f"<p>{p}</p>" for p in paragraphs)
+        item.content = f"<html><body><h1>{title}</h1>{body}</body></html>"
+        book.add_item(item)
+        items.append(item)
+    book.toc = [epub.Link(item.file_name, title, f"c{i}") for i, (item, (title, _)) in enumerate(zip(items, chapters))]
+    book.add_item(epub.EpubNcx())
+    book.add_item(epub.EpubNav())
+    book.spine = ["nav"] + items
+    epub.write_epub(path, book)
+
+
+def write_docx(chapters, path):
+    document = docx.Document()
+    for title, paragraphs in chapters:
+        document.add_heading(title, level=1)
+        for paragraph in paragraphs:
+            document.add_paragraph(paragraph)
+    document.save(path)
+
+
+def write_pdf(chapters, path, lines_per_page=40, chars_per_line=38):
+    document = fitz.open()
+    toc = []
+    for title, paragraphs in chapters:
+        lines = [title]
+        for paragraph in paragraphs:
+            lines.extend(paragraph[i:i + chars_per_line] for i in range(0, len(paragraph), chars_per_line))
+        toc.append([1, title, document.page_count + 1])
+        for start in range(0, len(lines), lines_per_page):
+            page = document.new_page()
+            page.insert_textbox(fitz.Rect(36, 36, 560, 806), "\n".join(lines[start:start + lines_per_page]),
+                                fontname="china-s", fontsize=11)
+    document.set_toc(toc)
+    document.save(path)
+    document.close()
+
+
+WRITERS = {"txt": write_txt, "epub": write_epub, "docx": write_docx, "pdf": write_pdf}
+
+
+def ensure_book(out_dir, fmt, size, seed=1):
+    """生成 (或复用已生成的) 指定格式与规模的书籍，返回文件路径"""
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, f"bench_{size}_{seed}.{fmt}")
+    if not os.path.exists(path):
+        chapter_count, chars = SIZES[size]
+        tmp_path = path + ".part." + fmt
+        WRITERS[fmt](make_chapters(chapter_count, chars, seed), tmp_path)
+        os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,228 @@
+"""
+基准测试用的本地替身：OpenAI 兼容的假 LLM 服务，以及假 edge_tts 后端。
+两者都支持可配置的延迟、抖动、错误率与限流，并统计调用次数。
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.segmenter import sentence_spans  # noqa: E402
+
+_BATCH_SEGMENT = re.compile(r'<segment id="(\d+)">\n(.*?)\n</segment>', re.S)
+
+
+class BackendProfile:
+    """
+    模拟后端的行为参数：
+    latency / jitter 为每次调用的基础耗时与随机抖动 (秒)，error_rate 为 5xx 概率，
+    max_concurrency 为同时处理的请求上限 (超出返回 429)，rpm 为每分钟请求上限 (0 表示不限)，
+    retry_after 为 429 时建议的等待秒数。
+    """
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, max_concurrency=0, rpm=0, retry_after=0.5,
+                 seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._window = []
+        self.calls = 0
+        self.throttled = 0
+        self.errors = 0
+
+    def admit(self):
+        """返回 "ok" / "throttle" / "error"；"ok" 时调用方处理完后需调用 done()"""
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            if self.rpm:
+                self._window = [t for t in self._window if now - t < 60]
+            if (self.max_concurrency and self._in_flight >= self.max_concurrency) or \
+                    (self.rpm and len(self._window) >= self.rpm):
+                self.throttled += 1
+                return "throttle"
+            if self._rng.random() < self.error_rate:
+                self.errors += 1
+                return "error"
+            self._in_flight += 1
+            self._window.append(now)
+            return "ok"
+
+    def done(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    def delay(self):
+        with self._lock:
+            return max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+
+    def stats(self):
+        return {"calls": self.calls, "throttled": self.throttled, "errors": self.errors}
+
+
+def fake_script(text):
+    """把文本按句切成剧本：引号内的对白交给女声，其余为旁白"""
+    script = []
+    for start, end in sentence_spans(text):
+        sentence = text[start:end].strip()
+        if not sentence:
+            continue
+        role = "young_female" if sentence[0] in "“「\"" else "narrator"
+        script.append({"text": sentence, "role": role, "emotion": "neutral", "params": {}})
+    return script
+
+
+class _LLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    profile = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        verdict = self.profile.admit()
+        if verdict == "throttle":
+            self._send_json(429, {"error": {"message": "rate limited"}},
+                            {"Retry-After": str(self.profile.retry_after)})
+            return
+        if verdict == "error":
+            time.sleep(self.profile.delay())
+            self._send_json(500, {"error": {"message": "internal error"}})
+            return
+
+        try:
+            time.sleep(self.profile.delay())
+            user = body["messages"][-1]["content"]
+            segments = _BATCH_SEGMENT.findall(user)
+            if segments:
+                content = {"segments": [{"id": int(i), "script": fake_script(t)} for i, t in segments]}
+            else:
+                content = {"script": fake_script(user.split("\n", 1)[1])}
+            content = json.dumps(content, ensure_ascii=False)
+
+            if body.get("stream"):
+                self._stream(content)
+            else:
+                self._send_json(200, {
+                    "id": "bench", "object": "chat.completion", "created": 0, "model": body.get("model"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+                })
+        finally:
+            self.profile.done()
+
+    def _stream(self, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write(data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        for i in range(0, len(content), 32):
+            event = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "bench",
+                     "choices": [{"index": 0, "delta": {"content": content[i:i + 32]}, "finish_reason": None}]}
+            write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+        write(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeLLMServer:
+    """本地 OpenAI 兼容服务 (/v1/chat/completions)，在后台线程运行"""
+
+    def __init__(self, profile=None, port=0):
+        self.profile = profile or BackendProfile()
+        handler = type("Handler", (_LLMHandler,), {"profile": self.profile})
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/v1"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# --- 假 TTS ---
+
+# MPEG-1 Layer III, 128 kbps, 44.1 kHz, 单声道，帧数据全零 (解码为静音)
+_SILENT_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0]) + bytes(413)
+
+
+def silent_mp3(frames):
+    return _SILENT_FRAME * max(1, frames)
+
+
+class TTSError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def make_fake_communicate(profile, frames_per_char=0.2, max_frames=400):
+    """
+    返回与 edge_tts.Communicate 接口兼容的假实现 (save / stream)。
+    音频为与文本长度成正比的静音 MP3，429 错误带 status 属性，与 edge_tts 的 aiohttp 异常一致。
+    """
+
+    class FakeCommunicate:
+        def __init__(self, text, voice, rate="+0%", pitch="+0Hz", volume="+0%"):
+            self.text = text
+
+        async def _synthesize(self):
+            verdict = profile.admit()
+            if verdict == "throttle":
+                raise TTSError("rate limited", status=429)
+            if verdict == "error":
+                await asyncio.sleep(profile.delay())
+                raise TTSError("service unavailable", status=503)
+            try:
+                await asyncio.sleep(profile.delay())
+            finally:
+                profile.done()
+            return silent_mp3(min(max_frames, int(len(self.text) * frames_per_char) + 1))
+
+        async def save(self, path):
+            data = await self._synthesize()
+            with open(path, "wb") as f:
+                f.write(data)
+
+        async def stream(self):
+            data = await self._synthesize()
+            for i in range(0, len(data), 4096):
+                yield {"type": "audio", "data": data[i:i + 4096]}
+
+    return FakeCommunicate
@@ -1,16 +1,86 @@
-# 这是一个示例 Python 脚本。
+"""
+无界面批处理入口 (不依赖 Streamlit)。
 
-# 按 Shift+F10 执行或将其替换为您的代码。
-# 按 双击 Shift 在所有地方搜索类、文件、工具窗口、操作和设置。
+示例:
+    python main.py books/ -o output_audio/batch --workers 4
+    python main.py books.txt --api-key sk-xxx --tts-budget 32 --llm-budget 16
+    python main.py books/ --queue redis://queue-host:6379/0 --store /mnt/shared/book2voice  (配合 worker.py)
+"""
+import argparse
+import os
+import sys
 
+from dotenv import load_dotenv
 
-def print_hi(name):
-    # 在下面的代码行中使用断点来调试脚本。
-    print(f'Hi, {name}')  # 按 Ctrl+F8 切换断点。
+from src.ai_director import DEFAULT_BATCH_TOKEN_BUDGET
+from src.batch import collect_books, run_batch
+from src.chapter_render import OUTPUT_FORMATS
+from src.config import OUTPUT_DIR, SHARED_STORE_DIR, configure_ffmpeg
 
 
-# 按装订区域中的绿色按钮以运行脚本。
-if __name__ == '__main__':
-    print_hi('PyCharm')
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI 有声书批量制作 (无界面模式)")
+    parser.add_argument("source", help="书籍目录，或书籍清单 (.json 列表 / 每行一个路径的文本文件)")
+    parser.add_argument("-o", "--output-dir", default=os.path.join(OUTPUT_DIR, "batch"), help="输出目录")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="并行处理的书籍数 (进程数)")
+    parser.add_argument("--tts-budget", type=int, default=16, help="所有进程共享的 TTS 并发总数")
+    parser.add_argument("--llm-budget", type=int, default=16, help="所有进程共享的 LLM 并发总数")
+    parser.add_argument("--api-key", default=os.getenv("LLM_API_KEY"),
+                        help="LLM API Key (默认读取 LLM_API_KEY)；不提供则使用纯旁白模式")
+    parser.add_argument("--base-url", default=os.getenv("LLM_BASE_URL", "https://api.deepseek.com"))
+    parser.add_argument("--model", default=os.getenv("LLM_MODEL", "deepseek-chat"))
+    parser.add_argument("--batch-tokens", type=int, nargs="?", const=DEFAULT_BATCH_TOKEN_BUDGET, default=None,
+                        help="启用批量导演，并指定单次请求的文本 token 上限")
+    parser.add_argument("--stream", action="store_true", help="启用流式导演")
+    parser.add_argument("--spool", action="store_true",
+                        help="TTS 音频追加进每个任务的单个假脱机文件，不再逐片段写小文件")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="mp3",
+                        help="成书格式：mp3 单文件，或带章节标记的 mka (MP3 流拷贝) / m4b (AAC)；均另保留逐章 MP3")
+    parser.add_argument("--pdf-shards", type=int, default=None,
+                        help="PDF 并行抽取文本的分片 (进程) 数，默认等于 CPU 核数；1 表示单进程")
+    parser.add_argument("--queue", default=None,
+                        help="分布式模式的任务队列 (SQLite 文件路径或 redis:// 地址)，导演与合成交给 worker.py 节点执行；"
+                             "断点续跑依靠队列中已完成的任务，不使用任务清单")
+    parser.add_argument("--store", default=SHARED_STORE_DIR, help="分布式模式下与 worker 共享的音频存储目录")
+    args = parser.parse_args(argv)
+    if args.queue:
+        # worker 逐片段导演、逐条合成，以下选项在分布式模式下没有对应实现
+        unsupported = [flag for flag, value in (("--batch-tokens", args.batch_tokens), ("--stream", args.stream),
+                                                ("--spool", args.spool)) if value]
+        if unsupported:
+            parser.error(f"分布式模式 (--queue) 不支持 {' / '.join(unsupported)}")
+    return args
 
-# 访问 https://www.jetbrains.com/help/pycharm/ 获取 PyCharm 帮助
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    configure_ffmpeg()
+
+    books = collect_books(args.source)
+    if not books:
+        print(f"未在 {args.source} 中找到支持的书籍文件")
+        return 1
+
+    options = {
+        "api_key": args.api_key,
+        "base_url": args.base_url,
+        "model": args.model,
+        "batch_tokens": args.batch_tokens,
+        "stream": args.stream,
+        "tts_budget": args.tts_budget,
+        "llm_budget": args.llm_budget,
+        "pdf_shards": args.pdf_shards,
+        "spool": args.spool,
+        "format": args.format,
+        "queue": args.queue,
+        "store": args.store,
+    }
+    print(f"共 {len(books)} 本书，{args.workers} 个进程并行处理")
+    summary = run_batch(books, args.output_dir, options, workers=args.workers)
+    print(f"完成 {summary['done']}/{summary['total']}，摘要已写入 {os.path.join(args.output_dir, 'summary.json')}")
+    return 0 if summary["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,21 @@
+import asyncio
 import json
 import os
-from openai import OpenAI
-from tenacity import retry, stop_after_attempt, wait_fixed
+import re
+import sqlite3
+import time
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+from src import metrics
+from src.concurrency import AdaptiveLimiter, backoff_delay, parse_retry_after
+from src.director_cache import prompt_version
+from src.json_stream import JSONArrayStreamParser
+
+# 非 CJK 字符 (码位不超过 U+2E80)，用于估算 token 数
+_NON_CJK = re.compile("[\x00-\u2e80]+")
 
 # 角色定义与 System Prompt
 SYSTEM_PROMPT = """
@@ -38,47 +52,388 @@ SYSTEM_PROMPT = """
 3. 根据上下文语境调整 rate (紧张时快，悲伤时慢) 和 pitch。
 """
 
+# 批量模式追加的说明：一次请求处理多个带编号的片段
+BATCH_PROMPT_SUFFIX = """
+**批量模式**:
+输入会包含多个片段，格式为 <segment id="编号">文本</segment>。
+请逐个片段独立生成剧本，不得合并、拆分或遗漏片段，并输出如下 JSON 对象：
+{"segments": [{"id": 编号, "script": [ ...该片段的剧本列表... ]}]}
+"""
+
+# 批量请求中每个片段的输入 token 预算 (不含 System Prompt)
+DEFAULT_BATCH_TOKEN_BUDGET = 3000
+
+# 异步路径的最大尝试次数 (限流 / 5xx / 网络错误 / JSON 解析失败都会重试)
+MAX_ATTEMPTS = 4
+
+
+# 条目末尾可能残留的标点与右引号 (定位剩余文本时跳过)
+_TRAILING_MARKS = "。！？!?…”’」』）》，,、；;：:. \n"
+
 
 class AIDirector:
-    def __init__(self, api_key, base_url, model_name="deepseek-chat"):
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+    def __init__(self, api_key, base_url, model_name="deepseek-chat", temperature=0.3, cache=None,
+                 max_concurrency=32, shared_slots=None):
+        self.api_key = api_key
+        self.base_url = base_url
         self.model_name = model_name
+        self.temperature = temperature
+        # 可选的持久化结果缓存 (DirectorCache)
+        self.cache = cache
+        # 单片段与批量模式的结果等价，共用同一缓存；任一提示词变化都会让缓存失效
+        self.prompt_version = prompt_version(SYSTEM_PROMPT + BATCH_PROMPT_SUFFIX)
+        # 自适应并发：从小并发起步，成功时增长，限流时回退，max_concurrency 仅作上限
+        # shared_slots (SharedSlots) 用于多进程批处理时共享全局 LLM 并发预算
+        self.limiter = AdaptiveLimiter(
+            initial=min(4, max_concurrency), max_limit=max_concurrency, shared=shared_slots
+        )
+        self._async_client = None
+        self._async_loop = None
+
+    def settings(self):
+        """决定导演结果的设置 (模型、温度、提示词版本)，分布式模式下随任务下发给 worker"""
+        return {"model": self.model_name, "temperature": self.temperature, "prompt": self.prompt_version}
+
+    @staticmethod
+    def estimate_tokens(text):
+        """粗略估算 token 数：中文约 1 字 1 token，其余字符约 4 个 1 token"""
+        cjk = len(_NON_CJK.sub("", text))
+        return cjk + (len(text) - cjk) // 4 + 1
+
+    @staticmethod
+    def pack_batches(text_segments, token_budget=DEFAULT_BATCH_TOKEN_BUDGET):
+        """按 token 预算将片段序号打包成若干批，单个超预算的片段独占一批"""
+        batches = []
+        current, used = [], 0
+        for i, segment in enumerate(text_segments):
+            cost = AIDirector.estimate_tokens(segment)
+            if current and used + cost > token_budget:
+                batches.append(current)
+                current, used = [], 0
+            current.append(i)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def _scene_messages(text_segment):
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": f"请处理以下文本：\n{text_segment}"}
+        ]
+
+    @staticmethod
+    def _batch_messages(segments_by_id):
+        body = "\n".join(
+            f'<segment id="{seg_id}">\n{text}\n</segment>' for seg_id, text in segments_by_id.items()
+        )
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT + BATCH_PROMPT_SUFFIX},
+            {"role": "user", "content": f"请分别处理以下 {len(segments_by_id)} 个片段：\n{body}"}
+        ]
+
+    @staticmethod
+    def _parse_script(content):
+        """解析单片段剧本，格式不符时抛出异常"""
+        # 清理可能存在的 markdown 标记
+        content = content.replace("```json", "").replace("```", "")
+
+        script = json.loads(content)
+        # 兼容处理：有时候 LLM 会把 list 包在一个 key 里
+        if isinstance(script, dict):
+            for key in script:
+                if isinstance(script[key], list):
+                    script = script[key]
+                    break
+
+        if not isinstance(script, list):
+            raise ValueError("LLM 返回的剧本不是 JSON 列表")
+        return script
+
+    @staticmethod
+    def _parse_batch(content, segment_ids):
+        """解析批量结果，返回 {片段编号: 剧本列表}，缺失或格式不符的片段不出现在结果中"""
+        content = content.replace("```json", "").replace("```", "")
+        data = json.loads(content)
+        entries = data.get("segments", []) if isinstance(data, dict) else data
+
+        scripts = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                seg_id = int(entry.get("id"))
+            except (TypeError, ValueError):
+                continue
+            script = entry.get("script")
+            if seg_id in segment_ids and isinstance(script, list):
+                scripts[seg_id] = script
+        return scripts
+
+    @staticmethod
+    def _fallback_script(text_segment):
+        # 降级策略：如果 AI 失败，返回默认旁白模式 (降级结果不写入缓存)
+        metrics.inc("llm_fallbacks_total")
+        return [{
+            "text": text_segment,
+            "role": "narrator",
+            "params": {"rate": "+0%", "pitch": "+0Hz"}
+        }]
+
+    def _cache_key(self, text_segment):
+        return self.cache.make_key(text_segment, self.model_name, self.temperature, self.prompt_version)
+
+    def _cache_lookup(self, text_segment):
+        """返回 (cache_key, 缓存剧本)；未启用缓存时两者均为 None"""
+        # 每个交给导演的片段都会经过这里，顺便统计导演阶段的吞吐
+        metrics.inc("llm_chars_total", len(text_segment))
+        if self.cache is None:
+            return None, None
+        cache_key = self._cache_key(text_segment)
+        cached = self.cache.get(cache_key)
+        metrics.inc("llm_cache_hits_total" if cached is not None else "llm_cache_misses_total")
+        return cache_key, cached
+
+    def _cache_store(self, cache_key, script):
+        if cache_key is None:
+            return
+        try:
+            self.cache.put(cache_key, script, self.model_name, self.prompt_version)
+        except sqlite3.Error as e:
+            # 剧本已经取得，缓存写入失败 (如多进程争用写锁超时) 不影响本次导演结果
+            print(f"Director Cache write error: {e}")
+            metrics.inc("llm_cache_write_errors_total")
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(2))
-    def direct_scene(self, text_segment):
+    # --- 异步接口 (流水线使用) ---
+    def _get_async_client(self):
         """
-        调用 LLM 对文本片段进行导演标注
+        AsyncOpenAI 客户端复用同一个连接池；连接池与事件循环绑定，
+        因此每个新的事件循环 (每次 asyncio.run) 重建一次。
         """
-        try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": f"请处理以下文本：\n{text_segment}"}
-                ],
-                temperature=0.3,
-                response_format={"type": "json_object"}  # 如果模型支持
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            pool_size = self.limiter.max_limit
+            self._async_client = AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                max_retries=0,  # 重试与退避由自适应控制器负责
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+                ),
             )
+            self._async_loop = loop
+        return self._async_client
+
+    async def _acomplete(self, messages, stream=False):
+        """
+        在自适应并发控制下发起一次补全请求。
+        429 按 Retry-After 暂停并减半并发；5xx 与网络错误退避重试；其余错误直接抛出。
+        流式请求成功返回时仍占用并发名额，由调用方读完后 release。
+        """
+        client = self._get_async_client()
+        mode = "stream" if stream else "complete"
+        for attempt in range(MAX_ATTEMPTS):
+            await self.limiter.acquire()
+            started = time.perf_counter()
+            holding = False
+            outcome = "error"
+            metrics.add_in_flight("llm_in_flight", 1)
+            try:
+                response = await client.chat.completions.create(
+                    model=self.model_name,
+                    messages=messages,
+                    temperature=self.temperature,
+                    response_format={"type": "json_object"},
+                    stream=stream
+                )
+            except RateLimitError as e:
+                self.limiter.on_throttle(parse_retry_after(e.response.headers))
+                outcome = "throttled"
+                error = e
+            except APIStatusError as e:
+                if e.status_code < 500:
+                    outcome = "client_error"
+                    raise
+                self.limiter.on_error()
+                outcome = "server_error"
+                error = e
+            except (APIConnectionError, APITimeoutError) as e:
+                self.limiter.on_error()
+                outcome = "network_error"
+                error = e
+            else:
+                # 流式请求以首包时间作为延迟
+                self.limiter.on_success(time.perf_counter() - started)
+                outcome = "ok"
+                holding = stream
+                return response
+            finally:
+                # 流式请求的区间同样只到首包为止
+                metrics.finish("llm_request_seconds", "llm.request", started, mode=mode,
+                               attempt=attempt, outcome=outcome)
+                metrics.inc("llm_requests_total", mode=mode, outcome=outcome)
+                metrics.add_in_flight("llm_in_flight", -1)
+                if not holding:
+                    self.limiter.release()
 
-            content = response.choices[0].message.content
-            # 清理可能存在的 markdown 标记
-            content = content.replace("```json", "").replace("```", "")
+            if attempt + 1 < MAX_ATTEMPTS:
+                metrics.inc("llm_retries_total", reason=outcome)
+                await asyncio.sleep(backoff_delay(attempt))
+        raise error
 
-            script = json.loads(content)
-            # 兼容处理：有时候 LLM 会把 list 包在一个 key 里
-            if isinstance(script, dict):
-                for key in script:
-                    if isinstance(script[key], list):
-                        script = script[key]
-                        break
+    async def _arequest_script(self, text_segment):
+        last_error = None
+        for _ in range(2):
+            response = await self._acomplete(self._scene_messages(text_segment))
+            try:
+                return self._parse_script(response.choices[0].message.content)
+            except (ValueError, TypeError) as e:
+                # 输出格式错误：重新生成一次
+                metrics.inc("llm_retries_total", reason="invalid_json")
+                last_error = e
+        raise last_error
 
-            return script
+    async def adirect_scene(self, text_segment, fallback=True):
+        """
+        导演单个片段：原生异步请求 + 自适应并发。
+        fallback 为 False 时重试耗尽直接抛出异常，不降级为旁白 (由调用方决定如何重试)
+        """
+        with metrics.span("direct_scene_seconds", "llm", mode="scene", chars=len(text_segment)) as labels:
+            cache_key, cached = self._cache_lookup(text_segment)
+            if cached is not None:
+                labels["outcome"] = "cached"
+                return cached
+            labels["outcome"] = "directed"
+            return await self._adirect_uncached(text_segment, cache_key, fallback)
 
+    async def _adirect_uncached(self, text_segment, cache_key=None, fallback=True):
+        try:
+            script = await self._arequest_script(text_segment)
         except Exception as e:
             print(f"LLM Processing Error: {e}")
-            # 降级策略：如果 AI 失败，返回默认旁白模式
-            return [{
-                "text": text_segment,
-                "role": "narrator",
-                "params": {"rate": "+0%", "pitch": "+0Hz"}
-            }]
+            if not fallback:
+                raise
+            return self._fallback_script(text_segment)
+
+        self._cache_store(cache_key, script)
+        return script
+
+    async def astream_scene(self, text_segment):
+        """
+        流式导演：使用流式补全 + 增量 JSON 解析，每个剧本条目闭合后立即 yield，
+        让 TTS 在整段补全结束前就能开始。流式失败时回退到非流式路径。
+        """
+        with metrics.span("direct_scene_seconds", "llm", mode="stream", chars=len(text_segment)):
+            cache_key, cached = self._cache_lookup(text_segment)
+            if cached is not None:
+                for item in cached:
+                    yield item
+                return
+
+            emitted = []
+            try:
+                stream = await self._acomplete(self._scene_messages(text_segment), stream=True)
+                try:
+                    parser = JSONArrayStreamParser()
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        for item in parser.feed(chunk.choices[0].delta.content or ""):
+                            if isinstance(item, dict) and item.get("text"):
+                                emitted.append(item)
+                                yield item
+                finally:
+                    self.limiter.release()
+                if not parser.done:
+                    raise ValueError("流式输出中断，JSON 数组未闭合")
+            except Exception as e:
+                print(f"LLM Streaming Error: {e}")
+                if not emitted:
+                    # 尚未输出任何条目：整段回退到非流式路径 (含重试与旁白降级)
+                    for item in await self._adirect_uncached(text_segment, cache_key):
+                        yield item
+                    return
+                # 已输出部分条目：剩余文本用旁白补齐，且不写入缓存
+                tail, located = self._uncovered_tail(text_segment, emitted)
+                if not located:
+                    # 已输出的条目在原文中定位不到 (LLM 改写了文字)，无法判断覆盖到哪里：
+                    # 改走非流式路径，只输出已输出条目之后的部分；仍不行时从最后定位到的位置起用旁白补齐
+                    metrics.inc("llm_stream_tail_unmatched_total")
+                    try:
+                        script = await self._adirect_uncached(text_segment, cache_key, fallback=False)
+                    except Exception:
+                        script = []
+                    if len(script) > len(emitted):
+                        for item in script[len(emitted):]:
+                            yield item
+                        return
+                if tail:
+                    yield self._fallback_script(tail)[0]
+                return
+
+            if emitted:
+                self._cache_store(cache_key, emitted)
+
+    @staticmethod
+    def _uncovered_tail(text_segment, emitted):
+        """
+        按顺序在原文中定位已输出的条目，返回 (其后尚未覆盖的文本, 是否全部定位成功)。
+        比较时忽略标点与空白 (LLM 常改写引号、增删空格)；某个条目定位失败时，文本从最后一个定位成功的条目之后算起。
+        """
+        positions = [i for i, ch in enumerate(text_segment) if ch.isalnum()]
+        normalized = "".join(text_segment[i] for i in positions)
+        pos = 0
+        located = True
+        for item in emitted:
+            text = "".join(ch for ch in str(item.get("text", "")) if ch.isalnum())
+            found = normalized.find(text, pos)
+            if found < 0:
+                located = False
+                break
+            pos = found + len(text)
+        start = positions[pos - 1] + 1 if pos else 0
+        # 紧跟在已输出条目之后的句末标点与右引号属于该条目
+        return text_segment[start:].lstrip(_TRAILING_MARKS).strip(), located
+
+    async def adirect_batch(self, text_segments, token_budget=DEFAULT_BATCH_TOKEN_BUDGET):
+        """
+        批量导演：把多个片段打包进同一次请求，返回与输入等长的剧本列表。
+        解析失败的批次 (或结果中缺失的片段) 回退到逐片段请求。
+        """
+        results = [None] * len(text_segments)
+        cache_keys = {}
+        pending = []
+        for i, segment in enumerate(text_segments):
+            cache_keys[i], cached = self._cache_lookup(segment)
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.append(i)
+
+        async def run_batch(indices):
+            scripts = {}
+            if len(indices) > 1:
+                segments_by_id = {i: text_segments[i] for i in indices}
+                with metrics.span("direct_batch_seconds", "llm", segments=len(indices)) as labels:
+                    try:
+                        response = await self._acomplete(self._batch_messages(segments_by_id))
+                        scripts = self._parse_batch(response.choices[0].message.content, segments_by_id)
+                    except Exception as e:
+                        print(f"LLM Batch Error ({len(indices)} segments): {e}")
+                    # 结果中缺失的片段会逐个重新请求
+                    labels["outcome"] = "complete" if len(scripts) == len(indices) else "partial"
+                    metrics.inc("llm_batch_segments_total", len(scripts), outcome="returned")
+                    metrics.inc("llm_batch_segments_total", len(indices) - len(scripts), outcome="missing")
+
+            for i in indices:
+                script = scripts.get(i)
+                if script is None:
+                    results[i] = await self._adirect_uncached(text_segments[i], cache_keys[i])
+                else:
+                    results[i] = script
+                    self._cache_store(cache_keys[i], script)
+
+        batches = self.pack_batches([text_segments[i] for i in pending], token_budget)
+        await asyncio.gather(*(run_batch([pending[j] for j in batch]) for batch in batches))
+        return results
@@ -1,6 +1,15 @@
 import edge_tts
 import asyncio
 import os
+import time
+from collections import namedtuple
+
+from src import metrics
+from src.concurrency import AdaptiveLimiter, backoff_delay
+from src.config import TTS_SEGMENT_CHARS
+
+# 单个片段的最大尝试次数 (瞬时错误会带抖动退避重试)
+TTS_MAX_ATTEMPTS = 4
 
 # 角色到 Edge-TTS 声音的映射表
 VOICE_MAP = {
@@ -15,24 +24,130 @@ VOICE_MAP = {
 }
 
 
+class SegmentAddress(namedtuple("SegmentAddress", ["chapter", "slice", "item"])):
+    """
+    片段音频的结构化地址：(书中章节序号, 导演片段序号, 剧本条目序号)。
+    各分量没有位数上限，元组本身可作字典 key、按自然顺序排序，不会像拼接成整数那样互相覆盖。
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        return f"{self.chapter}-{self.slice}-{self.item}"
+
+    def relative_path(self, ext="mp3"):
+        """按章节 / 片段分目录存放，超长的书也不会在单个目录里堆积数十万个文件"""
+        return os.path.join(f"c{self.chapter:05d}", f"s{self.slice:05d}", f"i{self.item:04d}.{ext}")
+
+
+def segment_path(temp_dir, index):
+    """片段音频路径：SegmentAddress 使用分目录布局，整数序号 (单独调用时) 平铺在 temp_dir 下"""
+    if isinstance(index, SegmentAddress):
+        return os.path.join(temp_dir, index.relative_path())
+    return os.path.join(temp_dir, f"seg_{index:05d}.mp3")
+
+
+def voice_signature(segment_data):
+    """条目实际使用的 (voice, rate, pitch, volume)，相同签名的条目听起来完全一致"""
+    params = segment_data.get("params") or {}
+    return (
+        VOICE_MAP.get(segment_data.get("role", "narrator"), VOICE_MAP["narrator"]),
+        params.get("rate", "+0%"),
+        params.get("pitch", "+0Hz"),
+        params.get("volume", "+0%"),
+    )
+
+
+class ScriptCoalescer:
+    """
+    合并相邻且声音签名相同的剧本条目，减少 TTS 请求与临时文件数量。
+    流式使用：逐条 feed，返回已封口的合并单元；结束时 flush 取出最后一个单元。
+    合并单元为 (首条目序号, 覆盖条目数, 合并后的条目)，据此可映射回原始条目。
+    """
+
+    def __init__(self, max_chars=TTS_SEGMENT_CHARS):
+        self.max_chars = max_chars
+        self._first = None
+        self._count = 0
+        self._signature = None
+        self._item = None
+        self._texts = []
+        self._length = 0
+
+    def feed(self, index, item):
+        text = item.get("text", "").strip()
+        if self._item is not None:
+            # 空条目不发声，直接并入当前单元
+            if not text:
+                self._count += 1
+                return []
+            if (voice_signature(item) == self._signature
+                    and self._length + 1 + len(text) <= self.max_chars):
+                self._count += 1
+                self._texts.append(text)
+                self._length += 1 + len(text)
+                return []
+
+        sealed = self.flush()
+        self._first, self._count = index, 1
+        self._signature, self._item = voice_signature(item), item
+        self._texts, self._length = [text], len(text)
+        return sealed
+
+    def flush(self):
+        if self._item is None:
+            return []
+        # 条目之间以换行连接，TTS 会在此自然停顿
+        merged = self._item if self._count == 1 else {**self._item, "text": "\n".join(self._texts)}
+        unit = (self._first, self._count, merged)
+        self._item = None
+        return [unit]
+
+
 class AudioEngine:
-    def __init__(self, temp_dir="temp_audio_chunks"):
+    def __init__(self, temp_dir="temp_audio_chunks", cache=None, concurrency=5, max_concurrency=16,
+                 shared_slots=None, spool=None):
         self.temp_dir = temp_dir
         if not os.path.exists(temp_dir):
             os.makedirs(temp_dir)
-        # 信号量控制并发
-        self.semaphore = asyncio.Semaphore(5)
+        # 自适应并发：根据错误率与延迟在 [1, max_concurrency] 之间调整
+        # shared_slots (SharedSlots) 用于多进程批处理时共享全局 TTS 并发预算
+        self.limiter = AdaptiveLimiter(initial=concurrency, max_limit=max_concurrency, shared=shared_slots)
+        # 可选的持久化 TTS 缓存 (TTSCache)，命中时不再访问网络
+        self.cache = cache
+        # 重试耗尽仍失败的片段: index -> 失败信息
+        self.failures = {}
+        # 未能写入 TTS 缓存的音频 (不影响本次结果，由调用方汇报)
+        self.cache_errors = []
+        # 可选的音频假脱机文件 (AudioSpool)：音频流直接追加进同一个文件，不再逐片段落盘
+        self.spool = spool
+        # 假脱机模式下已生成的片段: index -> 引用
+        self._spooled = {}
+
+    @property
+    def max_concurrency(self):
+        return self.limiter.max_limit
 
     async def generate_segment(self, segment_data, index):
         """
         根据 Script Segment 生成音频
         segment_data: {"text":..., "role":..., "params": {...}}
+        index: 片段标识，SegmentAddress 或整数序号，决定音频文件路径
         """
+        text = segment_data.get("text", "")
+        with metrics.span("tts_segment_seconds", "tts", f"seg {index}", index=index, chars=len(text),
+                          role=segment_data.get("role", "narrator")) as labels:
+            result = await self._generate_segment(segment_data, index, labels)
+        if result is not None:
+            metrics.inc("tts_chars_total", len(text))
+        return result
+
+    async def _generate_segment(self, segment_data, index, labels):
         role = segment_data.get("role", "narrator")
         text = segment_data.get("text", "")
         params = segment_data.get("params", {})
 
         if not text.strip():
+            labels["outcome"] = "empty"
             return None
 
         # 1. 确定 Voice
@@ -43,10 +158,38 @@ class AudioEngine:
         pitch = params.get("pitch", "+0Hz")
         volume = params.get("volume", "+0%")
 
-        # 3. 生成文件名 (保证顺序)
-        output_file = os.path.join(self.temp_dir, f"seg_{index:05d}.mp3")
+        # 3. 生成文件名 (由片段地址决定，互不覆盖)
+        output_file = segment_path(self.temp_dir, index)
+        if self.spool is None:
+            os.makedirs(os.path.dirname(output_file), exist_ok=True)
+
+        # 4. 先查缓存，命中则直接返回
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(text, voice, rate, pitch, volume)
+            if self.spool is not None:
+                data = self.cache.read(cache_key)
+                if data is not None:
+                    metrics.inc("tts_cache_hits_total")
+                    labels["outcome"] = "cached"
+                    return self._spool_result(index, data)
+            elif self.cache.get(cache_key, output_file):
+                metrics.inc("tts_cache_hits_total")
+                labels["outcome"] = "cached"
+                self.failures.pop(index, None)
+                return output_file
+            metrics.inc("tts_cache_misses_total")
 
-        async with self.semaphore:
+        # 5. 合成 (瞬时错误重试，先写临时文件避免残留半截音频)
+        tmp_file = output_file + ".part"
+        last_error = None
+        attempts = 0
+        for attempt in range(TTS_MAX_ATTEMPTS):
+            attempts += 1
+            await self.limiter.acquire()
+            started = time.perf_counter()
+            outcome = "error"
+            metrics.add_in_flight("tts_in_flight", 1)
             try:
                 communicate = edge_tts.Communicate(
                     text=text,
@@ -55,8 +198,110 @@ class AudioEngine:
                     pitch=pitch,
                     volume=volume
                 )
-                await communicate.save(output_file)
-                return output_file
+                if self.spool is not None:
+                    # 直接收集音频流，不经过临时文件
+                    data = b"".join([
+                        chunk["data"] async for chunk in communicate.stream() if chunk["type"] == "audio"
+                    ])
+                else:
+                    await communicate.save(tmp_file)
+                    os.replace(tmp_file, output_file)
             except Exception as e:
-                print(f"TTS Error on seg {index}: {e}")
-                return None
+                last_error = e
+                outcome = self._report_error(e)
+            else:
+                self.limiter.on_success(time.perf_counter() - started)
+                outcome = labels["outcome"] = "ok"
+                if self.spool is not None:
+                    if cache_key is not None:
+                        self._cache_audio(self.cache.write, cache_key, data)
+                    return self._spool_result(index, data)
+                if cache_key is not None:
+                    self._cache_audio(self.cache.put, cache_key, output_file)
+                self.failures.pop(index, None)
+                return output_file
+            finally:
+                metrics.finish("tts_request_seconds", "tts.request", started, index=index, attempt=attempt,
+                               outcome=outcome)
+                metrics.inc("tts_requests_total", outcome=outcome)
+                metrics.add_in_flight("tts_in_flight", -1)
+                self.limiter.release()
+
+            if outcome == "no_audio":
+                # 文本本身无法朗读，重试不会有不同结果
+                break
+            if attempt + 1 < TTS_MAX_ATTEMPTS:
+                metrics.inc("tts_retries_total", reason=outcome)
+                await asyncio.sleep(backoff_delay(attempt))
+
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        print(f"TTS Error on seg {index}: {last_error}")
+        metrics.inc("tts_failures_total")
+        labels["outcome"] = "failed"
+        self.failures[index] = {
+            "index": index,
+            "role": role,
+            "text": text,
+            "error": repr(last_error),
+            "attempts": attempts,
+            # 补缺时不再重试无法朗读的文本
+            "retryable": outcome != "no_audio",
+        }
+        return None
+
+    def _spool_result(self, index, data):
+        ref = self.spool.append(data)
+        self._spooled[index] = ref
+        self.failures.pop(index, None)
+        return ref
+
+    def _cache_audio(self, store, cache_key, source):
+        """写入 TTS 缓存；失败 (磁盘已满、权限不足等) 只记录，已合成的音频照常使用"""
+        try:
+            store(cache_key, source)
+        except OSError as e:
+            metrics.inc("tts_cache_write_errors_total")
+            self.cache_errors.append(f"{cache_key[:12]}  ->  {e}")
+
+    def _report_error(self, error):
+        """按错误类型反馈给并发控制器，返回错误分类 (用于指标)"""
+        if getattr(error, "status", None) == 429:
+            self.limiter.on_throttle()
+            return "throttled"
+        if isinstance(error, edge_tts.exceptions.NoAudioReceived):
+            # 通常是文本本身无法朗读 (如纯标点)，与服务端负载无关
+            return "no_audio"
+        self.limiter.on_error()
+        return "error"
+
+    def failure_report(self):
+        """返回重试后仍失败的片段列表 (按 index 排序)"""
+        return [self.failures[i] for i in sorted(self.failures)]
+
+    async def fill_gaps(self, segments):
+        """
+        补缺：只重新合成缺失的片段。
+        segments: {index: segment_data} (index 同 generate_segment)，已有音频文件的 index 会被跳过，
+        因文本无法朗读而失败的 index 直接返回 None。
+        返回 {index: 音频文件路径 (假脱机模式下为引用) 或 None}
+        """
+        results = {}
+        missing = {}
+        for index, segment_data in segments.items():
+            output_file = segment_path(self.temp_dir, index)
+            if index in self._spooled:
+                results[index] = self._spooled[index]
+            elif self.spool is None and os.path.exists(output_file):
+                results[index] = output_file
+            elif not self.failures.get(index, {}).get("retryable", True):
+                results[index] = None
+            else:
+                missing[index] = segment_data
+
+        if missing:
+            files = await asyncio.gather(
+                *(self.generate_segment(data, index) for index, data in missing.items())
+            )
+            results.update(zip(missing.keys(), files))
+        return results
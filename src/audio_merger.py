@@ -0,0 +1,251 @@
+import io
+import os
+import subprocess
+import time
+from collections import namedtuple
+
+from pydub import AudioSegment
+
+from src import metrics
+from src.audio_spool import audio_exists, parse_audio_ref, read_audio
+
+# 流式拼接时每次读取的块大小，决定峰值内存
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# MP3 帧头查表
+_MPEG_VERSIONS = {0b00: 2.5, 0b10: 2, 0b11: 1}
+_MPEG_LAYERS = {0b01: 3, 0b10: 2, 0b11: 1}
+_SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+# 可直接流式拼接所需的一致格式 (编码层 + 采样率 + 声道数)
+Mp3Format = namedtuple("Mp3Format", ["version", "layer", "sample_rate", "channels"])
+FrameInfo = namedtuple("FrameInfo", ["format", "length", "samples"])
+
+
+def parse_frame_header(header):
+    """解析 4 字节 MPEG 音频帧头，非法帧头返回 None"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+
+    version = _MPEG_VERSIONS.get((header[1] >> 3) & 0b11)
+    layer = _MPEG_LAYERS.get((header[1] >> 1) & 0b11)
+    bitrate_idx = header[2] >> 4
+    sr_idx = (header[2] >> 2) & 0b11
+    if version is None or layer is None or bitrate_idx in (0, 15) or sr_idx == 3:
+        return None
+
+    padding = (header[2] >> 1) & 0b1
+    channels = 1 if (header[3] >> 6) == 0b11 else 2
+    sample_rate = _SAMPLE_RATES[version][sr_idx]
+    bitrate = _BITRATES[(1 if version == 1 else 2, layer)][bitrate_idx] * 1000
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 2 or version == 1:
+        samples = 1152
+        length = 144 * bitrate // sample_rate + padding
+    else:
+        # MPEG-2/2.5 Layer III 每帧只有 576 个采样
+        samples = 576
+        length = 72 * bitrate // sample_rate + padding
+
+    return FrameInfo(Mp3Format(version, layer, sample_rate, channels), length, samples)
+
+
+def _id3v2_size(head):
+    """返回文件开头 ID3v2 标签的总长度 (没有标签返回 0)"""
+    if len(head) < 10 or head[:3] != b"ID3":
+        return 0
+    size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+    footer = 10 if head[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _audio_span(ref):
+    """
+    定位 MP3 片段中纯音频帧的区间，返回 (首帧格式, 文件路径, start, end)，区间为文件内的绝对偏移。
+    ref 可以是普通文件路径或假脱机引用。跳过 ID3v2 / ID3v1 标签以及编码器写入的 Xing/Info 帧。
+    """
+    path, base, length = parse_audio_ref(ref)
+    file_size = base + length if length is not None else os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.seek(base)
+        head = f.read(10)
+        start = base + _id3v2_size(head)
+        f.seek(start)
+        probe = f.read(min(8192, file_size - start))
+
+        # 寻找第一个合法帧 (部分文件在标签后带有填充字节)
+        offset = 0
+        info = None
+        while offset + 4 <= len(probe):
+            info = parse_frame_header(probe[offset:offset + 4])
+            if info is not None:
+                break
+            offset += 1
+        if info is None:
+            return None
+        start += offset
+
+        first_frame = probe[offset:offset + info.length]
+        if b"Xing" in first_frame or b"Info" in first_frame:
+            start += info.length
+
+        end = file_size
+        if file_size - start >= 128:
+            f.seek(file_size - 128)
+            if f.read(3) == b"TAG":
+                end -= 128
+
+    return info.format, path, start, end
+
+
+def probe_mp3(ref):
+    """返回 MP3 的格式信息，无法识别时返回 None"""
+    span = _audio_span(ref)
+    return span[0] if span else None
+
+
+def mp3_duration(ref):
+    """逐帧累加采样数计算 MP3 时长 (秒)，无法识别时返回 None"""
+    span = _audio_span(ref)
+    if span is None:
+        return None
+    _, path, start, end = span
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    samples = 0
+    sample_rate = None
+    offset = 0
+    while offset + 4 <= len(data):
+        info = parse_frame_header(data[offset:offset + 4])
+        if info is None or info.length <= 0:
+            offset += 1
+            continue
+        samples += info.samples
+        sample_rate = info.format.sample_rate
+        offset += info.length
+    return samples / sample_rate if sample_rate else None
+
+
+def _stream_copy(spans, output_path, progress_callback):
+    total = len(spans)
+    src, src_path = None, None
+    try:
+        with open(output_path, "wb") as out:
+            for i, (path, start, end) in enumerate(spans):
+                # 假脱机模式下所有片段在同一个文件里，复用已打开的句柄
+                if path != src_path:
+                    if src is not None:
+                        src.close()
+                    src, src_path = open(path, "rb"), path
+                src.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    remaining -= len(chunk)
+                if progress_callback:
+                    progress_callback(i + 1, total)
+    finally:
+        if src is not None:
+            src.close()
+
+
+def _reencode(file_paths, output_path, target, progress_callback, problems):
+    """
+    格式不一致时的回退路径：逐个解码为 PCM，通过管道送入单个 ffmpeg 编码进程。
+    任意时刻内存中只保留一个片段；解码失败的片段被跳过并记入 problems。
+    """
+    command = [
+        AudioSegment.converter, "-y", "-loglevel", "error",
+        "-f", "s16le", "-ar", str(target.sample_rate), "-ac", str(target.channels),
+        "-i", "pipe:0",
+        "-f", "mp3", output_path,
+    ]
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+    total = len(file_paths)
+    try:
+        for i, path in enumerate(file_paths):
+            try:
+                if parse_audio_ref(path)[2] is not None:
+                    segment = AudioSegment.from_file(io.BytesIO(read_audio(path)), format="mp3")
+                else:
+                    segment = AudioSegment.from_file(path)
+                segment = segment.set_frame_rate(target.sample_rate)
+                segment = segment.set_channels(target.channels).set_sample_width(2)
+                proc.stdin.write(segment.raw_data)
+            except Exception as e:
+                problems.append(f"{path}  ->  解码失败: {e}")
+            if progress_callback:
+                progress_callback(i + 1, total)
+    finally:
+        proc.stdin.close()
+        proc.wait()
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg 编码失败 (exit {proc.returncode})")
+
+
+def stream_merge(file_paths, output_path, progress_callback=None, warning_callback=None):
+    """
+    以恒定内存拼接 MP3 片段 (普通文件路径或假脱机引用)。
+    所有片段编码层、采样率、声道一致时直接拷贝 MP3 帧 (无解码)；
+    否则逐段解码并流式重新编码。
+    progress_callback(done, total) 用于汇报进度；warning_callback(text, details) 汇报被跳过的片段
+    (与 ProgressReporter.warning 签名一致)，为 None 时直接打印。
+    """
+    started = time.perf_counter()
+    spans = []
+    refs = []
+    formats = set()
+    problems = []
+    for ref in file_paths:
+        if not audio_exists(ref):
+            continue
+        span = _audio_span(ref)
+        if span is None:
+            problems.append(f"{ref}  ->  不是 MP3")
+            continue
+        fmt, path, start, end = span
+        formats.add(fmt)
+        spans.append((path, start, end))
+        refs.append(ref)
+
+    tmp_path = output_path + ".part"
+    mode = "copy" if len(formats) <= 1 else "reencode"
+    if mode == "copy":
+        _stream_copy(spans, tmp_path, progress_callback)
+    else:
+        target = max(formats, key=lambda f: (f.sample_rate, f.channels))
+        _reencode(refs, tmp_path, target, progress_callback, problems)
+
+    os.replace(tmp_path, output_path)
+    if problems:
+        text = f"有 {len(problems)} 个片段无法拼接，已跳过。"
+        if warning_callback is not None:
+            warning_callback(text, problems)
+        else:
+            print(text, *problems, sep="\n")
+    metrics.inc("merge_segments_total", len(spans))
+    metrics.inc("merge_skipped_total", len(file_paths) - len(spans))
+    metrics.inc("merge_bytes_total", os.path.getsize(output_path))
+    metrics.finish("merge_seconds", "merge", started, mode=mode, segments=len(spans))
+    return output_path
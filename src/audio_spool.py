@@ -0,0 +1,62 @@
+import os
+import threading
+
+# 假脱机引用格式: "<spool 文件路径>#<偏移>:<长度>"，可与普通音频文件路径混用
+SPOOL_SEPARATOR = "#"
+
+
+class AudioSpool:
+    """
+    只追加的音频假脱机文件：所有片段的 MP3 字节依次写入同一个文件，
+    用 (偏移, 长度) 引用各片段，避免为每个片段创建、stat、重新打开小文件。
+    引用是普通字符串，可以直接写入任务清单，拼接时按区间读取。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, "ab")
+
+    def append(self, data):
+        """写入一个片段，返回其引用"""
+        with self._lock:
+            offset = self._file.tell()
+            self._file.write(data)
+            # 引用交出去之前保证数据已离开进程缓冲区，拼接阶段可直接读取
+            self._file.flush()
+        return f"{self.path}{SPOOL_SEPARATOR}{offset}:{len(data)}"
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def parse_audio_ref(ref):
+    """返回 (文件路径, 起始偏移, 长度)；普通文件路径的长度为 None (到文件末尾)"""
+    path, sep, region = ref.rpartition(SPOOL_SEPARATOR)
+    if sep and ":" in region:
+        offset, _, length = region.partition(":")
+        if offset.isdigit() and length.isdigit():
+            return path, int(offset), int(length)
+    return ref, 0, None
+
+
+def audio_exists(ref):
+    """普通文件存在，或假脱机文件中对应区间完整"""
+    if not ref:
+        return False
+    path, offset, length = parse_audio_ref(ref)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    return length is None or size >= offset + length
+
+
+def read_audio(ref):
+    """读取一个片段的完整字节"""
+    path, offset, length = parse_audio_ref(ref)
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read() if length is None else f.read(length)
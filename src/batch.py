@@ -0,0 +1,256 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src import metrics
+from src.ai_director import AIDirector
+from src.book_cache import BookCache
+from src.book_loader import BookLoader, loader_version
+from src.chapter_render import ChapterRenderer
+from src.concurrency import SharedSlots
+from src.director_cache import DirectorCache
+from src.distributed import process_distributed
+from src.job_manifest import JobManifest
+from src.job_queue import SharedStore, open_queue
+from src.metrics import Metrics
+from src.pipeline import ProgressReporter, process_generation
+from src.segmenter import segmenter_settings
+from src.tts_cache import TTSCache
+
+SUPPORTED_EXTENSIONS = (".epub", ".docx", ".pdf", ".txt")
+
+# 进程池 worker 内的全局并发名额 (由 initializer 注入)
+_tts_slots = None
+_llm_slots = None
+
+
+class ConsoleReporter(ProgressReporter):
+    """命令行进度输出，按时间间隔节流，避免刷屏"""
+
+    def __init__(self, name, interval=5.0):
+        self.name = name
+        self.interval = interval
+        self._last = 0.0
+
+    def _print(self, text):
+        print(f"[{self.name}] {text}", flush=True)
+
+    def stage(self, text):
+        self._print(text)
+
+    def progress(self, done, total, status):
+        now = time.monotonic()
+        if status is not None and now - self._last < self.interval:
+            return
+        self._last = now
+        line = f"{done}/{total} 片段"
+        if status is not None:
+            line += (f" | 导演: {status['directing'] or '-'} | 录制: {status['recording'] or '-'}"
+                     f" | TTS {status['tts_in_flight']}/{status['tts_limit']} 进行中, {status['tts_waiting']} 等待"
+                     f" | {status['tts_requests']} 次请求/{status['script_items']} 个条目")
+        self._print(line)
+
+    def merge_progress(self, done, total):
+        if done == total:
+            self._print(f"章节渲染完成 ({total} 章)")
+
+    def warning(self, text, details=None):
+        self._print(f"⚠️ {text}")
+        for line in details or []:
+            self._print(f"    {line}")
+
+
+def collect_books(source):
+    """
+    解析批处理输入：目录 (递归查找支持的书籍文件)、
+    清单文件 (.json 路径列表，或每行一个路径的文本文件)。
+    """
+    if os.path.isdir(source):
+        books = []
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    books.append(os.path.join(root, name))
+        return sorted(books)
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding="utf-8") as f:
+        if source.lower().endswith(".json"):
+            entries = json.load(f)
+        else:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return [entry if os.path.isabs(entry) else os.path.join(base_dir, entry) for entry in entries]
+
+
+def output_names(books):
+    """
+    为每本书确定输出文件名 (不含扩展名)，与 books 一一对应。
+    默认取文件名主干；主干相同的书 (如 x.txt 与 x.epub、a/x.txt 与 b/x.txt) 改用相对公共目录的路径 (含扩展名)，
+    避免并行任务同时写同一个成书文件与章节目录。
+    """
+    stems = [os.path.splitext(os.path.basename(book))[0] for book in books]
+    # 按小写比较：大小写不敏感的文件系统上 X.txt 与 x.epub 也会写到同一个文件
+    counts = Counter(stem.lower() for stem in stems)
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(book)) for book in books]) if books else ""
+    names, used = [], set()
+    for book, stem in zip(books, stems):
+        name = stem
+        if counts[stem.lower()] > 1:
+            name = os.path.relpath(os.path.abspath(book), root).replace(os.sep, "_").replace(".", "_")
+        # 清单中重复列出同一本书等情况：追加序号
+        unique, n = name, 1
+        while unique.lower() in used:
+            n += 1
+            unique = f"{name}_{n}"
+        used.add(unique.lower())
+        names.append(unique)
+    return names
+
+
+def _init_worker(tts_semaphore, llm_semaphore):
+    global _tts_slots, _llm_slots
+    _tts_slots = SharedSlots(tts_semaphore) if tts_semaphore is not None else None
+    _llm_slots = SharedSlots(llm_semaphore) if llm_semaphore is not None else None
+
+
+def run_book(book_path, output_dir, options, name=None):
+    """
+    处理单本书 (在进程池 worker 中执行)：解析 -> 导演 -> 录音 -> 拼接。
+    复用任务清单，中断后再次运行会从断点继续。返回该书的结果摘要。
+    name 为输出文件名 (不含扩展名，默认取文件名主干)；指标 (metrics.prom) 与时间线 (trace.json) 写入任务目录。
+    """
+    name = name or os.path.splitext(os.path.basename(book_path))[0]
+    reporter = ConsoleReporter(name)
+    started = time.time()
+    result = {"book": book_path, "status": "failed", "output": None}
+
+    job_metrics = Metrics(name)
+    manifest = None
+
+    try:
+        # 本书的解析、导演、录音与拼接都记录到同一个指标集合
+        with metrics.activate(job_metrics):
+            book_cache = BookCache()
+            with open(book_path, "rb") as f:
+                # 任务清单与解析缓存都按原始文件内容识别，与界面启动的任务互通
+                book_fingerprint = JobManifest.fingerprint_bytes(f.read())
+                cache_key = book_cache.make_key(book_fingerprint)
+                chapters = book_cache.get(cache_key)
+                if chapters is None:
+                    f.seek(0)
+                    book_cache.put(cache_key, BookLoader.iter_book(f, pdf_shards=options.get("pdf_shards")))
+                    chapters = book_cache.get(cache_key)
+            book_cache.close()
+            result["chapters"] = len(chapters)
+            reporter.stage(f"解析完成，共 {len(chapters)} 章" + (" (缓存)" if not book_cache.misses else ""))
+
+            use_ai = bool(options.get("api_key"))
+            director = None
+            if use_ai:
+                director = AIDirector(
+                    options["api_key"], options["base_url"], options["model"],
+                    cache=DirectorCache(), max_concurrency=options["llm_budget"], shared_slots=_llm_slots
+                )
+
+            job_settings = {
+                "use_ai": use_ai,
+                "model": options["model"] if use_ai else None,
+                "prompt": director.prompt_version if use_ai else None,
+                "segmenter": segmenter_settings(),
+                "loader": loader_version(),
+            }
+            manifest = JobManifest(JobManifest.make_job_id(book_fingerprint, job_settings))
+
+            # 每章录完立即交给进程池渲染，整书生成结束时只剩封装
+            output_format = options.get("format", "mp3")
+            renderer = ChapterRenderer(os.path.join(output_dir, f"{name}.{output_format}"), output_format)
+
+            def on_chapter_done(idx, files):
+                renderer.submit(idx, chapters.title(idx), files)
+
+            try:
+                if options.get("queue"):
+                    # 分布式模式：导演与合成由 worker 节点 (worker.py) 执行，本进程只负责投递与重组
+                    queue = open_queue(options["queue"])
+                    try:
+                        audio_files = asyncio.run(process_distributed(
+                            chapters, list(range(len(chapters))), queue, SharedStore(options["store"]),
+                            director.settings() if use_ai else None, reporter, on_chapter_done
+                        ))
+                    finally:
+                        queue.close()
+                else:
+                    audio_files = asyncio.run(process_generation(
+                        chapters, list(range(len(chapters))), use_ai, director, TTSCache(),
+                        options.get("batch_tokens"), options.get("stream", False), manifest, reporter, _tts_slots,
+                        spool_audio=options.get("spool", False), on_chapter_done=on_chapter_done
+                    ))
+                result["segments"] = len(audio_files)
+
+                if audio_files:
+                    rendered = renderer.finish(reporter.merge_progress, title=name, warning_callback=reporter.warning)
+                    manifest.set_meta("output", rendered["output"])
+                    result["output"] = rendered["output"]
+                    result["chapter_dir"] = renderer.chapter_dir
+                    result["status"] = "done"
+                else:
+                    result["error"] = "未能生成任何音频"
+            finally:
+                renderer.cancel()
+    except Exception as e:
+        traceback.print_exc()
+        result["error"] = repr(e)
+
+    result["elapsed"] = round(time.time() - started, 1)
+    result["metrics"] = job_metrics.summary()
+    if manifest is not None:
+        job_metrics.write(manifest.job_dir)
+    summary = result["metrics"]
+    reporter.stage(
+        f"指标: LLM {summary['llm_requests']} 次请求 (重试 {summary['llm_retries']}, 降级 {summary['llm_fallbacks']})"
+        f" | TTS {summary['tts_requests']} 次请求 (重试 {summary['tts_retries']}, 失败 {summary['tts_failures']})"
+        f" | {summary['tts_chars_per_second']} 字/秒"
+    )
+    reporter.stage(f"结束: {result['status']} ({result['elapsed']}s)")
+    return result
+
+
+def run_batch(books, output_dir, options, workers=2):
+    """
+    多书并行批处理：进程池中每个进程处理一本书，
+    所有进程共享同一份 TTS / LLM 全局并发预算。结果摘要写入 output_dir/summary.json。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+
+    with multiprocessing.Manager() as manager:
+        tts_semaphore = manager.BoundedSemaphore(options["tts_budget"])
+        llm_semaphore = manager.BoundedSemaphore(options["llm_budget"])
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(tts_semaphore, llm_semaphore)
+        ) as pool:
+            futures = {
+                pool.submit(run_book, book, output_dir, options, name): book
+                for book, name in zip(books, output_names(books))
+            }
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append({"book": futures[future], "status": "failed", "error": repr(e)})
+
+    results.sort(key=lambda r: r["book"])
+    summary = {
+        "total": len(results),
+        "done": sum(1 for r in results if r["status"] == "done"),
+        "failed": sum(1 for r in results if r["status"] != "done"),
+        "books": results,
+    }
+    with open(os.path.join(output_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
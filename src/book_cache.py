@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from array import array
+
+from src.book_loader import Book, loader_version
+from src.config import BOOK_CACHE_DIR
+
+
+class BookCache:
+    """
+    书籍解析结果的本地持久化缓存。
+    Key = hash(原始文件内容, 解析器版本)。SQLite 索引保存章节标题与章节边界偏移，
+    全书正文以 UTF-8 存为单个文件，读取时 mmap 打开，多个会话共享同一份页缓存。
+    解析器的章节模式变化后旧条目自动失效并在启动时清理。
+    """
+
+    def __init__(self, cache_dir=BOOK_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.version = loader_version()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 进程内已打开的书，同一本书的多个会话复用同一个 Book
+        self._open_books = weakref.WeakValueDictionary()
+        os.makedirs(cache_dir, exist_ok=True)
+        # 批处理的多个进程共享同一个索引：WAL 模式下读写互不阻塞，写锁冲突时最多等待 30 秒
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite3"), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS book_cache (
+                key TEXT PRIMARY KEY,
+                loader_version TEXT NOT NULL,
+                titles TEXT NOT NULL,
+                bounds BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        # 解析器版本已变化的条目不会再被命中，直接删除
+        stale = self._conn.execute(
+            "SELECT key FROM book_cache WHERE loader_version != ?", (self.version,)
+        ).fetchall()
+        self._delete([key for key, in stale])
+
+    def make_key(self, file_digest):
+        """file_digest 为原始文件内容的 sha256 (见 JobManifest.fingerprint_bytes)"""
+        return hashlib.sha256(f"{file_digest}:{self.version}".encode("utf-8")).hexdigest()
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def get(self, key):
+        """命中返回 Book，未命中返回 None"""
+        with self._lock:
+            book = self._open_books.get(key)
+            if book is not None:
+                self.hits += 1
+                return book
+
+            row = self._conn.execute(
+                "SELECT titles, bounds FROM book_cache WHERE key = ?", (key,)
+            ).fetchone()
+            path = self._path_for(key)
+            if row is None or not os.path.exists(path):
+                self.misses += 1
+                return None
+
+            bounds = array('Q')
+            bounds.frombytes(row[1])
+            book = Book.open(path, json.loads(row[0]), bounds)
+            self._open_books[key] = book
+            self.hits += 1
+            return book
+
+    def put(self, key, chapters):
+        """写入解析结果 (Book 或 Chapter 列表)"""
+        book = chapters if isinstance(chapters, Book) else Book.from_chapters(chapters)
+        path = self._path_for(key)
+        # 多个进程可能同时缓存同一本书：各写各的临时文件，内容相同，后替换者覆盖先替换者
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp_path, "wb") as f:
+            f.write(book.buffer)
+
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO book_cache VALUES (?, ?, ?, ?, ?)",
+                (key, self.version, json.dumps(book.titles, ensure_ascii=False),
+                 book.bounds.tobytes(), time.time()),
+            )
+            self._conn.commit()
+
+    def _delete(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path_for(key))
+            except OSError:
+                # 文件不存在，或仍被 mmap 占用 (Windows)
+                pass
+        self._conn.executemany("DELETE FROM book_cache WHERE key = ?", [(key,) for key in keys])
+        self._conn.commit()
+
+    def clear(self):
+        """清空全部缓存，返回删除条数"""
+        with self._lock:
+            keys = [key for key, in self._conn.execute("SELECT key FROM book_cache").fetchall()]
+            self._delete(keys)
+            self._open_books.clear()
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM book_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,11 +1,45 @@
 import fitz  # PyMuPDF
 import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 import docx
+import codecs
+import hashlib
+import io
+import mmap
+import os
 import re
+import tempfile
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import List, Set, Tuple
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import unquote
+
+from src import metrics
+from src.config import PDF_EXTRACT_SHARDS, PDF_PARALLEL_MIN_PAGES
+
+# 流式读取 TXT 时每次读取的字节数
+TXT_READ_CHUNK = 1024 * 1024
+# 目录嗅探扫描的行数
+TOC_SCAN_LINES = 300
+# 解析逻辑修订号：改动切分/过滤行为 (而非正则与关键词本身) 时手动加一，使书籍缓存失效
+LOADER_REVISION = 1
+
+
+def _extract_pdf_pages(path: str, start: int, end: int) -> List[str]:
+    """进程池 worker：独立打开 PDF，抽取 [start, end) 页的文本"""
+    with fitz.open(path) as doc:
+        return [doc[page_num].get_text() for page_num in range(start, end)]
+
+
+def loader_version() -> str:
+    """解析器版本号：章节模式、垃圾关键词与修订号的短哈希"""
+    payload = repr((LOADER_REVISION, BookLoader.CHAPTER_PATTERN_FAMILIES, BookLoader.METADATA_KEYWORDS))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
 
 
 @dataclass
@@ -14,6 +48,77 @@ class Chapter:
     content: str
 
 
+class Book:
+    """
+    紧凑的整书表示：所有章节正文按 UTF-8 连续存放在一个缓冲区 (bytes / bytearray / mmap) 中，
+    另存标题列表和章节边界偏移数组，访问某章时才切片解码。
+    缓冲区来自 mmap 时，同一本书在多个会话间共享操作系统页缓存。
+    支持 len()、下标与迭代，取出的仍是 Chapter，可直接替代 List[Chapter]。
+    """
+
+    __slots__ = ("_buffer", "_titles", "_bounds", "__weakref__")
+
+    def __init__(self, buffer=None, titles: List[str] = None, bounds: array = None):
+        self._buffer = buffer if buffer is not None else bytearray()
+        self._titles = titles if titles is not None else []
+        # 第 i 章的字节区间为 [bounds[i], bounds[i + 1])
+        self._bounds = bounds if bounds is not None else array('Q', [0])
+
+    @classmethod
+    def from_chapters(cls, chapters: Iterable[Chapter]) -> "Book":
+        book = cls()
+        for chapter in chapters:
+            book.append(chapter)
+        return book
+
+    @classmethod
+    def open(cls, path: str, titles: List[str], bounds: array) -> "Book":
+        """以只读 mmap 打开缓冲区文件"""
+        if bounds[-1] == 0:
+            return cls(b"", titles, bounds)
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, titles, bounds)
+
+    def append(self, chapter: Chapter):
+        """追加章节 (仅适用于 bytearray 缓冲区，用于流式解析时边解析边积累)"""
+        self._buffer += chapter.content.encode("utf-8")
+        self._titles.append(chapter.title)
+        self._bounds.append(len(self._buffer))
+
+    @property
+    def titles(self) -> List[str]:
+        return self._titles
+
+    @property
+    def bounds(self) -> array:
+        return self._bounds
+
+    @property
+    def buffer(self):
+        return self._buffer
+
+    def title(self, index: int) -> str:
+        return self._titles[index]
+
+    def content(self, index: int) -> str:
+        return self._buffer[self._bounds[index]:self._bounds[index + 1]].decode("utf-8")
+
+    def __len__(self):
+        return len(self._titles)
+
+    def __getitem__(self, index: int) -> Chapter:
+        if index < 0:
+            index += len(self._titles)
+        if not 0 <= index < len(self._titles):
+            raise IndexError("chapter index out of range")
+        return Chapter(title=self._titles[index], content=self.content(index))
+
+    def __iter__(self) -> Iterator[Chapter]:
+        for index in range(len(self._titles)):
+            yield self[index]
+
+
 class BookLoader:
     # 垃圾信息关键词（版权页、出版社信息等）
     METADATA_KEYWORDS = [
@@ -22,70 +127,108 @@ class BookLoader:
         "字数", "印张", "版次", "书号", "经销", "开本"
     ]
 
-    # 增强的章节标题匹配模式
-    CHAPTER_PATTERNS = [
-        r'(^第[0-9一二三四五六七八九十百千]+[章|节|回|卷|部|篇].*)',  # 标准：第1章 / 第一卷
-        r'(^Chapter\s+\d+.*)',  # 英文：Chapter 1
-        r'(^Part\s+[One|Two|Three|I|II|III|IV|V|VI].*)',  # 英文：Part One
-        r'(^[0-9一二三四五六七八九十百]+\s+[\u4e00-\u9fa5]{2,})',  # 纯数字+文字：1. 开始
-        r'(^前言|^序言|^引子|^楔子|^尾声|^后记|^番外|^终章|^结语|^Prologue|^Epilogue|^Introduction|^Preface)',  # 特殊结构
-        r'(^目录|^Table of Contents)',  # 目录页本身
-        r'(^作者.*|^致谢.*)'  # 匹配 "作者的话", "致谢" 等
+    # 增强的章节标题匹配模式 (按优先级排列，名称即匹配到的模式族)
+    CHAPTER_PATTERN_FAMILIES = [
+        ("numbered", r'(^第[0-9一二三四五六七八九十百千]+[章|节|回|卷|部|篇].*)'),  # 标准：第1章 / 第一卷
+        ("chapter_en", r'(^Chapter\s+\d+.*)'),  # 英文：Chapter 1
+        ("part_en", r'(^Part\s+[One|Two|Three|I|II|III|IV|V|VI].*)'),  # 英文：Part One
+        ("digit_title", r'(^[0-9一二三四五六七八九十百]+\s+[\u4e00-\u9fa5]{2,})'),  # 纯数字+文字：1. 开始
+        ("special", r'(^前言|^序言|^引子|^楔子|^尾声|^后记|^番外|^终章|^结语|^Prologue|^Epilogue|^Introduction|^Preface)'),  # 特殊结构
+        ("toc_page", r'(^目录|^Table of Contents)'),  # 目录页本身
+        ("author_note", r'(^作者.*|^致谢.*)')  # 匹配 "作者的话", "致谢" 等
     ]
 
-    @staticmethod
-    def load_book(file) -> List[Chapter]:
-        """工厂方法：根据文件后缀分发处理逻辑"""
-        filename = file.name.lower()
-        chapters = []
+    # 所有模式合并为一个预编译正则，用命名分组区分模式族
+    _CHAPTER_MATCHER = re.compile(
+        "|".join(f"(?P<{name}>{pattern})" for name, pattern in CHAPTER_PATTERN_FAMILIES),
+        re.IGNORECASE
+    )
+    # 能作为任一模式开头的字符 (含 IGNORECASE 下的大小写变体)，首字不在其中的行无需进入正则
+    _TITLE_FIRST_CHARS = frozenset("第0123456789一二三四五六七八九十百前序引楔尾后番终结目作致CcEeIiPpTtİı")
 
+    @staticmethod
+    def load_book(file, pdf_shards: int = None) -> List[Chapter]:
+        """工厂方法：根据文件后缀分发处理逻辑，一次性返回全部章节"""
         try:
-            if filename.endswith('.epub'):
-                chapters = BookLoader._parse_epub(file)
-            elif filename.endswith('.docx'):
-                chapters = BookLoader._parse_docx(file)
-            elif filename.endswith('.pdf'):
-                chapters = BookLoader._parse_pdf(file)
-            elif filename.endswith('.txt'):
-                chapters = BookLoader._parse_txt(file)
-            else:
-                raise ValueError("不支持的文件格式")
-
-            # 统一进行垃圾章节过滤
-            return BookLoader._filter_junk_chapters(chapters)
+            return list(BookLoader.iter_book(file, pdf_shards=pdf_shards))
         except Exception as e:
             # 捕获解析错误，避免整个程序崩溃
             print(f"解析书籍出错: {e}")
             raise e
 
     @staticmethod
-    def _is_chapter_title(text: str, custom_titles: Set[str] = None) -> bool:
-        """判断一行文本是否像章节标题"""
+    def iter_book(file, filename: str = None, pdf_shards: int = None) -> Iterator[Chapter]:
+        """
+        流式加载：逐章惰性产出 Chapter，前几章可以在整本书解析完之前就被选择和生成。
+        file 可以是任意带 read() 的二进制对象 (文件句柄、上传文件、mmap)，
+        没有 name 属性时 (如 mmap) 需通过 filename 指明格式。TXT 峰值内存只与最大章节相关。
+        pdf_shards 为 PDF 并行抽取的分片数 (默认 PDF_EXTRACT_SHARDS，1 表示单进程)。
+        """
+        filename = (filename or file.name).lower()
+
+        if filename.endswith('.epub'):
+            chapters = BookLoader._parse_epub(file)
+        elif filename.endswith('.docx'):
+            chapters = BookLoader._parse_docx(file)
+        elif filename.endswith('.pdf'):
+            chapters = BookLoader._parse_pdf(file, pdf_shards)
+        elif filename.endswith('.txt'):
+            chapters = BookLoader._parse_txt(file)
+        else:
+            raise ValueError("不支持的文件格式")
+
+        # 统一进行垃圾章节过滤
+        return BookLoader._measure_stream(BookLoader._filter_junk_stream(chapters), filename.rsplit('.', 1)[-1])
+
+    @staticmethod
+    def _measure_stream(chapters: Iterator[Chapter], fmt: str) -> Iterator[Chapter]:
+        """
+        统计解析耗时与产出的章节/字数。流式解析可能被调用方分多次消费 (界面按时间片解析)，
+        因此只累计生成器内部实际执行的时间，不计调用方在两章之间的停顿。
+        """
+        first_started = started = time.perf_counter()
+        busy = 0.0
+        for chapter in chapters:
+            busy += time.perf_counter() - started
+            metrics.inc("book_chapters_total", format=fmt)
+            metrics.inc("book_chars_total", len(chapter.content), format=fmt)
+            yield chapter
+            started = time.perf_counter()
+        busy += time.perf_counter() - started
+        metrics.observe("book_parse_seconds", busy, format=fmt)
+        metrics.record_span("load_book", "parse", first_started, busy, format=fmt)
+
+    @staticmethod
+    def match_chapter_title(text: str, custom_titles: Set[str] = None) -> Optional[str]:
+        """
+        判断一行文本是否像章节标题，返回匹配到的模式族名称；
+        命中目录嗅探得到的标题时返回 "toc"，不是标题返回 None
+        """
         text = text.strip()
         if not text:
-            return False
+            return None
 
         # 1. 优先匹配动态提取的目录标题 (精确匹配)
         if custom_titles and text in custom_titles:
-            return True
+            return "toc"
 
-        # 2. 长度过滤 (标题一般不会太长)
-        if len(text) > 50:
-            return False
+        # 2. 长度过滤 (标题一般不会太长) + 首字预筛，绝大多数正文行在此返回
+        if len(text) > 50 or text[0] not in BookLoader._TITLE_FIRST_CHARS:
+            return None
 
-        # 3. 正则匹配通用模式
-        for pattern in BookLoader.CHAPTER_PATTERNS:
-            if re.match(pattern, text, re.IGNORECASE):
-                return True
-        return False
+        # 3. 合并后的单个正则匹配通用模式
+        match = BookLoader._CHAPTER_MATCHER.match(text)
+        return match.lastgroup if match else None
 
     @staticmethod
-    def _extract_toc_titles(content: str) -> Set[str]:
-        """目录嗅探：尝试从文本开头识别文本目录，提取短标题"""
-        found_titles = set()
-        lines = content.split('\n')
+    def _is_chapter_title(text: str, custom_titles: Set[str] = None) -> bool:
+        """判断一行文本是否像章节标题"""
+        return BookLoader.match_chapter_title(text, custom_titles) is not None
 
-        scan_limit = min(len(lines), 300)  # 稍微增加扫描行数
+    @staticmethod
+    def _extract_toc_from_lines(lines: List[str]) -> Set[str]:
+        found_titles = set()
+        scan_limit = min(len(lines), TOC_SCAN_LINES)  # 稍微增加扫描行数
         in_toc_area = False
 
         for i in range(scan_limit):
@@ -108,84 +251,181 @@ class BookLoader:
         return found_titles
 
     @staticmethod
-    def _filter_junk_chapters(chapters: List[Chapter]) -> List[Chapter]:
-        """过滤掉版权页、目录页等非正文内容"""
-        clean_chapters = []
-        for chap in chapters:
-            title_lower = chap.title.lower()
-            content_lower = chap.content.lower()[:500]
+    def _is_junk_chapter(chap: Chapter) -> bool:
+        """判断是否为版权页、目录页等非正文内容"""
+        title_lower = chap.title.lower()
+        content_lower = chap.content.lower()[:500]
 
-            # 1. 检查标题是否包含明显的垃圾关键词
-            if any(kw in title_lower for kw in ["版权", "copyright", "colophon", "table of contents"]):
-                continue
-            if title_lower.strip() == "目录":
-                continue
+        # 1. 检查标题是否包含明显的垃圾关键词
+        if any(kw in title_lower for kw in ["版权", "copyright", "colophon", "table of contents"]):
+            return True
+        if title_lower.strip() == "目录":
+            return True
 
-            # 2. 检查内容密度 (放宽限制，避免误杀短文)
-            if len(chap.content) < 500:  # 稍微降低阈值
-                hit_count = sum(1 for kw in BookLoader.METADATA_KEYWORDS if kw.lower() in content_lower)
-                if hit_count >= 2 or ("isbn" in content_lower):
-                    continue
+        # 2. 检查内容密度 (放宽限制，避免误杀短文)
+        if len(chap.content) < 500:  # 稍微降低阈值
+            hit_count = sum(1 for kw in BookLoader.METADATA_KEYWORDS if kw.lower() in content_lower)
+            if hit_count >= 2 or ("isbn" in content_lower):
+                return True
+
+        return False
 
-            clean_chapters.append(chap)
+    @staticmethod
+    def _filter_junk_stream(chapters: Iterable[Chapter]) -> Iterator[Chapter]:
+        """流式过滤垃圾章节；若全部被判为垃圾，则原样产出全部章节"""
+        junk = []
+        emitted = False
+        for chap in chapters:
+            if BookLoader._is_junk_chapter(chap):
+                if not emitted:
+                    junk.append(chap)
+                continue
+            emitted = True
+            junk = []
+            yield chap
 
-        return clean_chapters if clean_chapters else chapters
+        if not emitted:
+            yield from junk
 
     # --- EPUB 解析逻辑重构 (核心修改) ---
-    @staticmethod
-    def _parse_epub(file) -> List[Chapter]:
-        temp_path = f"temp_{file.name}"
-        with open(temp_path, "wb") as f:
-            f.write(file.read())
+    # 不产生文本的标签
+    _EPUB_SKIP_TAGS = {"script", "style", "head", "title"}
 
-        book = epub.read_epub(temp_path)
-        chapters = []
+    @staticmethod
+    def _parse_epub(file) -> Iterator[Chapter]:
+        # 直接从内存读取，不在工作目录落临时文件
+        book = epub.read_epub(io.BytesIO(file.read()))
 
         # 1. 尝试从 NCX/Nav 目录读取 (最准确)
         toc_items = BookLoader._flatten_epub_toc(book.toc)
 
         if toc_items:
-            # 如果有目录，按照目录抓取
-            for link in toc_items:
-                try:
-                    # link.href 可能是 'chap1.xhtml' 或 'chap1.xhtml#anchor'
-                    href_parts = link.href.split('#')
-                    file_href = href_parts[0]
-                    # anchor = href_parts[1] if len(href_parts) > 1 else None
-
-                    # 根据 href 找到 item
-                    item = book.get_item_with_href(file_href)
-                    if item:
-                        soup = BeautifulSoup(item.get_content(), 'html.parser')
-                        # 简单处理：提取该文件的全部文字
-                        # (精细化处理 anchor 比较复杂，这里先确保整章能读到)
-                        text = soup.get_text().strip()
-                        if len(text) > 50:
-                            chapters.append(Chapter(title=link.title, content=text))
-                except Exception:
-                    continue
+            yield from BookLoader._split_epub_by_toc(book, toc_items)
         else:
             # 2. 目录为空，回退到 Spine (阅读顺序) 遍历
             # Spine 是书籍定义的线性阅读顺序，比 get_items() 靠谱
             for item_id, linear in book.spine:
                 item = book.get_item_with_id(item_id)
                 if item:
-                    soup = BeautifulSoup(item.get_content(), 'html.parser')
-                    text = soup.get_text().strip()
+                    body = BookLoader._epub_body(item)
+                    text = "".join(text for _, text in BookLoader._walk_epub_text(body, set())).strip()
 
                     # 尝试寻找标题
-                    title = ""
-                    header = soup.find(['h1', 'h2', 'h3'])
-                    if header:
-                        title = header.get_text().strip()
+                    headers = body.xpath("(.//h1|.//h2|.//h3)[1]")
+                    if headers:
+                        title = headers[0].text_content().strip()
                     else:
                         # 如果没有标题，尝试用文件名或 ID
                         title = item.get_name()
 
                     if len(text) > 50:
-                        chapters.append(Chapter(title=title, content=text))
+                        yield Chapter(title=title, content=text)
 
-        return chapters
+    @staticmethod
+    def _epub_body(item):
+        """用 lxml 解析一个 XHTML 文档，返回 body (没有则返回根节点)"""
+        root = lxml.html.document_fromstring(item.get_content())
+        body = root.find("body")
+        return body if body is not None else root
+
+    @staticmethod
+    def _walk_epub_text(body, anchors: Set[str]) -> Iterator[Tuple[Optional[str], str]]:
+        """
+        按文档顺序产出 (锚点, 文本)：经过 anchors 中的锚点 (id 或 a[name]) 时先产出 (锚点, "")，
+        其余文本的锚点为 None。
+        """
+        walker = etree.iterwalk(body, events=("start", "end", "comment", "pi"))
+        for event, el in walker:
+            if event == "start":
+                # script/style 等不产生文本 (但其 tail 仍属于正文)
+                if el.tag in BookLoader._EPUB_SKIP_TAGS:
+                    walker.skip_subtree()
+                    continue
+                anchor = el.get("id") or (el.get("name") if el.tag == "a" else None)
+                if anchor in anchors:
+                    yield anchor, ""
+                if el.text:
+                    yield None, el.text
+            # end / 注释 / 处理指令：只取其后的 tail 文本
+            elif el is not body and el.tail:
+                yield None, el.tail
+
+    @staticmethod
+    def _split_epub_by_toc(book, toc_items) -> Iterator[Chapter]:
+        """
+        沿 Spine 顺序把每个文档只解析一次，按目录项 (文件 + 锚点) 切分：
+        每章只包含从自己的位置到下一个目录项之间的文字，
+        多个目录项指向同一文件时不会重复整份文件内容。
+        """
+        # 每个文件里作为章节起点的锚点 (None 表示文件开头)，以及对应的标题
+        starts: Dict[str, Dict[Optional[str], str]] = {}
+        for link in toc_items:
+            # link.href 可能是 'chap1.xhtml' 或 'chap1.xhtml#anchor'
+            file_href, _, anchor = unquote(link.href).partition('#')
+            # 多个目录项指向同一位置时 (如 "第一部" 与其下的 "第一章")，取层级更深的后者作为标题
+            starts.setdefault(file_href, {})[anchor or None] = link.title
+
+        spine_items = []
+        for item_id, linear in book.spine:
+            item = book.get_item_with_id(item_id)
+            if item:
+                spine_items.append(item)
+        spine_names = {item.get_name() for item in spine_items}
+
+        # 目录指向了不在 Spine 中的文档时，按目录顺序补到末尾
+        for file_href in starts:
+            if file_href not in spine_names:
+                item = book.get_item_with_href(file_href)
+                if item:
+                    spine_items.append(item)
+                    spine_names.add(file_href)
+
+        title = None
+        parts = []
+
+        for item in spine_items:
+            file_starts = starts.get(item.get_name(), {})
+            try:
+                body = BookLoader._epub_body(item)
+            except Exception:
+                continue
+
+            if None in file_starts:
+                # 文件开头即新章节
+                chapter = BookLoader._make_epub_chapter(title, parts)
+                if chapter:
+                    yield chapter
+                title, parts = file_starts[None], []
+
+            anchors = {anchor for anchor in file_starts if anchor}
+            # 尚无章节开始时，目录所在文件里首个锚点之前的文字 (如卷首标题) 归入该锚点的章节
+            leading = [] if title is None and anchors else None
+            for anchor, text in BookLoader._walk_epub_text(body, anchors):
+                if anchor:
+                    chapter = BookLoader._make_epub_chapter(title, parts)
+                    if chapter:
+                        yield chapter
+                    title, parts = file_starts[anchor], leading or []
+                    leading = None
+                    anchors.discard(anchor)
+                elif title is not None:
+                    parts.append(text)
+                elif leading is not None:
+                    leading.append(text)
+                # 其余为第一个目录项之前的内容 (封面、版权页等)，不计入任何章节
+
+        chapter = BookLoader._make_epub_chapter(title, parts)
+        if chapter:
+            yield chapter
+
+    @staticmethod
+    def _make_epub_chapter(title: Optional[str], parts: List[str]) -> Optional[Chapter]:
+        if title is None:
+            return None
+        text = "".join(parts).strip()
+        if len(text) > 50:
+            return Chapter(title=title, content=text)
+        return None
 
     @staticmethod
     def _flatten_epub_toc(toc, depth=0):
@@ -197,22 +437,21 @@ class BookLoader:
             elif isinstance(item, (tuple, list)):
                 # 目录项可能是 (Section, [Children])
                 section, children = item
-                if isinstance(section, epub.Link):
+                if isinstance(section, epub.Link) or (isinstance(section, epub.Section) and section.href):
                     items.append(section)
                 items.extend(BookLoader._flatten_epub_toc(children, depth + 1))
         return items
 
     @staticmethod
-    def _parse_docx(file) -> List[Chapter]:
+    def _parse_docx(file) -> Iterator[Chapter]:
         doc = docx.Document(file)
-        full_text = "\n".join([p.text for p in doc.paragraphs])
-        toc_titles = BookLoader._extract_toc_titles(full_text)
+        paragraphs = doc.paragraphs
+        toc_titles = BookLoader._extract_toc_from_lines([p.text for p in paragraphs[:TOC_SCAN_LINES]])
 
-        chapters = []
         current_title = "正文"
         current_content = []
 
-        for para in doc.paragraphs:
+        for para in paragraphs:
             text = para.text.strip()
             if not text:
                 continue
@@ -222,70 +461,160 @@ class BookLoader:
 
             if is_heading or is_pattern_match:
                 if current_content:
-                    chapters.append(Chapter(title=current_title, content="\n".join(current_content)))
+                    yield Chapter(title=current_title, content="\n".join(current_content))
                 current_title = text
                 current_content = []
             else:
                 current_content.append(text)
 
         if current_content:
-            chapters.append(Chapter(title=current_title, content="\n".join(current_content)))
+            yield Chapter(title=current_title, content="\n".join(current_content))
+
+    @staticmethod
+    def _pdf_path(file, data: bytes) -> Tuple[str, bool]:
+        """
+        返回可供 worker 独立打开的 PDF 路径，以及是否为需要清理的临时文件。
+        真实文件直接用原路径，内存中的上传文件先落盘。
+        """
+        try:
+            file.fileno()
+            if os.path.isfile(file.name):
+                return file.name, False
+        except (AttributeError, OSError, ValueError):
+            pass
 
-        return chapters
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            tmp.write(data)
+        return tmp.name, True
 
     @staticmethod
-    def _parse_pdf(file) -> List[Chapter]:
-        doc = fitz.open(stream=file.read(), filetype="pdf")
-        toc = doc.get_toc()
-        chapters = []
-
-        if toc:
-            for i in range(len(toc)):
-                title = toc[i][1]
-                start_page = toc[i][2] - 1
-                end_page = toc[i + 1][2] - 1 if i + 1 < len(toc) else doc.page_count
-
-                text = ""
-                for page_num in range(start_page, end_page):
-                    text += doc[page_num].get_text()
-
-                if text.strip():
-                    chapters.append(Chapter(title=title, content=text))
-        else:
-            full_text = ""
-            for page in doc:
-                full_text += page.get_text()
-            chapters = BookLoader._split_text_by_patterns(full_text)
+    def _iter_pdf_pages_parallel(path: str, page_count: int, shards: int) -> Iterator[str]:
+        """
+        按连续页段分片，交给进程池并行抽取，再按页序产出文本。
+        前面的分片一完成即可产出，不必等待整本书。
+        """
+        shard_size = -(-page_count // shards)
+        ranges = [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [pool.submit(_extract_pdf_pages, path, start, end) for start, end in ranges]
+            for future in futures:
+                yield from future.result()
+
+    @staticmethod
+    def _parse_pdf(file, shards: int = None) -> Iterator[Chapter]:
+        shards = shards or PDF_EXTRACT_SHARDS
+        data = file.read()
+        path, is_temp = None, False
+        try:
+            with fitz.open(stream=data, filetype="pdf") as doc:
+                toc = doc.get_toc()
+                page_count = doc.page_count
+
+                if shards > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+                    path, is_temp = BookLoader._pdf_path(file, data)
+                    del data
+                    pages = BookLoader._iter_pdf_pages_parallel(path, page_count, min(shards, page_count))
+                else:
+                    pages = (page.get_text() for page in doc)
+
+                if toc:
+                    yield from BookLoader._assemble_toc_chapters(toc, page_count, pages)
+                else:
+                    yield from BookLoader._split_lines_by_patterns(BookLoader._iter_lines(pages))
+        finally:
+            if is_temp:
+                os.remove(path)
 
-        return chapters
+    @staticmethod
+    def _assemble_toc_chapters(toc, page_count: int, pages: Iterable[str]) -> Iterator[Chapter]:
+        """按页序消费页面文本，按目录顺序组装章节；后续章节不再用到的页随即释放"""
+        starts = [entry[2] - 1 for entry in toc]
+        # keep_from[i]：第 i 个及之后的目录项最早用到的页
+        keep_from = starts[:] + [page_count]
+        for i in range(len(toc) - 1, -1, -1):
+            keep_from[i] = min(keep_from[i], keep_from[i + 1])
+
+        page_iter = iter(pages)
+        page_texts = {}
+        loaded = 0
+        for i in range(len(toc)):
+            title = toc[i][1]
+            start_page = starts[i]
+            end_page = starts[i + 1] if i + 1 < len(toc) else page_count
+
+            while loaded < end_page:
+                page_texts[loaded] = next(page_iter, "")
+                loaded += 1
+
+            text = "".join(page_texts.get(page_num, "") for page_num in range(start_page, end_page))
+            if text.strip():
+                yield Chapter(title=title, content=text)
+
+            for page_num in [p for p in page_texts if p < keep_from[i + 1]]:
+                del page_texts[page_num]
 
     @staticmethod
-    def _parse_txt(file) -> List[Chapter]:
-        content = file.read().decode('utf-8')
-        return BookLoader._split_text_by_patterns(content)
+    def _detect_encoding(sample: bytes) -> str:
+        """根据开头的字节判断编码：BOM 优先，其次 UTF-8，否则按 GB18030 (GBK 超集) 处理"""
+        if sample.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return 'utf-16'
+        try:
+            # 采样末尾可能截断多字节字符，用增量解码器容忍不完整的结尾
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            return 'gb18030'
 
     @staticmethod
-    def _split_text_by_patterns(content: str) -> List[Chapter]:
-        toc_titles = BookLoader._extract_toc_titles(content)
-        lines = content.split('\n')
-        chapters = []
+    def _iter_decoded(file, chunk_size: int = TXT_READ_CHUNK) -> Iterator[str]:
+        """分块读取并增量解码，任意时刻只持有一个块"""
+        chunk = file.read(chunk_size)
+        decoder = codecs.getincrementaldecoder(BookLoader._detect_encoding(chunk))(errors='replace')
+        while chunk:
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+            chunk = file.read(chunk_size)
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    @staticmethod
+    def _iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+        """把任意切分的文本块重新拼成按换行分隔的行"""
+        pending = ""
+        for chunk in chunks:
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop()
+            yield from lines
+        yield pending
+
+    @staticmethod
+    def _parse_txt(file) -> Iterator[Chapter]:
+        return BookLoader._split_lines_by_patterns(BookLoader._iter_lines(BookLoader._iter_decoded(file)))
+
+    @staticmethod
+    def _split_lines_by_patterns(lines: Iterator[str]) -> Iterator[Chapter]:
+        # 先缓存开头若干行做目录嗅探，再接着流式切分
+        head = list(islice(lines, TOC_SCAN_LINES))
+        toc_titles = BookLoader._extract_toc_from_lines(head)
         current_title = "正文"
         current_content = []
 
-        for line in lines:
+        for line in chain(head, lines):
             line = line.strip()
             if not line:
                 continue
 
             if BookLoader._is_chapter_title(line, toc_titles):
                 if current_content:
-                    chapters.append(Chapter(title=current_title, content="\n".join(current_content)))
+                    yield Chapter(title=current_title, content="\n".join(current_content))
                 current_title = line
                 current_content = []
             else:
                 current_content.append(line)
 
         if current_content:
-            chapters.append(Chapter(title=current_title, content="\n".join(current_content)))
-
-        return chapters
+            yield Chapter(title=current_title, content="\n".join(current_content))
@@ -0,0 +1,220 @@
+import os
+import re
+import struct
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pydub import AudioSegment
+
+from src import metrics
+from src.audio_merger import mp3_duration, stream_merge
+from src.config import CHAPTER_RENDER_WORKERS, M4B_AAC_BITRATE
+
+# 成书格式：mp3 为单个 MP3 文件；mka (MP3 流拷贝) / m4b (AAC) 为带章节标记的容器
+OUTPUT_FORMATS = ("mp3", "mka", "m4b")
+
+# 文件名中不允许出现的字符
+_UNSAFE_FILENAME = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+def chapter_filename(order, title, ext="mp3"):
+    """逐章文件名：序号 + 标题，保证按文件名排序即为章节顺序"""
+    safe_title = _UNSAFE_FILENAME.sub("_", title).strip(" .")[:60] or "chapter"
+    return f"{order + 1:03d} {safe_title}.{ext}"
+
+
+def _ffmpeg(args):
+    command = [AudioSegment.converter, "-y", "-loglevel", "error"] + args
+    proc = subprocess.run(command, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg 执行失败 (exit {proc.returncode}): {proc.stderr.decode(errors='replace')}")
+
+
+def _iter_mp4_boxes(f, start, end):
+    """遍历 [start, end) 范围内的 MP4 box，产出 (类型, 内容起点, box 终点)"""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            return
+        yield box_type, pos + header, pos + size
+        pos += size
+
+
+def mp4_duration(path):
+    """
+    读取 MP4/M4A 的 mvhd 时长 (秒)，即 concat 拼接时该文件实际占用的时长；
+    AAC 编码会引入几十毫秒的首尾填充，章节标记以此为准才不会逐章累积偏差。找不到时返回 None
+    """
+    with open(path, "rb") as f:
+        for box_type, body, box_end in _iter_mp4_boxes(f, 0, os.path.getsize(path)):
+            if box_type != b"moov":
+                continue
+            for child_type, child_body, _ in _iter_mp4_boxes(f, body, box_end):
+                if child_type != b"mvhd":
+                    continue
+                f.seek(child_body)
+                if f.read(4)[0] == 1:
+                    f.seek(16, os.SEEK_CUR)
+                    timescale, duration = struct.unpack(">IQ", f.read(12))
+                else:
+                    f.seek(8, os.SEEK_CUR)
+                    timescale, duration = struct.unpack(">II", f.read(8))
+                return duration / timescale if timescale else None
+    return None
+
+
+def _render_chapter(file_paths, mp3_path, aac_path=None):
+    """
+    进程池 worker：把一章的片段流式拼接为 MP3，需要时再编码一份 AAC (M4B 只能封装 AAC)。
+    返回 (MP3 路径, 成书中该章的时长秒数, AAC 路径, 开始时刻, 耗时, 被跳过的片段)；
+    perf_counter 为系统级单调时钟，可与主进程对齐。被跳过的片段随结果带回主进程，由其汇报
+    """
+    started = time.perf_counter()
+    problems = []
+    stream_merge(file_paths, mp3_path, warning_callback=lambda text, details: problems.extend(details))
+    if aac_path is not None:
+        tmp_path = aac_path + ".part"
+        _ffmpeg(["-i", mp3_path, "-vn", "-c:a", "aac", "-b:a", M4B_AAC_BITRATE, "-f", "mp4", tmp_path])
+        os.replace(tmp_path, aac_path)
+        duration = mp4_duration(aac_path)
+    else:
+        duration = mp3_duration(mp3_path)
+    return mp3_path, duration or 0.0, aac_path, started, time.perf_counter() - started, problems
+
+
+def _escape_metadata(value):
+    """FFMETADATA 文本中 = ; # \\ 与换行需要转义"""
+    return re.sub(r"([=;#\\\n])", r"\\\1", value)
+
+
+def write_ffmetadata(path, title, chapters):
+    """chapters: [(标题, 起始秒, 结束秒)]，写出 ffmpeg 的章节元数据文件"""
+    lines = [";FFMETADATA1", f"title={_escape_metadata(title)}", ""]
+    for chapter_title, start, end in chapters:
+        lines += [
+            "[CHAPTER]",
+            "TIMEBASE=1/1000",
+            f"START={round(start * 1000)}",
+            f"END={round(end * 1000)}",
+            f"title={_escape_metadata(chapter_title)}",
+            "",
+        ]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def mux_chapters(file_paths, chapters, output_path, fmt, title=""):
+    """
+    不重新编码，把逐章音频按顺序拼进带章节标记的容器 (concat 分离器 + 流拷贝)。
+    fmt 为 "mka" (MP3 直接封装) 或 "m4b" (file_paths 需为 AAC)。
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        list_path = os.path.join(tmp_dir, "concat.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in file_paths:
+                escaped = os.path.abspath(path).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        meta_path = os.path.join(tmp_dir, "chapters.txt")
+        write_ffmetadata(meta_path, title, chapters)
+
+        tmp_path = output_path + ".part"
+        _ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", list_path, "-i", meta_path,
+            "-map", "0:a", "-map_metadata", "1", "-map_chapters", "1", "-c", "copy",
+            "-f", "ipod" if fmt == "m4b" else "matroska", tmp_path,
+        ])
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+class ChapterRenderer:
+    """
+    逐章渲染：流水线每完成一章就提交到进程池，拼接该章的 MP3 (m4b 格式再编码 AAC)，
+    多章并行，最后一次 TTS 调用结束后只剩下最后一章与不重新编码的封装。
+    成书为 output_path，逐章 MP3 保留在 "<输出名>_chapters" 目录。
+    """
+
+    def __init__(self, output_path, fmt="mp3", workers=None):
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"不支持的输出格式: {fmt}")
+        self.output_path = output_path
+        self.fmt = fmt
+        base = os.path.splitext(output_path)[0]
+        self.chapter_dir = base + "_chapters"
+        os.makedirs(self.chapter_dir, exist_ok=True)
+        self._pool = ProcessPoolExecutor(max_workers=workers or CHAPTER_RENDER_WORKERS)
+        # 章节顺序号 -> (标题, Future)
+        self._chapters = {}
+
+    def submit(self, order, title, file_paths):
+        """提交一章 (order 为该章在成书中的顺序)；没有音频的章节被跳过"""
+        if not file_paths:
+            return
+        mp3_path = os.path.join(self.chapter_dir, chapter_filename(order, title))
+        aac_path = os.path.splitext(mp3_path)[0] + ".m4a" if self.fmt == "m4b" else None
+        self._chapters[order] = (title, self._pool.submit(_render_chapter, file_paths, mp3_path, aac_path))
+
+    def finish(self, progress_callback=None, title="", warning_callback=None):
+        """
+        等待所有章节渲染完成并封装成书。progress_callback(done, total) 汇报已完成的章节数，
+        warning_callback(text, details) 汇报拼接时被跳过的片段 (同 stream_merge)。
+        返回 {"output": 成书路径, "chapters": [(标题, MP3 路径, 时长)]}
+        """
+        orders = sorted(self._chapters)
+        rendered = []
+        problems = []
+        try:
+            for done, order in enumerate(orders, 1):
+                chapter_title, future = self._chapters[order]
+                mp3_path, duration, aac_path, started, elapsed, skipped = future.result()
+                problems.extend(f"{chapter_title}: {line}" for line in skipped)
+                metrics.observe("chapter_render_seconds", elapsed, format=self.fmt)
+                metrics.record_span(chapter_title, "render", started, elapsed, order=order)
+                rendered.append((chapter_title, mp3_path, duration, aac_path))
+                if progress_callback:
+                    progress_callback(done, len(orders))
+        finally:
+            self._pool.shutdown()
+        if problems:
+            text = f"有 {len(problems)} 个片段无法拼接，成书中将缺少这些内容。"
+            if warning_callback is not None:
+                warning_callback(text, problems)
+            else:
+                print(text, *problems, sep="\n")
+
+        started = time.perf_counter()
+        if not rendered:
+            output = None
+        elif self.fmt == "mp3":
+            # 各章已是同一格式的 MP3，整书拼接只是帧拷贝
+            output = stream_merge([mp3_path for _, mp3_path, _, _ in rendered], self.output_path,
+                                  warning_callback=warning_callback)
+        else:
+            markers, position = [], 0.0
+            for chapter_title, _, duration, _ in rendered:
+                markers.append((chapter_title, position, position + duration))
+                position += duration
+            sources = [aac_path if self.fmt == "m4b" else mp3_path for _, mp3_path, _, aac_path in rendered]
+            output = mux_chapters(sources, markers, self.output_path, self.fmt, title)
+            for _, _, _, aac_path in rendered:
+                if aac_path is not None:
+                    os.remove(aac_path)
+        metrics.finish("mux_seconds", "merge", started, format=self.fmt, chapters=len(rendered))
+
+        return {
+            "output": output,
+            "chapters": [(chapter_title, mp3_path, duration) for chapter_title, mp3_path, duration, _ in rendered],
+        }
+
+    def cancel(self):
+        self._pool.shutdown(cancel_futures=True)
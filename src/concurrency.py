@@ -0,0 +1,176 @@
+import asyncio
+import collections
+import email.utils
+import random
+import time
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """指数退避 + 全抖动 (full jitter)：attempt 从 0 开始"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_retry_after(headers):
+    """解析 Retry-After / retry-after-ms 响应头，返回需要等待的秒数 (无则 None)"""
+    if not headers:
+        return None
+
+    retry_ms = headers.get("retry-after-ms")
+    if retry_ms:
+        try:
+            return float(retry_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        # HTTP-date 格式
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class SharedSlots:
+    """
+    跨进程共享的并发名额 (包装 multiprocessing.Manager 的信号量)。
+    多个进程各自的自适应控制器在此之上再受一个全局总预算约束。
+    """
+
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, semaphore):
+        self._semaphore = semaphore
+
+    async def acquire(self):
+        # 代理信号量的阻塞 acquire 会卡住事件循环，这里用非阻塞尝试 + 短暂让出
+        while not self._semaphore.acquire(False):
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+    def release(self):
+        self._semaphore.release()
+
+
+class AdaptiveLimiter:
+    """
+    AIMD 自适应并发控制器。
+    成功时加性增长 (每轮约 +1)，遇到限流、服务端错误或延迟突增时乘性回退，
+    并遵守服务端返回的 Retry-After。状态与事件循环无关，可跨多次 asyncio.run 复用。
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=32, latency_threshold=2.0, shared=None):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        # 延迟超过基线的多少倍视为突增
+        self.latency_threshold = latency_threshold
+        self.baseline_latency = None
+        self.in_flight = 0
+        self.successes = 0
+        self.throttles = 0
+        self.errors = 0
+        self._pause_until = 0.0
+        self._last_decrease = 0.0
+        self._waiters = collections.deque()
+        # 可选的跨进程全局名额 (SharedSlots)
+        self.shared = shared
+
+    @property
+    def current_limit(self):
+        return max(self.min_limit, min(self.max_limit, int(self.limit)))
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            delay = self._pause_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            if self.in_flight < self.current_limit:
+                self.in_flight += 1
+                if self.shared is not None:
+                    try:
+                        await self.shared.acquire()
+                    except BaseException:
+                        self.in_flight -= 1
+                        self._wake()
+                        raise
+                return
+
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # 已被唤醒却取消时，把机会让给下一个等待者
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+
+    def release(self):
+        if self.shared is not None:
+            self.shared.release()
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        free = self.current_limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _decrease(self, factor):
+        # 同一轮 (约一个基线延迟内) 的多次失败只回退一次，避免并发请求同时失败导致直接跌到底
+        now = time.monotonic()
+        cooldown = max(self.baseline_latency or 0.0, 1.0)
+        if now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+
+    def on_success(self, latency):
+        self.successes += 1
+        if self.baseline_latency is None:
+            self.baseline_latency = latency
+        spike = latency > self.baseline_latency * self.latency_threshold
+        # 基线只缓慢跟随，避免被单次慢请求带偏
+        self.baseline_latency = 0.95 * self.baseline_latency + 0.05 * latency
+
+        if spike:
+            self._decrease(0.9)
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._wake()
+
+    def on_throttle(self, retry_after=None):
+        """收到 429：并发减半，并在 Retry-After 期间暂停发起新请求"""
+        self.throttles += 1
+        self._decrease(0.5)
+        if retry_after:
+            self._pause_until = max(self._pause_until, time.monotonic() + retry_after)
+
+    def on_error(self):
+        """5xx / 连接错误：适度回退"""
+        self.errors += 1
+        self._decrease(0.75)
+
+    def stats(self):
+        return {
+            "limit": self.current_limit,
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "successes": self.successes,
+            "throttles": self.throttles,
+            "errors": self.errors,
+        }
@@ -4,6 +4,47 @@ import os
 TEMP_DIR = "temp_audio_chunks"
 OUTPUT_DIR = "output_audio"
 
+# 生成任务目录 (每个任务的清单与分段音频，用于断点续跑)
+JOBS_DIR = "jobs"
+
+# TTS 音频持久化缓存 (跨次运行复用，不随临时文件夹清空)
+TTS_CACHE_DIR = "tts_cache"
+TTS_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 2GB 上限，超出后按 LRU 淘汰
+
+# AI 导演结果缓存 (SQLite)
+DIRECTOR_CACHE_PATH = "director_cache.sqlite3"
+
+# 书籍解析结果缓存：SQLite 索引 (标题 + 偏移) 与按内容哈希命名的正文文件 (可 mmap)
+BOOK_CACHE_DIR = "book_cache"
+
+# 文本按句切分后打包的预算：每片交给 AI 导演处理一次 (字符数上限 + 估算 token 上限)
+DIRECTOR_SEGMENT_CHARS = 1500
+DIRECTOR_SEGMENT_TOKENS = 1200
+# 单次 TTS 请求的字符上限，超出的剧本条目按句拆分
+TTS_SEGMENT_CHARS = 800
+
+# 生成流水线各级之间的队列长度 (决定导演阶段最多领先录音阶段多少片)
+PIPELINE_QUEUE_SIZE = 16
+
+# PDF 并行抽取文本：分片数 (每片一个进程，各自独立打开文档)，页数少于阈值时直接单线程处理
+PDF_EXTRACT_SHARDS = os.cpu_count() or 1
+PDF_PARALLEL_MIN_PAGES = 100
+
+# 逐章渲染的进程数 (各章拼接与 AAC 编码并行)；M4B 只能封装 AAC，逐章编码时使用的码率
+CHAPTER_RENDER_WORKERS = os.cpu_count() or 1
+M4B_AAC_BITRATE = "64k"
+
+# 分布式模式：任务队列地址 (SQLite 文件路径，或 redis://host:port/db)、worker 与协调者共享的结果目录
+# 队列不放在 JOBS_DIR 下：清理断点续跑任务时不能连带删除队列与其结束日志
+JOB_QUEUE_URL = "job_queue.sqlite3"
+SHARED_STORE_DIR = "shared_store"
+# 任务租约时长 (秒)，worker 每隔三分之一租约续约一次；超过最大尝试次数的任务标记为失败
+QUEUE_LEASE_SECONDS = 60
+QUEUE_MAX_ATTEMPTS = 3
+# 协调者轮询结果、空闲 worker 轮询新任务的间隔 (秒)；worker 持续空闲时间隔逐次翻倍，直到上限
+QUEUE_POLL_INTERVAL = 0.5
+QUEUE_MAX_POLL_INTERVAL = 10.0
+
 # 默认语音角色
 DEFAULT_VOICE = "zh-CN-XiaoxiaoNeural"
 
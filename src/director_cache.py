@@ -0,0 +1,104 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from src.config import DIRECTOR_CACHE_PATH
+
+
+def prompt_version(system_prompt):
+    """System Prompt 的短哈希，作为提示词版本号"""
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class DirectorCache:
+    """
+    AI 导演结果的本地持久化缓存 (SQLite)。
+    Key = hash(文本片段, 模型名, temperature, System Prompt 版本)，
+    Value = 解析后的剧本列表。可按模型或提示词版本整体失效。
+    """
+
+    def __init__(self, db_path=DIRECTOR_CACHE_PATH):
+        self.db_path = db_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # 允许跨线程使用同一连接 (由锁串行化)；批处理的多个进程共享同一个数据库，
+        # WAL 模式下读写互不阻塞，写锁冲突时最多等待 30 秒
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS director_cache (
+                key TEXT PRIMARY KEY,
+                model_name TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                script TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_director_model ON director_cache (model_name, prompt_version)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text_segment, model_name, temperature, prompt_ver):
+        payload = json.dumps([text_segment, model_name, temperature, prompt_ver], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """命中返回剧本列表，未命中返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT script FROM director_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, script, model_name, prompt_ver):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO director_cache VALUES (?, ?, ?, ?, ?)",
+                (key, model_name, prompt_ver, json.dumps(script, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def invalidate(self, model_name=None, prompt_ver=None):
+        """按模型和/或提示词版本删除缓存；两者都不传则清空全部。返回删除条数"""
+        clauses, args = [], []
+        if model_name is not None:
+            clauses.append("model_name = ?")
+            args.append(model_name)
+        if prompt_ver is not None:
+            clauses.append("prompt_version = ?")
+            args.append(prompt_ver)
+        sql = "DELETE FROM director_cache"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+
+        with self._lock:
+            cursor = self._conn.execute(sql, args)
+            self._conn.commit()
+            return cursor.rowcount
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM director_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,285 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+from src import metrics
+from src.ai_director import AIDirector
+from src.audio_engine import AudioEngine, ScriptCoalescer, voice_signature
+from src.config import QUEUE_LEASE_SECONDS, QUEUE_MAX_POLL_INTERVAL, QUEUE_POLL_INTERVAL
+from src.job_queue import DONE, task_key
+from src.pipeline import ProgressReporter
+from src.segmenter import director_segments, split_script_item
+
+# 任务类别：导演一个片段 / 合成一个 (合并后的) 剧本条目
+DIRECT, SYNTHESIZE = "direct", "tts"
+
+# 协调者刷新队列统计 (各状态任务数，需要扫描全表) 的间隔 (秒)
+STATS_INTERVAL = 5.0
+
+
+def _narrator_script(text):
+    return [{"text": text, "role": "narrator", "params": {}}]
+
+
+# --- 协调者 ---
+async def process_distributed(chapters, selected_indices, queue, store, director_settings=None, reporter=None,
+                              on_chapter_done=None, poll_interval=QUEUE_POLL_INTERVAL):
+    """
+    分布式生成的协调者：切分片段并把导演、合成任务投递到队列，由任意数量的 worker 节点 (worker.py) 执行，
+    再按 (章节, 片段, 条目) 顺序重组结果。与 process_generation 的返回值和回调约定相同。
+    director_settings 为 AIDirector.settings()，随导演任务下发；为 None 时不使用 AI，直接构造旁白剧本。
+    任务 key 由内容决定，中断后重跑会直接复用队列中已完成的结果；全书相同的台词只合成一次。
+    """
+    reporter = reporter or ProgressReporter()
+    # 先记下结束日志的位置：之后结束的任务都能从日志中增量取到
+    cursor = queue.finished_cursor()
+    # 新投递、尚未查询过的 key：可能在此前的运行中就已结束，不会再出现在结束日志里，需单独查询一次
+    unchecked = set()
+
+    # 片段 -> 导演任务，片段文本只保留到剧本返回为止 (导演失败时用于旁白降级)
+    direct_waiting = {}
+    # 不使用 AI 时的旁白片段 (剧本在本地直接生成)
+    narration = []
+    chapter_slice_counts = []
+    for idx, chap_idx in enumerate(selected_indices):
+        segments = director_segments(chapters[chap_idx].content)
+        chapter_slice_counts.append(len(segments))
+        for seg_i, segment in enumerate(segments):
+            if director_settings is None:
+                narration.append((idx, seg_i, segment))
+                continue
+            key = task_key(DIRECT, segment, director_settings)
+            queue.enqueue(DIRECT, key, {"text": segment, "director": director_settings})
+            unchecked.add(key)
+            direct_waiting.setdefault(key, []).append((idx, seg_i, segment))
+            metrics.inc("queue_enqueued_total", kind=DIRECT)
+    total_slices = max(sum(chapter_slice_counts), 1)
+
+    # 合成任务 key -> 等待该音频的 (章节, 片段, 首条目)
+    tts_waiting = {}
+    slice_item_counts = {}
+    slice_remaining = {}
+    item_results = {}
+    chapter_remaining = list(chapter_slice_counts)
+    state = {"done": 0, "items": 0, "requests": 0}
+    failures = []
+
+    def finish_slice(idx):
+        state["done"] += 1
+        chapter_remaining[idx] -= 1
+        if chapter_remaining[idx] == 0:
+            report_chapter(idx)
+
+    def chapter_audio_files(idx):
+        audio_files = []
+        for seg_i in range(chapter_slice_counts[idx]):
+            for script_idx in range(slice_item_counts.get((idx, seg_i), 0)):
+                audio_file = item_results.get((idx, seg_i, script_idx))
+                if audio_file:
+                    audio_files.append(audio_file)
+        return audio_files
+
+    def report_chapter(idx):
+        if on_chapter_done is not None:
+            on_chapter_done(idx, chapter_audio_files(idx))
+
+    def accept_script(idx, seg_i, script):
+        """剧本到达：拆分、合并相邻同声条目，投递合成任务"""
+        key = (idx, seg_i)
+        items = [item for directed_item in script for item in split_script_item(directed_item)]
+        coalescer = ScriptCoalescer()
+        units = [unit for i, item in enumerate(items) for unit in coalescer.feed(i, item)] + coalescer.flush()
+        slice_item_counts[key] = len(items)
+        slice_remaining[key] = 0
+        state["items"] += len(items)
+        for script_idx, _, item in units:
+            state["requests"] += 1
+            if not item.get("text", "").strip():
+                continue
+            tts_key = task_key(SYNTHESIZE, voice_signature(item), item["text"])
+            if tts_key not in tts_waiting:
+                queue.enqueue(SYNTHESIZE, tts_key, {"item": item})
+                unchecked.add(tts_key)
+                metrics.inc("queue_enqueued_total", kind=SYNTHESIZE)
+            tts_waiting.setdefault(tts_key, []).append((idx, seg_i, script_idx))
+            slice_remaining[key] += 1
+        if slice_remaining[key] == 0:
+            finish_slice(idx)
+
+    for idx, seg_i, segment in narration:
+        accept_script(idx, seg_i, _narrator_script(segment))
+    # 没有任何片段的章节
+    for idx, count in enumerate(chapter_slice_counts):
+        if count == 0:
+            report_chapter(idx)
+
+    stats, stats_at = {}, 0.0
+    while direct_waiting or tts_waiting:
+        # 每轮只处理新结束的任务与新投递的 key，查询量与未完成任务总数无关
+        cursor, finished = queue.finished_since(cursor)
+        if unchecked:
+            finished.update(queue.results(list(unchecked)))
+            unchecked.clear()
+
+        for key, result in finished.items():
+            if key in direct_waiting:
+                for idx, seg_i, segment in direct_waiting.pop(key):
+                    if result["status"] == DONE:
+                        script = result["result"]["script"]
+                    else:
+                        # 多个 worker 都没能导演成功：降级为旁白，保证成书完整
+                        metrics.inc("queue_failed_total", kind=DIRECT)
+                        script = _narrator_script(segment)
+                    accept_script(idx, seg_i, script)
+            elif key in tts_waiting:
+                audio_file, error = None, result["error"]
+                if result["status"] == DONE:
+                    audio_file = store.resolve(result["result"]["audio"])
+                    error = f"共享存储中找不到 {result['result']['audio']}"
+                if audio_file is None:
+                    metrics.inc("queue_failed_total", kind=SYNTHESIZE)
+                for idx, seg_i, script_idx in tts_waiting.pop(key):
+                    item_results[(idx, seg_i, script_idx)] = audio_file
+                    if audio_file is None:
+                        failures.append(f"#{idx}-{seg_i}-{script_idx}  ->  {error}")
+                    slice_remaining[(idx, seg_i)] -= 1
+                    if slice_remaining[(idx, seg_i)] == 0:
+                        finish_slice(idx)
+
+        if time.monotonic() - stats_at >= STATS_INTERVAL:
+            stats, stats_at = queue.stats(), time.monotonic()
+        reporter.progress(state["done"], total_slices, {
+            "directing": f"{len(direct_waiting)} 个片段待导演",
+            "recording": f"{len(tts_waiting)} 条音频待合成",
+            "tts_waiting": stats.get("pending", 0),
+            "tts_in_flight": stats.get("leased", 0),
+            "tts_limit": "-",
+            "script_items": state["items"],
+            "tts_requests": state["requests"],
+            "ai": None,
+        })
+        if direct_waiting or tts_waiting:
+            await asyncio.sleep(poll_interval)
+
+    if failures:
+        reporter.warning(f"有 {len(failures)} 个片段没有取得音频 (所有 worker 都合成失败，或共享存储中缺失)，"
+                         f"成书中将缺少这些内容。", failures)
+
+    final_audio_files = []
+    for idx in range(len(selected_indices)):
+        final_audio_files.extend(chapter_audio_files(idx))
+    reporter.progress(total_slices, total_slices, None)
+    return final_audio_files
+
+
+# --- Worker ---
+class QueueWorker:
+    """
+    工作节点：从队列领取导演 / 合成任务并执行，结果写回队列 (剧本) 与共享存储 (音频)。
+    每个节点有独立的自适应并发控制器与出口 IP，增加节点即可横向扩展吞吐。
+    持有任务期间定期续约，节点崩溃后租约过期，任务由其他节点接手。
+    """
+
+    def __init__(self, queue, store, api_key=None, base_url=None, kinds=(DIRECT, SYNTHESIZE), concurrency=16,
+                 worker_id=None, tts_cache=None, director_cache=None, lease_seconds=QUEUE_LEASE_SECONDS):
+        self.queue = queue
+        self.store = store
+        self.api_key = api_key
+        self.base_url = base_url
+        self.kinds = [kind for kind in kinds if kind != DIRECT or api_key]
+        self.concurrency = concurrency
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.director_cache = director_cache
+        self.engine = AudioEngine(temp_dir=store.temp_dir(self.worker_id), cache=tts_cache,
+                                  max_concurrency=concurrency)
+        # (模型, 温度) -> AIDirector
+        self._directors = {}
+        self._sequence = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _director(self, settings):
+        key = (settings["model"], settings["temperature"])
+        if key not in self._directors:
+            self._directors[key] = AIDirector(
+                self.api_key, self.base_url, settings["model"], settings["temperature"],
+                cache=self.director_cache, max_concurrency=self.concurrency
+            )
+        return self._directors[key]
+
+    async def _direct(self, payload):
+        director = self._director(payload["director"])
+        if director.prompt_version != payload["director"]["prompt"]:
+            raise RuntimeError("提示词版本与协调者不一致，请升级该 worker")
+        return {"script": await director.adirect_scene(payload["text"], fallback=False)}
+
+    async def _synthesize(self, task):
+        self._sequence += 1
+        audio_file = await self.engine.generate_segment(task.payload["item"], self._sequence)
+        # 常驻节点没有汇总报告：缓存写入失败随时输出，不在内存中累积
+        while self.engine.cache_errors:
+            print(f"[{self.worker_id}] TTS 缓存写入失败: {self.engine.cache_errors.pop()}")
+        if audio_file is None:
+            failure = self.engine.failures.pop(self._sequence, {})
+            raise RuntimeError(failure.get("error", "合成失败"))
+        return {"audio": self.store.put_file(task.key, audio_file)}
+
+    async def _keep_lease(self, task):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.queue.heartbeat, task, self.worker_id, self.lease_seconds):
+                # 租约已丢失 (例如长时间卡顿后被他人接手)：继续执行，结果以先完成者为准
+                print(f"[{self.worker_id}] 任务 {task.key} 的租约已丢失")
+                return
+
+    async def _handle(self, task):
+        keeper = asyncio.create_task(self._keep_lease(task))
+        started = time.perf_counter()
+        try:
+            if task.kind == DIRECT:
+                result = await self._direct(task.payload)
+            else:
+                result = await self._synthesize(task)
+        except Exception as e:
+            self.failed += 1
+            await asyncio.to_thread(self.queue.fail, task, self.worker_id, repr(e))
+            metrics.finish("queue_task_seconds", "worker", started, kind=task.kind, outcome="failed")
+        else:
+            self.completed += 1
+            await asyncio.to_thread(self.queue.complete, task, self.worker_id, result)
+            metrics.finish("queue_task_seconds", "worker", started, kind=task.kind, outcome="done")
+        finally:
+            keeper.cancel()
+
+    async def run(self, idle_exit=None):
+        """
+        单个领取循环：有空闲槽位 (共 concurrency 个) 才领取下一个任务，交给独立协程执行；
+        实际 TTS / LLM 并发仍由各自的自适应控制器调节。队列为空时轮询间隔指数退避，避免空闲节点反复争抢写锁。
+        idle_exit 不为空时，没有在途任务且连续空闲超过该秒数后退出 (便于按需拉起的临时节点)。
+        """
+        slots = asyncio.Semaphore(self.concurrency)
+        running = set()
+        interval = QUEUE_POLL_INTERVAL
+        idle_since = time.monotonic()
+        while True:
+            await slots.acquire()
+            task = await asyncio.to_thread(self.queue.claim, self.kinds, self.worker_id, self.lease_seconds)
+            if task is None:
+                slots.release()
+                if running:
+                    idle_since = time.monotonic()
+                elif idle_exit is not None and time.monotonic() - idle_since >= idle_exit:
+                    break
+                await asyncio.sleep(interval)
+                interval = min(interval * 2, QUEUE_MAX_POLL_INTERVAL)
+                continue
+
+            interval = QUEUE_POLL_INTERVAL
+            handler = asyncio.create_task(self._handle(task))
+            running.add(handler)
+            handler.add_done_callback(running.discard)
+            handler.add_done_callback(lambda _: slots.release())
+        await asyncio.gather(*running)
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from src.audio_spool import audio_exists
+from src.config import JOBS_DIR
+
+
+class JobManifest:
+    """
+    生成任务的磁盘清单 (SQLite)，用于断点续跑。
+    记录每个 (章节, 片段) 的导演剧本，以及每个 (章节, 片段, 条目) 的音频文件、状态和时长。
+    任务重启后跳过所有已完成的单元，从第一个缺失处继续。
+    """
+
+    def __init__(self, job_id, jobs_dir=JOBS_DIR):
+        self.job_id = job_id
+        self.job_dir = os.path.join(jobs_dir, job_id)
+        self.audio_dir = os.path.join(self.job_dir, "segments")
+        os.makedirs(self.audio_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(self.job_dir, "manifest.sqlite3"), check_same_thread=False)
+        # WAL + NORMAL：每次写入都落盘提交，但不为每条记录做完整 fsync
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS slices (
+                chapter INTEGER NOT NULL,
+                slice INTEGER NOT NULL,
+                script TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (chapter, slice)
+            );
+            CREATE TABLE IF NOT EXISTS items (
+                chapter INTEGER NOT NULL,
+                slice INTEGER NOT NULL,
+                item INTEGER NOT NULL,
+                audio_file TEXT,
+                status TEXT NOT NULL,
+                duration REAL,
+                span INTEGER NOT NULL DEFAULT 1,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (chapter, slice, item)
+            );
+            """
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def fingerprint_bytes(data):
+        """原始书籍文件的内容哈希 (无需等整本书解析完)"""
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def make_job_id(book_fingerprint, settings):
+        """同一本书 (原始文件内容) + 相同设置 (是否 AI、模型、提示词、切分与解析器版本) 对应同一个任务"""
+        payload = json.dumps([book_fingerprint, settings], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False))
+            )
+            self._conn.commit()
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def get_script(self, chapter, slice_idx):
+        """返回已保存的剧本，未导演过返回 None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT script FROM slices WHERE chapter = ? AND slice = ?", (chapter, slice_idx)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_script(self, chapter, slice_idx, script):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO slices VALUES (?, ?, ?, ?)",
+                (chapter, slice_idx, json.dumps(script, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def completed_audio(self, chapter, slice_idx, item, span=1):
+        """
+        从 item 开始、覆盖 span 个条目的合并音频已完成且文件仍在时返回文件路径，否则返回 None。
+        覆盖范围不同 (合并方式变化) 的记录不复用。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT audio_file FROM items WHERE chapter = ? AND slice = ? AND item = ? AND span = ?"
+                " AND status = 'done'",
+                (chapter, slice_idx, item, span),
+            ).fetchone()
+        if row and audio_exists(row[0]):
+            return row[0]
+        return None
+
+    def mark_item(self, chapter, slice_idx, item, audio_file, status, duration=None, span=1):
+        """记录从 item 开始、覆盖 span 个剧本条目的一次 TTS 合成结果"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO items (chapter, slice, item, audio_file, status, duration, updated_at, span)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (chapter, slice_idx, item, audio_file, status, duration, time.time(), span),
+            )
+            self._conn.commit()
+
+    def summary(self):
+        """已导演片段数与各状态条目数"""
+        with self._lock:
+            slices = self._conn.execute("SELECT COUNT(*) FROM slices").fetchone()[0]
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM items GROUP BY status").fetchall()
+        return {"slices": slices, **{status: count for status, count in rows}}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,469 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.config import QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS
+
+# 任务状态
+PENDING, LEASED, DONE, FAILED = "pending", "leased", "done", "failed"
+
+
+@dataclass
+class Task:
+    kind: str
+    key: str
+    payload: dict
+    attempts: int
+
+
+def task_key(kind, *parts):
+    """按内容生成稳定的任务 key：相同内容只会排队一次，重跑时直接复用已完成的结果"""
+    payload = json.dumps([kind, *parts], ensure_ascii=False, sort_keys=True)
+    return f"{kind}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]}"
+
+
+def _result_entry(status, result, error):
+    return {"status": status, "result": json.loads(result) if result else None, "error": error}
+
+
+class JobQueue:
+    """
+    分布式工作队列接口：协调者按 key 投递任务并轮询结果，worker 领取任务 (带租约)、
+    定期续约，完成后写回结果。租约过期未续约的任务会被其他 worker 重新领取，
+    超过最大尝试次数后标记为失败。key 全局唯一，重复投递是空操作 (已失败的任务会重新排队)。
+    """
+
+    def enqueue(self, kind: str, key: str, payload: dict) -> None:
+        raise NotImplementedError
+
+    def claim(self, kinds: Iterable[str], worker_id: str,
+              lease_seconds: float = QUEUE_LEASE_SECONDS) -> Optional[Task]:
+        """领取一个待处理 (或租约已过期) 的任务，没有任务时返回 None"""
+        raise NotImplementedError
+
+    def heartbeat(self, task: Task, worker_id: str, lease_seconds: float = QUEUE_LEASE_SECONDS) -> bool:
+        """续约；返回 False 表示租约已丢失 (任务已被他人领取或完成)"""
+        raise NotImplementedError
+
+    def complete(self, task: Task, worker_id: str, result: dict) -> None:
+        raise NotImplementedError
+
+    def fail(self, task: Task, worker_id: str, error: str) -> None:
+        """本次尝试失败：未超过最大尝试次数时重新排队"""
+        raise NotImplementedError
+
+    def results(self, keys: List[str]) -> Dict[str, dict]:
+        """返回已结束任务的 {key: {"status": done/failed, "result": ..., "error": ...}}，未结束的 key 不出现"""
+        raise NotImplementedError
+
+    def finished_cursor(self) -> int:
+        """任务结束日志的当前位置，配合 finished_since 增量获取之后结束的任务"""
+        raise NotImplementedError
+
+    def finished_since(self, cursor: int) -> Tuple[int, Dict[str, dict]]:
+        """
+        返回 (新位置, {key: 结果})：cursor 之后结束 (完成或最终失败) 的任务，结果格式同 results。
+        轮询方只需处理新结束的任务，不必反复查询所有未完成的 key。
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    单机后端：任务表存放在一个 SQLite 文件中，同一台机器上的多个 worker 进程可以并发领取。
+    领取在 BEGIN IMMEDIATE 事务中完成，同一任务不会被两个 worker 同时持有。
+    """
+
+    # 单次 results 查询的 key 数上限 (SQLite 参数个数限制)
+    RESULT_BATCH = 500
+
+    def __init__(self, path, max_attempts=QUEUE_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_tasks_claim ON tasks(kind, status, created_at);
+            CREATE TABLE IF NOT EXISTS finished (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL
+            );
+            """
+        )
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 立即取得写锁，状态检查与改写之间不会插入其他进程的写入"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(self, kind, key, payload):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO tasks (key, kind, payload, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET status = excluded.status, attempts = 0, error = NULL, "
+                "updated_at = excluded.updated_at WHERE tasks.status = ?",
+                (key, kind, json.dumps(payload, ensure_ascii=False), PENDING, now, now, FAILED)
+            )
+
+    def claim(self, kinds, worker_id, lease_seconds=QUEUE_LEASE_SECONDS):
+        kinds = list(kinds)
+        placeholders = ",".join("?" * len(kinds))
+        now = time.time()
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    f"SELECT key, kind, payload, attempts FROM tasks WHERE kind IN ({placeholders}) "
+                    f"AND (status = ? OR (status = ? AND lease_until < ?)) ORDER BY created_at LIMIT 1",
+                    (*kinds, PENDING, LEASED, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                key, kind, payload, attempts = row
+                if attempts >= self.max_attempts:
+                    # 租约多次过期 (worker 崩溃或卡死)：不再重试
+                    conn.execute(
+                        "UPDATE tasks SET status = ?, error = ?, updated_at = ? WHERE key = ?",
+                        (FAILED, "租约多次过期", now, key)
+                    )
+                    conn.execute("INSERT INTO finished (key) VALUES (?)", (key,))
+                    continue
+                conn.execute(
+                    "UPDATE tasks SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE key = ?",
+                    (LEASED, worker_id, now + lease_seconds, now, key)
+                )
+                return Task(kind, key, json.loads(payload), attempts + 1)
+
+    def heartbeat(self, task, worker_id, lease_seconds=QUEUE_LEASE_SECONDS):
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE tasks SET lease_until = ?, updated_at = ? WHERE key = ? AND worker = ? AND status = ?",
+                (now + lease_seconds, now, task.key, worker_id, LEASED)
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, task, worker_id, result):
+        # 结果与执行者无关：租约丢失后仍先完成的一方写入结果，后完成的一方被忽略
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ?, result = ?, lease_until = NULL, updated_at = ? "
+                "WHERE key = ? AND status != ?",
+                (DONE, json.dumps(result, ensure_ascii=False), time.time(), task.key, DONE)
+            )
+            if cursor.rowcount:
+                conn.execute("INSERT INTO finished (key) VALUES (?)", (task.key,))
+
+    def fail(self, task, worker_id, error):
+        status = FAILED if task.attempts >= self.max_attempts else PENDING
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ?, error = ?, lease_until = NULL, updated_at = ? "
+                "WHERE key = ? AND worker = ? AND status = ?",
+                (status, error, time.time(), task.key, worker_id, LEASED)
+            )
+            if cursor.rowcount and status == FAILED:
+                conn.execute("INSERT INTO finished (key) VALUES (?)", (task.key,))
+
+    def results(self, keys):
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), self.RESULT_BATCH):
+                chunk = keys[i:i + self.RESULT_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT key, status, result, error FROM tasks WHERE key IN ({','.join('?' * len(chunk))}) "
+                    f"AND status IN (?, ?)",
+                    (*chunk, DONE, FAILED)
+                ).fetchall()
+                for key, status, result, error in rows:
+                    found[key] = _result_entry(status, result, error)
+        return found
+
+    def finished_cursor(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM finished").fetchone()[0]
+
+    def finished_since(self, cursor):
+        found = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT finished.seq, tasks.key, tasks.status, tasks.result, tasks.error FROM finished "
+                "JOIN tasks ON tasks.key = finished.key WHERE finished.seq > ? ORDER BY finished.seq",
+                (cursor,)
+            ).fetchall()
+        for seq, key, status, result, error in rows:
+            cursor = seq
+            # 结束后又被重新投递的任务 (失败后重跑) 以当前状态为准
+            if status in (DONE, FAILED):
+                found[key] = _result_entry(status, result, error)
+        return cursor, found
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Redis 后端的状态转换脚本：每次转换在服务端原子执行，先校验当前状态再改写，统计计数与状态同步更新。
+# 任务相关的 key 由前缀在脚本内拼出，因此只支持单实例 (非 Cluster) 部署。
+_REDIS_ENQUEUE = """
+local prefix, key, kind = ARGV[1], ARGV[2], ARGV[3]
+local task = prefix .. ':task:' .. key
+local status = redis.call('HGET', task, 'status')
+if not status then
+    redis.call('HSET', task, 'status', 'pending', 'kind', kind, 'payload', ARGV[4], 'attempts', 0,
+               'created_at', ARGV[5])
+elseif status == 'failed' then
+    redis.call('HSET', task, 'status', 'pending', 'attempts', 0)
+    redis.call('HINCRBY', prefix .. ':stats', 'failed', -1)
+else
+    return 0
+end
+redis.call('HINCRBY', prefix .. ':stats', 'pending', 1)
+redis.call('LPUSH', prefix .. ':pending:' .. kind, key)
+return 1
+"""
+
+_REDIS_CLAIM = """
+local prefix, worker, now, lease, max_attempts = ARGV[1], ARGV[2], tonumber(ARGV[3]), tonumber(ARGV[4]),
+    tonumber(ARGV[5])
+local leases, stats = prefix .. ':leases', prefix .. ':stats'
+-- 回收过期租约
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', leases, '-inf', now, 'LIMIT', 0, 100)) do
+    redis.call('ZREM', leases, key)
+    local task = prefix .. ':task:' .. key
+    if redis.call('HGET', task, 'status') == 'leased' then
+        redis.call('HINCRBY', stats, 'leased', -1)
+        if tonumber(redis.call('HGET', task, 'attempts')) >= max_attempts then
+            redis.call('HSET', task, 'status', 'failed', 'error', ARGV[6])
+            redis.call('HINCRBY', stats, 'failed', 1)
+            redis.call('RPUSH', prefix .. ':finished', key)
+        else
+            redis.call('HSET', task, 'status', 'pending')
+            redis.call('HINCRBY', stats, 'pending', 1)
+            redis.call('RPUSH', prefix .. ':pending:' .. redis.call('HGET', task, 'kind'), key)
+        end
+    end
+end
+-- 领取：列表中状态已不是 pending 的 key (已被完成或重复入列) 直接丢弃
+for i = 7, #ARGV do
+    while true do
+        local key = redis.call('RPOP', prefix .. ':pending:' .. ARGV[i])
+        if not key then
+            break
+        end
+        local task = prefix .. ':task:' .. key
+        if redis.call('HGET', task, 'status') == 'pending' then
+            local attempts = redis.call('HINCRBY', task, 'attempts', 1)
+            redis.call('HSET', task, 'status', 'leased', 'worker', worker)
+            redis.call('HINCRBY', stats, 'pending', -1)
+            redis.call('HINCRBY', stats, 'leased', 1)
+            redis.call('ZADD', leases, now + lease, key)
+            return {ARGV[i], key, redis.call('HGET', task, 'payload'), attempts}
+        end
+    end
+end
+return false
+"""
+
+_REDIS_HEARTBEAT = """
+local prefix, key, worker = ARGV[1], ARGV[2], ARGV[3]
+local task = prefix .. ':task:' .. key
+if redis.call('HGET', task, 'status') ~= 'leased' or redis.call('HGET', task, 'worker') ~= worker then
+    return 0
+end
+return redis.call('ZADD', prefix .. ':leases', 'XX', 'CH', ARGV[4], key)
+"""
+
+_REDIS_COMPLETE = """
+local prefix, key = ARGV[1], ARGV[2]
+local task = prefix .. ':task:' .. key
+local status = redis.call('HGET', task, 'status')
+if not status or status == 'done' then
+    return 0
+end
+redis.call('ZREM', prefix .. ':leases', key)
+redis.call('HSET', task, 'status', 'done', 'result', ARGV[3])
+redis.call('HINCRBY', prefix .. ':stats', status, -1)
+redis.call('HINCRBY', prefix .. ':stats', 'done', 1)
+redis.call('RPUSH', prefix .. ':finished', key)
+return 1
+"""
+
+_REDIS_FAIL = """
+local prefix, key, worker = ARGV[1], ARGV[2], ARGV[3]
+local task = prefix .. ':task:' .. key
+if redis.call('HGET', task, 'status') ~= 'leased' or redis.call('HGET', task, 'worker') ~= worker then
+    return 0
+end
+redis.call('ZREM', prefix .. ':leases', key)
+redis.call('HINCRBY', prefix .. ':stats', 'leased', -1)
+if tonumber(redis.call('HGET', task, 'attempts')) >= tonumber(ARGV[5]) then
+    redis.call('HSET', task, 'status', 'failed', 'error', ARGV[4])
+    redis.call('HINCRBY', prefix .. ':stats', 'failed', 1)
+    redis.call('RPUSH', prefix .. ':finished', key)
+else
+    redis.call('HSET', task, 'status', 'pending', 'error', ARGV[4])
+    redis.call('HINCRBY', prefix .. ':stats', 'pending', 1)
+    redis.call('RPUSH', prefix .. ':pending:' .. redis.call('HGET', task, 'kind'), key)
+end
+return 1
+"""
+
+
+class RedisJobQueue(JobQueue):
+    """
+    多机后端：任何支持 Lua 脚本的 Redis 协议兼容服务 (Redis / Valkey / KeyDB 等，单实例) 均可。
+    每个任务一个 hash；待处理任务按类别排在 list 中，持有中的任务记录在以租约到期时间为分值的 zset 中。
+    每次状态转换都是一个 Lua 脚本，领取时顺带回收过期租约，进程在任意时刻崩溃都不会留下不一致的状态。
+    任务结束时 key 追加到结束日志 (list)，供协调者增量轮询。
+    """
+
+    def __init__(self, url, prefix="book2voice", max_attempts=QUEUE_MAX_ATTEMPTS):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("Redis 队列后端需要安装 redis 包: pip install redis") from e
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+        self._enqueue = self._redis.register_script(_REDIS_ENQUEUE)
+        self._claim = self._redis.register_script(_REDIS_CLAIM)
+        self._heartbeat = self._redis.register_script(_REDIS_HEARTBEAT)
+        self._complete = self._redis.register_script(_REDIS_COMPLETE)
+        self._fail = self._redis.register_script(_REDIS_FAIL)
+
+    def _task(self, key):
+        return f"{self.prefix}:task:{key}"
+
+    def enqueue(self, kind, key, payload):
+        self._enqueue(args=[self.prefix, key, kind, json.dumps(payload, ensure_ascii=False), time.time()])
+
+    def claim(self, kinds, worker_id, lease_seconds=QUEUE_LEASE_SECONDS):
+        row = self._claim(args=[self.prefix, worker_id, time.time(), lease_seconds, self.max_attempts,
+                                "租约多次过期", *kinds])
+        if not row:
+            return None
+        kind, key, payload, attempts = row
+        return Task(kind, key, json.loads(payload), int(attempts))
+
+    def heartbeat(self, task, worker_id, lease_seconds=QUEUE_LEASE_SECONDS):
+        # 租约已被回收 (不在 zset 中) 时不再续上
+        return self._heartbeat(args=[self.prefix, task.key, worker_id, time.time() + lease_seconds]) == 1
+
+    def complete(self, task, worker_id, result):
+        # 与 SQLite 后端一致：先完成的一方写入结果，即使租约已被回收
+        self._complete(args=[self.prefix, task.key, json.dumps(result, ensure_ascii=False)])
+
+    def fail(self, task, worker_id, error):
+        self._fail(args=[self.prefix, task.key, worker_id, error, self.max_attempts])
+
+    def results(self, keys):
+        found = {}
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(self._task(key), "status", "result", "error")
+        for key, (status, result, error) in zip(keys, pipe.execute()):
+            if status in (DONE, FAILED):
+                found[key] = _result_entry(status, result, error)
+        return found
+
+    def finished_cursor(self):
+        return self._redis.llen(f"{self.prefix}:finished")
+
+    def finished_since(self, cursor):
+        # 结束日志是只追加的 list，位置即下标
+        keys = self._redis.lrange(f"{self.prefix}:finished", cursor, -1)
+        return cursor + len(keys), self.results(keys)
+
+    def stats(self):
+        return {status: int(count) for status, count in self._redis.hgetall(f"{self.prefix}:stats").items()}
+
+    def close(self):
+        self._redis.close()
+
+
+def open_queue(url):
+    """根据地址创建队列：redis:// / rediss:// 为 Redis 后端，其余视为 SQLite 文件路径 (可带 sqlite:/// 前缀)"""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisJobQueue(url)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SQLiteJobQueue(url)
+
+
+class SharedStore:
+    """
+    worker 与协调者共享的结果存储 (本机目录，多机时为各节点挂载的同一共享目录)。
+    结果以相对路径交换，各节点的挂载点可以不同。先写临时文件再原子改名，读者不会看到半截文件。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+
+    def temp_dir(self, worker_id):
+        """worker 专用的临时目录，与存储位于同一文件系统 (保证改名是原子的)"""
+        path = os.path.join(self.root, "tmp", worker_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def put_file(self, name, src_path):
+        """把本地文件移入存储，返回相对路径"""
+        digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        relative = os.path.join(digest[:2], f"{digest}{os.path.splitext(src_path)[1]}")
+        dest = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        tmp = f"{dest}.{uuid.uuid4().hex}.part"
+        shutil.move(src_path, tmp)
+        os.replace(tmp, dest)
+        return relative
+
+    def resolve(self, relative):
+        """相对路径 -> 本机路径；文件不存在 (共享目录未挂载、被清理等) 时返回 None"""
+        path = os.path.join(self.root, relative)
+        return path if os.path.exists(path) else None
@@ -0,0 +1,56 @@
+import json
+
+
+class JSONArrayStreamParser:
+    """
+    增量 JSON 数组解析器：逐块喂入 LLM 流式输出，
+    数组中的每个对象一旦闭合就立即解析并返回。
+
+    兼容两种顶层形式：直接输出 [...]，或包在对象里的 {"script": [...]}。
+    以遇到的第一个数组作为目标数组，只缓存当前正在接收的对象文本。
+    """
+
+    def __init__(self):
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._array_depth = None
+        self._obj_buf = None
+        self.done = False
+
+    def feed(self, chunk):
+        """喂入一段文本，返回本次新闭合的对象列表"""
+        items = []
+        for ch in chunk:
+            if self._obj_buf is not None:
+                self._obj_buf.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch == "[" or ch == "{":
+                self._stack.append(ch)
+                if ch == "[" and self._array_depth is None:
+                    self._array_depth = len(self._stack)
+                elif (ch == "{" and not self.done and self._obj_buf is None
+                      and self._array_depth is not None and len(self._stack) == self._array_depth + 1):
+                    self._obj_buf = ["{"]
+            elif ch == "]" or ch == "}":
+                if not self._stack:
+                    continue
+                self._stack.pop()
+                depth = len(self._stack)
+                if ch == "}" and self._obj_buf is not None and depth == self._array_depth:
+                    items.append(json.loads("".join(self._obj_buf)))
+                    self._obj_buf = None
+                elif ch == "]" and self._array_depth is not None and depth == self._array_depth - 1:
+                    self.done = True
+        return items
@@ -0,0 +1,302 @@
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+# 导出指标名的统一前缀
+METRIC_PREFIX = "book2voice_"
+
+# 延迟直方图的桶上界 (秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# 单个任务保留的时间线事件上限，超出后只更新统计指标 (10 小时的书也不会撑爆内存)
+MAX_TRACE_EVENTS = 500_000
+
+# 直方图只按这些低基数标签聚合，其余标签 (片段序号等) 只出现在时间线事件中
+_HISTOGRAM_LABELS = {"outcome", "mode", "format"}
+
+# 当前生效的指标集合；asyncio 任务创建时复制上下文，因此流水线内的所有协程共享同一个
+_current = contextvars.ContextVar("book2voice_metrics", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Metrics:
+    """
+    一次生成任务的结构化指标：计数器、在途数 (带峰值)、延迟直方图，以及 Chrome Trace 时间线。
+    导出为 Prometheus 文本格式 (to_prometheus) 与 chrome://tracing / Perfetto 可读的 JSON (to_chrome_trace)。
+    各方法线程安全，PDF 解析线程与事件循环可以同时写入。
+    """
+
+    def __init__(self, name="book2voice"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._counters = {}
+        self._gauges = {}
+        self._gauge_peaks = {}
+        self._histograms = {}
+        self._events = []
+        self.dropped_events = 0
+        # 时间线上并发的区间按类别分配到不同"车道" (tid)：类别 -> 各车道最后一个区间的结束时间
+        self._lane_ends = {}
+        self._lane_ids = {}
+
+    # --- 记录 ---
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def add_in_flight(self, name, delta, **labels):
+        """调整在途数并记录峰值，同时在时间线上画出变化曲线"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            value = self._gauges.get(key, 0) + delta
+            self._gauges[key] = value
+            self._gauge_peaks[key] = max(self._gauge_peaks.get(key, 0), value)
+            self._append_event({"name": name, "ph": "C", "ts": self._now_us(), "pid": os.getpid(),
+                                "args": {"value": value}})
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def record_span(self, name, category, started, duration, **args):
+        """记录一个时间线区间；started 为 time.perf_counter() 读数，duration 为秒"""
+        begin = round((started - self._origin) * 1e6)
+        dur = round(duration * 1e6)
+        with self._lock:
+            # 贪心分配车道：放进第一条已空闲的车道，同类别并发的区间在时间线上不会互相覆盖
+            ends = self._lane_ends.setdefault(category, [])
+            lane = next((i for i, end in enumerate(ends) if end <= begin), len(ends))
+            if lane == len(ends):
+                ends.append(0)
+            ends[lane] = max(ends[lane], begin + dur)
+            self._append_event({
+                "name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": self._lane_id(category, lane),
+                "ts": begin, "dur": dur, "args": {k: v for k, v in args.items() if v is not None},
+            })
+
+    def finish(self, histogram, category, started, trace_name=None, **labels):
+        """
+        结束一个从 started (time.perf_counter() 读数) 开始的区间：写入延迟直方图与时间线。
+        直方图只按低基数的标签聚合，片段序号之类只进时间线。
+        """
+        duration = time.perf_counter() - started
+        self.observe(histogram, duration, **{k: v for k, v in labels.items() if k in _HISTOGRAM_LABELS})
+        self.record_span(trace_name or histogram, category, started, duration, **labels)
+
+    @contextlib.contextmanager
+    def span(self, histogram, category, trace_name=None, **labels):
+        """计时一个区间；yield 出的 dict 可在区间内补充标签 (如 outcome)，标签同时作为时间线事件的参数"""
+        started = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.finish(histogram, category, started, trace_name, **labels)
+
+    def _lane_id(self, category, lane):
+        key = (category, lane)
+        if key not in self._lane_ids:
+            self._lane_ids[key] = len(self._lane_ids) + 1
+        return self._lane_ids[key]
+
+    def _now_us(self):
+        return round((time.perf_counter() - self._origin) * 1e6)
+
+    def _append_event(self, event):
+        if len(self._events) < MAX_TRACE_EVENTS:
+            self._events.append(event)
+        else:
+            self.dropped_events += 1
+
+    # --- 查询 ---
+    def elapsed(self):
+        return time.perf_counter() - self._origin
+
+    def counter(self, name, **labels):
+        """计数器的值；不给标签时对该名称下所有标签求和"""
+        with self._lock:
+            if labels:
+                return self._counters.get((name, _label_key(labels)), 0)
+            return sum(v for (n, _), v in self._counters.items() if n == name)
+
+    def peak(self, name):
+        with self._lock:
+            return max((v for (n, _), v in self._gauge_peaks.items() if n == name), default=0)
+
+    def summary(self):
+        """关键指标摘要 (供界面与命令行展示)"""
+        elapsed = max(self.elapsed(), 1e-9)
+        with self._lock:
+            histograms = {}
+            for (name, _), hist in self._histograms.items():
+                total = histograms.setdefault(name, {"count": 0, "sum": 0.0})
+                total["count"] += hist["count"]
+                total["sum"] += hist["sum"]
+        return {
+            "elapsed": round(elapsed, 3),
+            "llm_requests": self.counter("llm_requests_total"),
+            "llm_retries": self.counter("llm_retries_total"),
+            "llm_fallbacks": self.counter("llm_fallbacks_total"),
+            "llm_cache_hits": self.counter("llm_cache_hits_total"),
+            "llm_in_flight_peak": self.peak("llm_in_flight"),
+            "tts_requests": self.counter("tts_requests_total"),
+            "tts_retries": self.counter("tts_retries_total"),
+            "tts_failures": self.counter("tts_failures_total"),
+            "tts_cache_hits": self.counter("tts_cache_hits_total"),
+            "tts_in_flight_peak": self.peak("tts_in_flight"),
+            "tts_chars_per_second": round(self.counter("tts_chars_total") / elapsed, 1),
+            "mean_seconds": {name: round(h["sum"] / h["count"], 3) for name, h in histograms.items() if h["count"]},
+        }
+
+    # --- 导出 ---
+    def to_prometheus(self):
+        """Prometheus 文本格式 (0.0.4)"""
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            peaks = sorted(self._gauge_peaks.items())
+            histograms = sorted(
+                (key, {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]})
+                for key, h in self._histograms.items()
+            )
+
+        def emit_family(items, metric_type, render, suffix=""):
+            last = None
+            for (name, labels), value in items:
+                full = METRIC_PREFIX + name + suffix
+                if full != last:
+                    lines.append(f"# TYPE {full} {metric_type}")
+                    last = full
+                render(full, labels, value)
+
+        emit_family(counters, "counter", lambda n, l, v: lines.append(f"{n}{_format_labels(l)} {v}"))
+        emit_family(gauges, "gauge", lambda n, l, v: lines.append(f"{n}{_format_labels(l)} {v}"))
+        emit_family(peaks, "gauge", lambda n, l, v: lines.append(f"{n}{_format_labels(l)} {v}"), "_peak")
+
+        def render_histogram(name, labels, hist):
+            for bound, count in zip(LATENCY_BUCKETS, hist["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {hist['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {hist['sum']:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {hist['count']}")
+
+        emit_family(histograms, "histogram", render_histogram)
+
+        # 派生指标：全程吞吐 (字符/秒)
+        elapsed = max(self.elapsed(), 1e-9)
+        lines.append(f"# TYPE {METRIC_PREFIX}job_elapsed_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}job_elapsed_seconds {elapsed:.3f}")
+        for stage in ("llm", "tts"):
+            name = f"{METRIC_PREFIX}{stage}_chars_per_second"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {self.counter(stage + '_chars_total') / elapsed:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def to_chrome_trace(self):
+        """Chrome Trace Event 格式，可在 chrome://tracing 或 ui.perfetto.dev 中打开"""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+            lanes = dict(self._lane_ids)
+        metadata = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": self.name}}]
+        # 同一类别的车道排在一起
+        for order, ((category, lane), tid) in enumerate(sorted(lanes.items())):
+            metadata.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                             "args": {"name": f"{category} #{lane + 1}"}})
+            metadata.append({"name": "thread_sort_index", "ph": "M", "pid": pid, "tid": tid,
+                             "args": {"sort_index": order}})
+        return {
+            "traceEvents": metadata + events,
+            "displayTimeUnit": "ms",
+            "otherData": {"job": self.name, "dropped_events": self.dropped_events},
+        }
+
+    def write(self, directory):
+        """把 metrics.prom 与 trace.json 写入目录，返回两个文件路径"""
+        os.makedirs(directory, exist_ok=True)
+        prom_path = os.path.join(directory, "metrics.prom")
+        trace_path = os.path.join(directory, "trace.json")
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        with open(trace_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_chrome_trace(), f, ensure_ascii=False)
+        return prom_path, trace_path
+
+
+# --- 模块级入口：未激活指标集合时全部为空操作，调用方无需判断 ---
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def activate(metrics):
+    """在当前上下文 (及其中创建的 asyncio 任务) 中启用指标集合"""
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def inc(name, value=1, **labels):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.inc(name, value, **labels)
+
+
+def add_in_flight(name, delta, **labels):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add_in_flight(name, delta, **labels)
+
+
+def observe(name, value, **labels):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.observe(name, value, **labels)
+
+
+def record_span(name, category, started, duration, **args):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.record_span(name, category, started, duration, **args)
+
+
+def finish(histogram, category, started, trace_name=None, **labels):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.finish(histogram, category, started, trace_name, **labels)
+
+
+@contextlib.contextmanager
+def span(histogram, category, trace_name=None, **labels):
+    metrics = _current.get()
+    if metrics is None:
+        yield labels
+        return
+    with metrics.span(histogram, category, trace_name, **labels) as span_labels:
+        yield span_labels
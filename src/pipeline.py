@@ -0,0 +1,351 @@
+import asyncio
+import os
+import time
+
+from src import metrics
+from src.ai_director import AIDirector
+from src.audio_engine import AudioEngine, ScriptCoalescer, SegmentAddress
+from src.audio_merger import mp3_duration
+from src.audio_spool import AudioSpool
+from src.book_loader import Book
+from src.config import TEMP_DIR, PIPELINE_QUEUE_SIZE
+from src.segmenter import director_segments, split_script_item
+
+
+class ProgressReporter:
+    """
+    进度汇报接口。生成流水线只通过它输出进度，不直接依赖任何 UI；
+    Streamlit 界面与命令行分别实现。默认实现什么也不做。
+    """
+
+    def stage(self, text):
+        """阶段性提示 (如 "正在补齐失败片段")"""
+
+    def progress(self, done, total, status):
+        """
+        片段级进度。status 为 None (结束) 或包含以下字段的 dict:
+        directing / recording (当前章节标题), tts_waiting, tts_in_flight, tts_limit,
+        script_items / tts_requests (剧本条目数与合并后的 TTS 请求数),
+        ai (AI 并发控制器统计，未启用 AI 时为 None)
+        """
+
+    def merge_progress(self, done, total):
+        """成书渲染进度 (已渲染完成的章节数)"""
+
+    def warning(self, text, details=None):
+        """需要用户关注的问题，details 为补充说明的行列表"""
+
+
+def _chapter_sizes(chapters, selected_indices):
+    """各章正文大小：Book 直接取字节区间，不解码正文；普通章节列表取字符数"""
+    if isinstance(chapters, Book):
+        bounds = chapters.bounds
+        return [bounds[chap_idx + 1] - bounds[chap_idx] for chap_idx in selected_indices]
+    return [len(chapters[chap_idx].content) for chap_idx in selected_indices]
+
+
+def _chapter_titles(chapters, selected_indices):
+    """各章标题：Book 只取标题列表，不解码正文"""
+    if isinstance(chapters, Book):
+        return [chapters.title(chap_idx) for chap_idx in selected_indices]
+    return [chapters[chap_idx].title for chap_idx in selected_indices]
+
+
+# --- 核心异步逻辑：封装整个生成过程 ---
+async def process_generation(chapters, selected_indices, use_ai, director, tts_cache=None,
+                             batch_token_budget=None, stream_director=False, manifest=None,
+                             reporter=None, tts_slots=None, spool_audio=False, on_chapter_done=None):
+    """
+    将章节遍历和音频生成逻辑封装在同一个 Async Loop 中，
+    确保 AudioEngine 的 Semaphore 与当前 Loop 绑定。
+    batch_token_budget 不为空时启用批量导演：多个片段打包进一次 LLM 请求。
+    stream_director 为 True 时使用流式导演：每个剧本条目一生成就送去 TTS。
+    manifest (JobManifest) 不为空时支持断点续跑：已导演的片段、已录制的条目直接复用。
+    reporter (ProgressReporter) 接收进度；tts_slots 为多进程共享的 TTS 并发名额。
+    spool_audio 为 True 时音频不再逐片段落盘，而是追加进单个假脱机文件，返回值为片段引用。
+    on_chapter_done(idx, audio_files) 在一章的全部片段录制完成时立即回调 (idx 为在 selected_indices 中的序号)，
+    用于边生成边渲染章节；含失败条目的章节在补缺之后回调。
+
+    采用三级流水线：按句切分 -> AI 导演 -> TTS 录制，级间使用有界队列。
+    进入 TTS 前，相邻且声音参数相同的剧本条目会合并为一次请求。
+    第 N 章录音的同时第 N+1 章已在导演，任一片段导演完成即可进入 TTS，
+    最终按 (章节, 片段) 顺序输出。
+    """
+    started = time.perf_counter()
+    # 在 Loop 内部初始化 Engine，防止 Semaphore 报错
+    temp_dir = manifest.audio_dir if manifest is not None else TEMP_DIR
+    spool = AudioSpool(os.path.join(temp_dir, "segments.spool")) if spool_audio else None
+    engine = AudioEngine(temp_dir=temp_dir, cache=tts_cache, shared_slots=tts_slots, spool=spool)
+    reporter = reporter or ProgressReporter()
+
+    # 各章在切分阶段切分一次，届时才知道片段数 (None 表示尚未切分)；
+    # 切分完成前的总片段数按已切分章节的 "片段数 / 正文大小" 比例估算，供进度显示
+    chapter_slice_counts = [None] * len(selected_indices)
+    chapter_sizes = _chapter_sizes(chapters, selected_indices)
+    # 状态显示用的章节标题，开始前一次取好 (按片段逐次取会反复解码整章正文)
+    chapter_titles = _chapter_titles(chapters, selected_indices)
+    sizing = {"slices": 0, "size": 0, "unsegmented": sum(chapter_sizes)}
+
+    def total_slices():
+        if sizing["unsegmented"] and sizing["size"]:
+            estimate = sizing["slices"] + round(sizing["unsegmented"] * sizing["slices"] / sizing["size"])
+        else:
+            estimate = sizing["slices"] + sum(1 for count in chapter_slice_counts if count is None)
+        return max(estimate, state["done"], 1)
+
+    # AI 并发由 director.limiter 自适应控制
+    # 级间有界队列：防止导演阶段无限超前于录音阶段
+    slice_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    script_queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    # 同时处于录音中的片段上限 (反压到导演阶段)
+    synth_slots = asyncio.Semaphore(PIPELINE_QUEUE_SIZE)
+    # 全书共享的 TTS 工作队列：所有章节、片段的脚本条目统一排队，
+    # 由固定数量的 worker 消费，保证 TTS 并发始终打满
+    tts_queue = asyncio.Queue()
+
+    # (章节序号, 片段序号) -> 脚本条目数；(章节, 片段, 首条目) -> 合并单元的音频文件
+    slice_item_counts = {}
+    slice_remaining = {}
+    item_results = {}
+    # 重试后仍失败的条目: SegmentAddress -> ((章节, 片段, 条目), 脚本条目)，结束前统一补缺
+    failed_items = {}
+    # 含失败条目的章节 (补缺后才回调)
+    failed_chapters = set()
+    state = {"directing": "", "recording": "", "done": 0, "in_flight": 0, "items": 0, "requests": 0}
+    # 各章尚未完成的片段数 (切分时写入)，以及已回调过的章节
+    chapter_remaining = [0] * len(selected_indices)
+    chapters_reported = set()
+
+    def refresh_status():
+        reporter.progress(state["done"], total_slices(), {
+            "directing": state["directing"],
+            "recording": state["recording"],
+            "tts_waiting": tts_queue.qsize(),
+            "tts_in_flight": state["in_flight"],
+            "tts_limit": engine.limiter.current_limit,
+            "script_items": state["items"],
+            "tts_requests": state["requests"],
+            "ai": director.limiter.stats() if use_ai else None,
+        })
+
+    def maybe_finish_slice(key):
+        # 片段的所有条目都已到达 (slice_item_counts 已记录) 且全部录制完成
+        if key in slice_item_counts and slice_remaining[key] == 0:
+            state["done"] += 1
+            synth_slots.release()
+            idx = key[0]
+            chapter_remaining[idx] -= 1
+            if chapter_remaining[idx] == 0 and idx not in failed_chapters:
+                report_chapter(idx)
+        refresh_status()
+
+    def chapter_audio_files(idx):
+        audio_files = []
+        for seg_i in range(chapter_slice_counts[idx]):
+            for script_idx in range(slice_item_counts.get((idx, seg_i), 0)):
+                audio_file = item_results.get((idx, seg_i, script_idx))
+                if audio_file:
+                    audio_files.append(audio_file)
+        return audio_files
+
+    def report_chapter(idx):
+        chapters_reported.add(idx)
+        if on_chapter_done is not None:
+            on_chapter_done(idx, chapter_audio_files(idx))
+
+    async def pick_script(batch_task, k):
+        return (await batch_task)[k]
+
+    async def direct_segment(segment):
+        if use_ai:
+            return await director.adirect_scene(segment)
+        # 普通模式：直接构造默认脚本
+        return [{"text": segment, "role": "narrator", "params": {}}]
+
+    # === 阶段 1: 文本切分 ===
+    async def parse_stage():
+        for idx, chap_idx in enumerate(selected_indices):
+            segments = director_segments(chapters[chap_idx].content)
+            # 先公布该章片段数，再放出其片段：片段完成时章节总数一定已知
+            chapter_slice_counts[idx] = chapter_remaining[idx] = len(segments)
+            sizing["slices"] += len(segments)
+            sizing["size"] += chapter_sizes[idx]
+            sizing["unsegmented"] -= chapter_sizes[idx]
+            if not segments:
+                report_chapter(idx)
+            for seg_i, segment in enumerate(segments):
+                # 断点续跑：已导演过的片段直接带上保存的剧本
+                saved_script = manifest.get_script(chap_idx, seg_i) if manifest is not None else None
+                await slice_queue.put((idx, seg_i, segment, saved_script))
+        await slice_queue.put(None)
+
+    # === 阶段 2: AI 剧本标注 (并发，按序交给下一阶段) ===
+    async def direct_stage():
+        batch, batch_tokens = [], 0
+
+        async def flush_batch():
+            nonlocal batch, batch_tokens
+            if not batch:
+                return
+            batch_task = asyncio.create_task(
+                director.adirect_batch([segment for _, _, segment in batch], batch_token_budget)
+            )
+            for k, (idx, seg_i, _) in enumerate(batch):
+                await script_queue.put((idx, seg_i, asyncio.create_task(pick_script(batch_task, k))))
+            batch, batch_tokens = [], 0
+
+        while True:
+            job = await slice_queue.get()
+            if job is None:
+                await flush_batch()
+                await script_queue.put(None)
+                return
+            idx, seg_i, segment, saved_script = job
+            if saved_script is not None:
+                await script_queue.put((idx, seg_i, saved_script))
+                continue
+
+            state["directing"] = chapter_titles[idx]
+            refresh_status()
+
+            if use_ai and stream_director:
+                await script_queue.put((idx, seg_i, director.astream_scene(segment)))
+                continue
+
+            if not (use_ai and batch_token_budget):
+                await script_queue.put((idx, seg_i, asyncio.create_task(direct_segment(segment))))
+                continue
+
+            # 批量模式：累积到 token 预算后整批发出
+            cost = AIDirector.estimate_tokens(segment)
+            if batch and batch_tokens + cost > batch_token_budget:
+                await flush_batch()
+            batch.append((idx, seg_i, segment))
+            batch_tokens += cost
+
+    # === 阶段 3: 音频生成 (每个片段导演完成后，其条目立即进入全局 TTS 队列) ===
+    async def iter_script(source):
+        if isinstance(source, list):
+            # 清单中保存的剧本
+            for item in source:
+                yield item
+        elif hasattr(source, "__aiter__"):
+            # 流式导演：逐条到达
+            async for item in source:
+                yield item
+        else:
+            for item in await source:
+                yield item
+
+    async def enqueue_slice(idx, seg_i, source):
+        key = (idx, seg_i)
+        chap_idx = selected_indices[idx]
+        # 只有剧本来自清单时，清单中的条目音频才与之对应
+        resumed = manifest is not None and isinstance(source, list)
+        slice_remaining[key] = 0
+        script = []
+        coalescer = ScriptCoalescer()
+
+        def submit(units):
+            # 合并单元以首条目序号标识，span 记录它覆盖的原始条目数
+            for script_idx, span, item in units:
+                state["requests"] += 1
+                done_file = manifest.completed_audio(chap_idx, seg_i, script_idx, span) if resumed else None
+                if done_file:
+                    item_results[(idx, seg_i, script_idx)] = done_file
+                else:
+                    slice_remaining[key] += 1
+                    tts_queue.put_nowait((idx, seg_i, script_idx, span, item))
+
+        async for directed_item in iter_script(source):
+            # 过长的条目按句拆成多次 TTS 请求 (清单中保存的是拆分后的剧本，再次拆分不会变化)
+            for item in split_script_item(directed_item):
+                script.append(item)
+                state["items"] += 1
+                submit(coalescer.feed(len(script) - 1, item))
+            refresh_status()
+        submit(coalescer.flush())
+        if manifest is not None and not resumed:
+            manifest.save_script(chap_idx, seg_i, script)
+        slice_item_counts[key] = len(script)
+        maybe_finish_slice(key)
+
+    def record_item(key, span, audio_file):
+        item_results[key] = audio_file
+        if manifest is not None:
+            idx, seg_i, script_idx = key
+            status = "done" if audio_file else "failed"
+            duration = mp3_duration(audio_file) if audio_file else None
+            manifest.mark_item(selected_indices[idx], seg_i, script_idx, audio_file, status, duration, span)
+
+    async def tts_worker():
+        while True:
+            job = await tts_queue.get()
+            if job is None:
+                return
+            idx, seg_i, script_idx, span, item = job
+            state["recording"] = chapter_titles[idx]
+            state["in_flight"] += 1
+            try:
+                address = SegmentAddress(selected_indices[idx], seg_i, script_idx)
+                audio_file = await engine.generate_segment(item, address)
+                if audio_file is not None or item.get("text", "").strip():
+                    record_item((idx, seg_i, script_idx), span, audio_file)
+                if audio_file is None and address in engine.failures:
+                    failed_items[address] = ((idx, seg_i, script_idx), span, item)
+                    failed_chapters.add(idx)
+            finally:
+                state["in_flight"] -= 1
+            slice_remaining[(idx, seg_i)] -= 1
+            maybe_finish_slice((idx, seg_i))
+
+    async def synth_stage():
+        # worker 数等于并发上限，实际并发由 engine.limiter 自适应调节
+        workers = [asyncio.create_task(tts_worker()) for _ in range(engine.max_concurrency)]
+        feeders = []
+        while True:
+            job = await script_queue.get()
+            if job is None:
+                break
+            await synth_slots.acquire()
+            feeders.append(asyncio.create_task(enqueue_slice(*job)))
+        await asyncio.gather(*feeders)
+        for _ in workers:
+            tts_queue.put_nowait(None)
+        await asyncio.gather(*workers)
+
+    await asyncio.gather(parse_stage(), direct_stage(), synth_stage())
+
+    # === 补缺：只重新合成失败的条目，避免成书出现空洞 ===
+    if failed_items:
+        reporter.stage(f"🩹 正在补齐 {len(failed_items)} 个失败片段...")
+        filled = await engine.fill_gaps({address: item for address, (_, _, item) in failed_items.items()})
+        for address, (key, span, _) in failed_items.items():
+            record_item(key, span, filled.get(address))
+
+    failures = engine.failure_report()
+    if failures:
+        reporter.warning(
+            f"有 {len(failures)} 个片段多次重试后仍合成失败，成书中将缺少这些内容。",
+            [f"#{f['index']} [{f['role']}] {f['text'][:60]}  ->  {f['error']}" for f in failures]
+        )
+    if engine.cache_errors:
+        reporter.warning(f"有 {len(engine.cache_errors)} 条音频未能写入 TTS 缓存 (不影响本次成书)。", engine.cache_errors)
+
+    # 补缺后的章节 (以及没有任何片段的空章节) 在此回调
+    for idx in range(len(selected_indices)):
+        if idx not in chapters_reported:
+            report_chapter(idx)
+
+    # 按章节、片段顺序汇总
+    final_audio_files = []
+    for idx in range(len(selected_indices)):
+        final_audio_files.extend(chapter_audio_files(idx))
+
+    if spool is not None:
+        spool.close()
+    total = total_slices()
+    metrics.finish("generation_seconds", "job", started, chapters=len(selected_indices), slices=total,
+                   items=state["items"], requests=state["requests"])
+    reporter.progress(total, total, None)
+    return final_audio_files
@@ -0,0 +1,157 @@
+import re
+from typing import List, Tuple
+
+from src.ai_director import AIDirector
+from src.config import DIRECTOR_SEGMENT_CHARS, DIRECTOR_SEGMENT_TOKENS, TTS_SEGMENT_CHARS
+
+# 切分规则修订号：改动断句/打包逻辑时加一，使旧任务清单中按片段保存的剧本不再被复用
+SEGMENTER_REVISION = 1
+
+# 句末标点 (英文句点需后接空白才算句末，单独处理)
+SENTENCE_ENDS = set("。！？!?…")
+# 成对引号/括号：引号内的句末标点不断开，整段对白保持完整
+OPEN_QUOTES = set("“‘「『（《")
+CLOSE_QUOTES = set("”’」』）》")
+# 单句超出预算时的次级断点
+CLAUSE_BREAKS = set("，,、；;：:")
+
+_MARKS = re.compile("[" + re.escape("".join(SENTENCE_ENDS | OPEN_QUOTES | CLOSE_QUOTES) + '".\n') + "]")
+_TRAILING = re.compile("[" + re.escape("".join(SENTENCE_ENDS | CLOSE_QUOTES)) + "]*")
+
+
+def segmenter_settings():
+    """参与任务清单标识的切分设置 (预算变化后片段边界随之变化)"""
+    return {
+        "revision": SEGMENTER_REVISION,
+        "director": [DIRECTOR_SEGMENT_CHARS, DIRECTOR_SEGMENT_TOKENS],
+        "tts": TTS_SEGMENT_CHARS,
+    }
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """
+    按中英文句末标点与引号边界断句，返回首尾相接、覆盖全文的 [start, end) 区间。
+    换行总是断开；引号内的句末标点不断开，对白在闭合引号之后断开。
+    """
+    spans = []
+    start = 0
+    depth = 0
+    ascii_quote = False
+    n = len(text)
+
+    # 只在标点、引号和换行处推进状态机，其余字符由正则整段跳过
+    for match in _MARKS.finditer(text):
+        i = match.start()
+        if i < start:
+            continue
+        ch = text[i]
+        boundary = False
+
+        if ch == "\n":
+            # 段落边界同时重置引号状态，避免未闭合的引号吞掉后文
+            depth, ascii_quote = 0, False
+            boundary = True
+        elif ch in OPEN_QUOTES:
+            depth += 1
+        elif ch in CLOSE_QUOTES:
+            depth = max(0, depth - 1)
+            # 对白以句末标点收尾：闭合引号后断开
+            boundary = depth == 0 and not ascii_quote and i > 0 and text[i - 1] in SENTENCE_ENDS
+        elif ch == '"':
+            ascii_quote = not ascii_quote
+            boundary = not ascii_quote and depth == 0 and i > 0 and text[i - 1] in SENTENCE_ENDS
+        elif depth == 0 and not ascii_quote:
+            if ch in SENTENCE_ENDS:
+                boundary = True
+            elif ch == "." and (i + 1 == n or text[i + 1].isspace()):
+                boundary = True
+
+        if boundary:
+            # 连续的句末标点与闭合引号归入同一句，例如 "！？”"、"……"
+            end = _TRAILING.match(text, i + 1).end()
+            spans.append((start, end))
+            start = end
+
+    if start < n:
+        spans.append((start, n))
+    return spans
+
+
+def _fits(text, start, end, max_chars, max_tokens):
+    if end - start > max_chars:
+        return False
+    return max_tokens is None or AIDirector.estimate_tokens(text[start:end]) <= max_tokens
+
+
+def _split_oversized(text, start, end, max_chars, max_tokens):
+    """超长单句：先按逗号等次级断点切，仍超长时按字数硬切"""
+    pieces = []
+    piece_start = start
+    for i in range(start, end):
+        if text[i] in CLAUSE_BREAKS:
+            pieces.append((piece_start, i + 1))
+            piece_start = i + 1
+    if piece_start < end:
+        pieces.append((piece_start, end))
+
+    result = []
+    for piece_start, piece_end in pieces:
+        if _fits(text, piece_start, piece_end, max_chars, max_tokens):
+            result.append((piece_start, piece_end))
+            continue
+        # token 预算更紧时 (如纯中文)，按字数估算出的上限缩小步长
+        step = max_chars if max_tokens is None else max(1, min(max_chars, max_tokens))
+        for cut in range(piece_start, piece_end, step):
+            result.append((cut, min(cut + step, piece_end)))
+    return result
+
+
+def segment_spans(text: str, max_chars: int, max_tokens: int = None) -> List[Tuple[int, int]]:
+    """
+    断句后按预算贪心打包：每段不超过 max_chars 个字符且 (如给定) 不超过 max_tokens 个估算 token。
+    返回各段在原文中的 [start, end) 区间，纯空白的段落被丢弃。
+    """
+    # (start, end, 估算 token 数)，每句只估算一次
+    units = []
+    for start, end in sentence_spans(text):
+        tokens = AIDirector.estimate_tokens(text[start:end]) if max_tokens is not None else 0
+        if end - start <= max_chars and (max_tokens is None or tokens <= max_tokens):
+            units.append((start, end, tokens))
+            continue
+        for piece_start, piece_end in _split_oversized(text, start, end, max_chars, max_tokens):
+            tokens = AIDirector.estimate_tokens(text[piece_start:piece_end]) if max_tokens is not None else 0
+            units.append((piece_start, piece_end, tokens))
+
+    segments = []
+    seg_start = seg_end = None
+    seg_tokens = 0
+    for start, end, tokens in units:
+        if (seg_start is not None and end - seg_start <= max_chars
+                and (max_tokens is None or seg_tokens + tokens <= max_tokens)):
+            seg_end = end
+            seg_tokens += tokens
+            continue
+        if seg_start is not None:
+            segments.append((seg_start, seg_end))
+        seg_start, seg_end, seg_tokens = start, end, tokens
+    if seg_start is not None:
+        segments.append((seg_start, seg_end))
+
+    return [(start, end) for start, end in segments if text[start:end].strip()]
+
+
+def segment_text(text: str, max_chars: int, max_tokens: int = None) -> List[str]:
+    return [text[start:end].strip() for start, end in segment_spans(text, max_chars, max_tokens)]
+
+
+def director_segments(text: str) -> List[str]:
+    """交给 AI 导演的片段：一次请求的文本量"""
+    return segment_text(text, DIRECTOR_SEGMENT_CHARS, DIRECTOR_SEGMENT_TOKENS)
+
+
+def split_script_item(item: dict, max_chars: int = TTS_SEGMENT_CHARS) -> List[dict]:
+    """把超出单次 TTS 请求长度的剧本条目按句拆成多条，角色与语音参数不变"""
+    text = item.get("text", "")
+    if len(text) <= max_chars:
+        return [item]
+    return [{**item, "text": piece} for piece in segment_text(text, max_chars)]
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from src.config import TTS_CACHE_DIR, TTS_CACHE_MAX_BYTES
+
+
+class TTSCache:
+    """
+    内容寻址的 TTS 音频磁盘缓存。
+    Key = hash(text, voice, rate, pitch, volume)，文件按 key 前两位分目录存放，
+    超过容量上限时按最近使用时间 (LRU) 淘汰。
+    LRU 索引只在进程内维护：批处理的多个进程共享同一目录时，各自按启动时扫描到的文件与本进程的读写记账，
+    容量上限只是近似值；其他进程淘汰掉的文件在读取时按未命中处理。
+    """
+
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> 文件大小，顺序即 LRU 顺序 (最久未用的在最前)
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(text, voice, rate, pitch, volume):
+        """根据合成参数生成稳定的内容哈希"""
+        payload = json.dumps([text, voice, rate, pitch, volume], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.mp3")
+
+    def _load_index(self):
+        """启动时扫描缓存目录，按文件修改时间重建 LRU 顺序"""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".mp3"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                found.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        # 启动时就已超出上限 (例如调低了上限)：立即淘汰，而不是等到下一次写入
+        self._evict()
+
+    def get(self, key, dest_path):
+        """命中时将缓存音频复制到 dest_path 并返回 True"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return False
+            self._entries.move_to_end(key)
+            path = self._path_for(key)
+
+        try:
+            shutil.copyfile(path, dest_path)
+        except OSError:
+            # 文件被外部删除 (如其他进程淘汰)，视为未命中
+            self._forget(key)
+            return False
+        self._touch(path)
+
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def read(self, key):
+        """命中时返回缓存音频的字节 (供假脱机模式使用)，未命中返回 None"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            path = self._path_for(key)
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            self._forget(key)
+            return None
+        self._touch(path)
+
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def _forget(self, key):
+        """索引中有、磁盘上已不存在的条目：移出索引并记为未命中"""
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            self.misses += 1
+
+    @staticmethod
+    def _touch(path):
+        """刷新 mtime，保证重启后 LRU 顺序依然正确；文件刚被其他进程淘汰时忽略"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def write(self, key, data):
+        """将内存中的音频字节写入缓存，写入失败时抛出 OSError (由调用方记录)"""
+        path = self._path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict()
+
+    def put(self, key, src_path):
+        """将新生成的音频写入缓存，必要时淘汰最久未使用的条目；写入失败时抛出 OSError (由调用方记录)"""
+        path = self._path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(src_path, tmp_path)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path_for(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """返回命中统计，供 UI 展示"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
@@ -1,13 +1,16 @@
 import shutil
 import os
-from src.config import TEMP_DIR
+from src.config import TEMP_DIR, JOBS_DIR
 
 
-def clear_temp_folder():
-    """清空临时音频文件夹，防止残留"""
-    if os.path.exists(TEMP_DIR):
-        shutil.rmtree(TEMP_DIR)
-    os.makedirs(TEMP_DIR)
+def clear_jobs_folder():
+    """删除所有生成任务的清单与分段音频，只删除任务目录 (含 manifest.sqlite3)，目录下的其他文件保留"""
+    if not os.path.isdir(JOBS_DIR):
+        return
+    for name in os.listdir(JOBS_DIR):
+        job_dir = os.path.join(JOBS_DIR, name)
+        if os.path.isfile(os.path.join(job_dir, "manifest.sqlite3")):
+            shutil.rmtree(job_dir)
 
 
 def format_filename(index):
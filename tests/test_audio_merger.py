@@ -0,0 +1,135 @@
+import pytest
+
+from src import audio_merger
+from src.audio_merger import Mp3Format, _audio_span, mp3_duration, parse_frame_header, stream_merge
+
+# MPEG-1 Layer III, 128 kbps, 44100 Hz, 立体声：每帧 417 字节 / 1152 个采样
+STEREO_44K = bytes([0xFF, 0xFB, 0x90, 0x00])
+# MPEG-2 Layer III, 64 kbps, 24000 Hz, 单声道：每帧 192 字节 / 576 个采样
+MONO_24K = bytes([0xFF, 0xF3, 0x84, 0xC0])
+
+
+def _frame(header, fill=b"\x00"):
+    length = parse_frame_header(header).length
+    return header + fill * (length - 4)
+
+
+def _id3v2(body_size):
+    # 标签长度为 syncsafe 整数 (每字节 7 位)
+    size = bytes([(body_size >> shift) & 0x7F for shift in (21, 14, 7, 0)])
+    return b"ID3\x04\x00\x00" + size + b"\x00" * body_size
+
+
+def _xing_frame(header):
+    frame = bytearray(_frame(header))
+    frame[36:40] = b"Xing"
+    return bytes(frame)
+
+
+def _write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_parse_frame_header():
+    info = parse_frame_header(STEREO_44K)
+    assert info.format == Mp3Format(1, 3, 44100, 2)
+    assert (info.length, info.samples) == (417, 1152)
+
+    info = parse_frame_header(MONO_24K)
+    assert info.format == Mp3Format(2, 3, 24000, 1)
+    assert (info.length, info.samples) == (192, 576)
+
+    assert parse_frame_header(b"ID3\x04") is None
+    # 比特率索引 15 为保留值
+    assert parse_frame_header(bytes([0xFF, 0xFB, 0xF0, 0x00])) is None
+
+
+def test_audio_span_skips_id3v2_xing_and_id3v1(tmp_path):
+    tag = _id3v2(300)
+    # 标签后的填充字节
+    padding = b"\x00" * 7
+    audio = _frame(STEREO_44K, b"\x11") * 3
+    data = tag + padding + _xing_frame(STEREO_44K) + audio + b"TAG" + b"\x00" * 125
+    path = _write(tmp_path, "a.mp3", data)
+
+    fmt, span_path, start, end = _audio_span(path)
+    assert fmt == Mp3Format(1, 3, 44100, 2)
+    assert span_path == path
+    assert data[start:end] == audio
+    # Xing/Info 帧不计入时长
+    assert mp3_duration(path) == 3 * 1152 / 44100
+
+
+def test_audio_span_skips_info_frame(tmp_path):
+    info = bytearray(_frame(STEREO_44K))
+    info[36:40] = b"Info"
+    audio = _frame(STEREO_44K, b"\x22") * 2
+    path = _write(tmp_path, "a.mp3", bytes(info) + audio)
+
+    _, _, start, end = _audio_span(path)
+    assert (start, end) == (len(info), len(info) + len(audio))
+
+
+def test_audio_span_rejects_non_mp3(tmp_path):
+    assert _audio_span(_write(tmp_path, "a.mp3", b"RIFF" + b"\x00" * 100)) is None
+
+
+def test_stream_merge_copies_frames_when_formats_match(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_merger, "_reencode", lambda *args: pytest.fail("不应重新编码"))
+    first = _frame(STEREO_44K, b"\x01") * 2
+    second = _frame(STEREO_44K, b"\x02") * 3
+    paths = [
+        _write(tmp_path, "1.mp3", _id3v2(20) + _xing_frame(STEREO_44K) + first),
+        str(tmp_path / "missing.mp3"),
+        _write(tmp_path, "2.mp3", second + b"TAG" + b"\x00" * 125),
+    ]
+    progress = []
+    output = stream_merge(paths, str(tmp_path / "out.mp3"), lambda done, total: progress.append((done, total)))
+
+    with open(output, "rb") as f:
+        assert f.read() == first + second
+    assert progress == [(1, 2), (2, 2)]
+
+
+def test_stream_merge_reencodes_mixed_sample_rates(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_reencode(file_paths, output_path, target, progress_callback, problems):
+        calls.append((file_paths, target))
+        with open(output_path, "wb") as f:
+            f.write(b"reencoded")
+
+    monkeypatch.setattr(audio_merger, "_reencode", fake_reencode)
+    monkeypatch.setattr(audio_merger, "_stream_copy", lambda *args: pytest.fail("格式不一致时不应直接拷贝"))
+    paths = [
+        _write(tmp_path, "1.mp3", _frame(MONO_24K) * 2),
+        _write(tmp_path, "2.mp3", _frame(STEREO_44K) * 2),
+    ]
+    output = stream_merge(paths, str(tmp_path / "out.mp3"))
+
+    # 以采样率最高 (其次声道最多) 的格式为目标
+    assert calls == [(paths, Mp3Format(1, 3, 44100, 2))]
+    with open(output, "rb") as f:
+        assert f.read() == b"reencoded"
+
+
+def test_stream_merge_empty_input(tmp_path):
+    output = stream_merge([], str(tmp_path / "out.mp3"))
+    with open(output, "rb") as f:
+        assert f.read() == b""
+    assert not (tmp_path / "out.mp3.part").exists()
+
+
+def test_stream_merge_reports_skipped_segments(tmp_path):
+    audio = _frame(STEREO_44K, b"\x03") * 2
+    bad = _write(tmp_path, "bad.mp3", b"RIFF" + b"\x00" * 100)
+    paths = [_write(tmp_path, "1.mp3", audio), bad]
+    warnings = []
+    output = stream_merge(paths, str(tmp_path / "out.mp3"),
+                          warning_callback=lambda text, details: warnings.append((text, details)))
+
+    with open(output, "rb") as f:
+        assert f.read() == audio
+    assert warnings == [("有 1 个片段无法拼接，已跳过。", [f"{bad}  ->  不是 MP3"])]
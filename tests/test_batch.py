@@ -0,0 +1,30 @@
+import os
+
+from src.batch import collect_books, output_names
+
+
+def test_output_names_keep_unique_stems(tmp_path):
+    books = [str(tmp_path / "a.txt"), str(tmp_path / "sub" / "b.epub")]
+    assert output_names(books) == ["a", "b"]
+
+
+def test_output_names_disambiguate_same_stem(tmp_path):
+    for rel in ("x.txt", "x.epub", os.path.join("a", "x.txt"), os.path.join("b", "x.txt"), "y.txt"):
+        path = tmp_path / rel
+        path.parent.mkdir(exist_ok=True)
+        path.write_text("第1章 开始\n正文", encoding="utf-8")
+
+    books = collect_books(str(tmp_path))
+    names = dict(zip((os.path.relpath(book, tmp_path) for book in books), output_names(books)))
+    assert names == {
+        "x.txt": "x_txt",
+        "x.epub": "x_epub",
+        os.path.join("a", "x.txt"): "a_x_txt",
+        os.path.join("b", "x.txt"): "b_x_txt",
+        "y.txt": "y",
+    }
+
+
+def test_output_names_case_insensitive_and_repeated(tmp_path):
+    books = [str(tmp_path / "X.txt"), str(tmp_path / "x.epub"), str(tmp_path / "y.txt"), str(tmp_path / "y.txt")]
+    assert output_names(books) == ["X_txt", "x_epub", "y_txt", "y_txt_2"]
@@ -0,0 +1,18 @@
+from multiprocessing.pool import ThreadPool
+
+from src.book_cache import BookCache
+from src.book_loader import Chapter
+
+
+def test_book_cache_shared_between_instances(tmp_path):
+    caches = [BookCache(str(tmp_path)) for _ in range(2)]
+    assert caches[0]._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    chapters = [Chapter(title="第1章", content="正文一"), Chapter(title="第2章", content="正文二")]
+
+    # 两个实例 (如两个批处理进程) 同时缓存同一本书
+    with ThreadPool(2) as pool:
+        pool.map(lambda cache: cache.put("k", chapters), caches)
+
+    book = BookCache(str(tmp_path)).get("k")
+    assert [(book.title(i), book.content(i)) for i in range(len(book))] == [("第1章", "正文一"), ("第2章", "正文二")]
+    assert not list(tmp_path.glob("*.part"))
@@ -0,0 +1,31 @@
+import asyncio
+import sqlite3
+
+from src.ai_director import AIDirector
+from src.director_cache import DirectorCache
+
+
+def test_director_cache_uses_wal(tmp_path):
+    cache = DirectorCache(str(tmp_path / "director.sqlite3"))
+    assert cache._conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    cache.put("k", [{"text": "a"}], "m", "p")
+    other = DirectorCache(str(tmp_path / "director.sqlite3"))
+    assert other.get("k") == [{"text": "a"}]
+    cache.close()
+    other.close()
+
+
+class LockedCache(DirectorCache):
+    def put(self, key, script, model_name, prompt_ver):
+        raise sqlite3.OperationalError("database is locked")
+
+
+def test_cache_write_error_does_not_fail_directing(tmp_path):
+    director = AIDirector("key", "http://127.0.0.1:9", cache=LockedCache(str(tmp_path / "director.sqlite3")))
+    script = [{"text": "你好", "role": "narrator", "params": {}}]
+
+    async def request(text_segment):
+        return script
+
+    director._arequest_script = request
+    assert asyncio.run(director.adirect_scene("你好", fallback=False)) == script
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+
+from src.job_queue import DONE, FAILED, LEASED, PENDING, RedisJobQueue, SQLiteJobQueue
+
+
+@pytest.fixture
+def redis_queue(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    import redis
+
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+    queue = RedisJobQueue("redis://fake", max_attempts=2)
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def sqlite_queues(tmp_path):
+    """两个 worker 进程各自打开同一个队列文件"""
+    path = str(tmp_path / "queue.sqlite3")
+    queues = [SQLiteJobQueue(path, max_attempts=2) for _ in range(2)]
+    yield queues
+    for queue in queues:
+        queue.close()
+
+
+def _status(queue, key):
+    return queue._redis.hget(queue._task(key), "status")
+
+
+def test_redis_enqueue_is_idempotent(redis_queue):
+    redis_queue.enqueue("tts", "a", {"n": 1})
+    redis_queue.enqueue("tts", "a", {"n": 2})
+    assert redis_queue.stats() == {PENDING: 1}
+    task = redis_queue.claim(["tts"], "w1")
+    assert task.payload == {"n": 1} and task.attempts == 1
+    assert redis_queue.claim(["tts"], "w2") is None
+
+
+def test_redis_complete_after_reclaim_drops_stale_pending_key(redis_queue):
+    redis_queue.enqueue("tts", "a", {})
+    slow = redis_queue.claim(["tts"], "slow", lease_seconds=0.01)
+    time.sleep(0.02)
+    # 另一个 worker 领取时回收过期租约，任务重新排队
+    assert redis_queue.claim(["direct"], "other") is None
+    assert _status(redis_queue, "a") == PENDING
+
+    # 慢 worker 仍先完成：结果生效，列表中残留的 key 在领取时被丢弃，不会被改回 leased
+    redis_queue.complete(slow, "slow", {"audio": "x"})
+    assert redis_queue.claim(["tts"], "other") is None
+    assert _status(redis_queue, "a") == DONE
+    assert redis_queue.results(["a"])["a"]["result"] == {"audio": "x"}
+    assert redis_queue.stats() == {PENDING: 0, LEASED: 0, DONE: 1}
+
+
+def test_redis_heartbeat_and_fail_require_current_lease(redis_queue):
+    redis_queue.enqueue("tts", "a", {})
+    task = redis_queue.claim(["tts"], "w1", lease_seconds=0.01)
+    time.sleep(0.02)
+    stolen = redis_queue.claim(["tts"], "w2")
+    assert stolen.attempts == 2
+    assert not redis_queue.heartbeat(task, "w1")
+    redis_queue.fail(task, "w1", "boom")
+    assert _status(redis_queue, "a") == LEASED
+    assert redis_queue.heartbeat(stolen, "w2")
+
+    # 达到最大尝试次数后标记失败；再次投递会重新排队
+    redis_queue.fail(stolen, "w2", "boom")
+    assert redis_queue.results(["a"])["a"] == {"status": FAILED, "result": None, "error": "boom"}
+    redis_queue.enqueue("tts", "a", {})
+    assert redis_queue.claim(["tts"], "w3").attempts == 1
+    assert redis_queue.stats() == {PENDING: 0, LEASED: 1, FAILED: 0}
+
+
+def test_sqlite_workers_never_hold_the_same_task(sqlite_queues):
+    for i in range(50):
+        sqlite_queues[0].enqueue("tts", f"k{i}", {"n": i})
+    claimed = [[], []]
+
+    def drain(n):
+        while True:
+            task = sqlite_queues[n].claim(["tts"], f"w{n}")
+            if task is None:
+                return
+            claimed[n].append(task.key)
+
+    threads = [threading.Thread(target=drain, args=(n,)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed[0] + claimed[1]) == sorted(f"k{i}" for i in range(50))
+    assert sqlite_queues[0].stats() == {LEASED: 50}
+
+
+def test_sqlite_lease_expiry_max_attempts_and_reenqueue(sqlite_queues):
+    q1, q2 = sqlite_queues
+    cursor = q1.finished_cursor()
+    q1.enqueue("tts", "a", {})
+
+    # w1 的租约过期后由 w2 接手；w1 的续约与失败上报都被忽略
+    task = q1.claim(["tts"], "w1", lease_seconds=0.01)
+    assert q2.claim(["tts"], "w2") is None
+    time.sleep(0.02)
+    stolen = q2.claim(["tts"], "w2")
+    assert (stolen.key, stolen.attempts) == ("a", 2)
+    assert not q1.heartbeat(task, "w1")
+    q1.fail(task, "w1", "stale")
+    assert q2.stats() == {LEASED: 1}
+    assert q2.heartbeat(stolen, "w2")
+
+    # 达到最大尝试次数后标记失败，并出现在结束日志中
+    q2.fail(stolen, "w2", "boom")
+    cursor, finished = q1.finished_since(cursor)
+    assert finished == {"a": {"status": FAILED, "result": None, "error": "boom"}}
+    assert q1.claim(["tts"], "w1") is None
+
+    # 再次投递会重新排队并重置尝试次数
+    q1.enqueue("tts", "a", {})
+    task = q2.claim(["tts"], "w2")
+    assert task.attempts == 1
+    q2.complete(task, "w2", {"audio": "a.mp3"})
+    cursor, finished = q1.finished_since(cursor)
+    assert finished["a"]["status"] == DONE
+    assert q1.finished_since(cursor) == (cursor, {})
+    # 已完成的任务再次投递不会重跑
+    q1.enqueue("tts", "a", {})
+    assert q1.claim(["tts"], "w1") is None
+
+
+def test_sqlite_expired_lease_at_max_attempts_fails_task(sqlite_queues):
+    q1, q2 = sqlite_queues
+    q1.enqueue("tts", "a", {})
+    q1.claim(["tts"], "w1", lease_seconds=0.01)
+    time.sleep(0.02)
+    q2.claim(["tts"], "w2", lease_seconds=0.01)
+    time.sleep(0.02)
+
+    # 两次领取后 worker 都没有结束任务 (崩溃)：不再重试
+    assert q1.claim(["tts"], "w1") is None
+    assert q2.results(["a"])["a"] == {"status": FAILED, "result": None, "error": "租约多次过期"}
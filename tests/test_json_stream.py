@@ -0,0 +1,63 @@
+import json
+
+from src.json_stream import JSONArrayStreamParser
+
+SCRIPT = [
+    {"text": "他说：\"走吧 [快]\"", "role": "male_young", "params": {"rate": "+10%"}},
+    {"text": "路径 C:\\temp\\{x}", "role": "narrator", "params": {}},
+    {"text": "\u4f60\u597d \u2014 “再见”", "role": "female_young", "params": {"pitch": "-5Hz"}},
+]
+
+
+def _feed_all(parser, chunks):
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+
+def _chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_chunk_boundaries_inside_strings_and_escapes():
+    # ensure_ascii 让中文以 \uXXXX 形式出现，逐字符喂入时切分点会落在转义序列与 \u 序列中间
+    for ensure_ascii in (False, True):
+        text = json.dumps(SCRIPT, ensure_ascii=ensure_ascii)
+        assert "\\\"" in text and "\\\\" in text
+        for size in (1, 2, 3, 7):
+            parser = JSONArrayStreamParser()
+            assert _feed_all(parser, _chunked(text, size)) == SCRIPT
+            assert parser.done
+
+
+def test_items_are_returned_as_soon_as_they_close():
+    parser = JSONArrayStreamParser()
+    text = json.dumps(SCRIPT, ensure_ascii=False)
+    first_end = text.index("}}") + 2
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.feed(text[first_end - 1:first_end]) == [SCRIPT[0]]
+    assert parser.feed(text[first_end:]) == SCRIPT[1:]
+
+
+def test_array_wrapped_in_object():
+    text = "好的，剧本如下：\n```json\n" + json.dumps({"script": SCRIPT}, ensure_ascii=False) + "\n```"
+    parser = JSONArrayStreamParser()
+    assert _feed_all(parser, _chunked(text, 5)) == SCRIPT
+    assert parser.done
+    # 数组闭合之后的内容不再产出条目
+    assert parser.feed('[{"text": "多余", "role": "narrator"}]') == []
+
+
+def test_truncated_input_yields_only_closed_items():
+    text = json.dumps(SCRIPT, ensure_ascii=False)
+    # 截断在第三个条目的字符串中间
+    cut = text.index("再见")
+    parser = JSONArrayStreamParser()
+    assert _feed_all(parser, _chunked(text[:cut], 4)) == SCRIPT[:2]
+    assert not parser.done
+
+    # 数组还没开始就被截断
+    parser = JSONArrayStreamParser()
+    assert parser.feed('{"script": ') == []
+    assert not parser.done
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from src.tts_cache import TTSCache
+
+
+def _fill(cache, keys, size=100):
+    for key in keys:
+        cache.write(key, b"\x00" * size)
+
+
+def test_over_cap_cache_is_evicted_at_startup(tmp_path):
+    cache = TTSCache(str(tmp_path), max_bytes=1000)
+    keys = [f"{i:02d}" + "a" * 62 for i in range(8)]
+    for i, key in enumerate(keys):
+        _fill(cache, [key])
+        os.utime(cache._path_for(key), (i, i))
+
+    # 调低上限后重新打开：最久未用的条目立即被淘汰
+    smaller = TTSCache(str(tmp_path), max_bytes=300)
+    assert smaller.stats()["bytes"] == 300
+    assert list(smaller._entries) == keys[-3:]
+    assert not os.path.exists(smaller._path_for(keys[0]))
+
+
+def test_file_evicted_by_another_process_is_a_miss(tmp_path):
+    key = "ab" + "c" * 62
+    ours = TTSCache(str(tmp_path))
+    _fill(ours, [key])
+    # 另一个进程的索引淘汰了同一文件
+    os.remove(ours._path_for(key))
+
+    assert ours.read(key) is None
+    assert not ours.get(key, str(tmp_path / "out.mp3"))
+    assert ours.stats() == {"hits": 0, "misses": 2, "hit_rate": 0.0, "entries": 0, "bytes": 0}
+
+
+def test_write_error_is_raised_and_leaves_no_temp_file(tmp_path):
+    key = "ab" + "d" * 62
+    cache = TTSCache(str(tmp_path))
+    # 目标路径被目录占用，替换失败
+    os.makedirs(cache._path_for(key))
+    with pytest.raises(OSError):
+        cache.write(key, b"data")
+    assert os.listdir(os.path.dirname(cache._path_for(key))) == [os.path.basename(cache._path_for(key))]
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,14 @@
+from src import utils
+from src.job_manifest import JobManifest
+
+
+def test_clear_jobs_folder_keeps_non_job_files(tmp_path, monkeypatch):
+    jobs_dir = tmp_path / "jobs"
+    monkeypatch.setattr(utils, "JOBS_DIR", str(jobs_dir))
+    manifest = JobManifest("job1", jobs_dir=str(jobs_dir))
+    manifest.close()
+    (jobs_dir / "queue.sqlite3").write_bytes(b"queue")
+    (jobs_dir / "notes").mkdir()
+
+    utils.clear_jobs_folder()
+    assert sorted(p.name for p in jobs_dir.iterdir()) == ["notes", "queue.sqlite3"]
@@ -0,0 +1,61 @@
+"""
+分布式工作节点：从任务队列领取导演 / 合成任务执行，音频写入共享存储。
+协调者为 main.py --queue；每台机器可运行一个或多个 worker，随时加入或退出。
+
+示例:
+    python worker.py --queue job_queue.sqlite3 --concurrency 16
+    python worker.py --queue redis://queue-host:6379/0 --store /mnt/shared/book2voice --kinds tts
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from src.config import JOB_QUEUE_URL, SHARED_STORE_DIR
+from src.director_cache import DirectorCache
+from src.distributed import DIRECT, SYNTHESIZE, QueueWorker
+from src.job_queue import SharedStore, open_queue
+from src.tts_cache import TTSCache
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AI 有声书分布式工作节点")
+    parser.add_argument("--queue", default=JOB_QUEUE_URL, help="任务队列 (SQLite 文件路径或 redis:// 地址)")
+    parser.add_argument("--store", default=SHARED_STORE_DIR, help="与协调者共享的音频存储目录")
+    parser.add_argument("--concurrency", type=int, default=16, help="本节点同时执行的任务数上限")
+    parser.add_argument("--kinds", nargs="+", choices=(DIRECT, SYNTHESIZE), default=[DIRECT, SYNTHESIZE],
+                        help="领取的任务类别 (导演需要 API Key)")
+    parser.add_argument("--api-key", default=os.getenv("LLM_API_KEY"), help="LLM API Key (默认读取 LLM_API_KEY)")
+    parser.add_argument("--base-url", default=os.getenv("LLM_BASE_URL", "https://api.deepseek.com"))
+    parser.add_argument("--worker-id", default=None, help="节点标识 (默认 主机名-进程号-随机串)")
+    parser.add_argument("--idle-exit", type=float, default=None, help="连续空闲超过该秒数后退出")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+
+    queue = open_queue(args.queue)
+    worker = QueueWorker(
+        queue, SharedStore(args.store), args.api_key, args.base_url, args.kinds, args.concurrency,
+        args.worker_id, tts_cache=TTSCache(), director_cache=DirectorCache()
+    )
+    if not worker.kinds:
+        print("未提供 API Key，无法执行导演任务")
+        return 1
+    print(f"[{worker.worker_id}] 开始领取任务: {', '.join(worker.kinds)} (并发 {args.concurrency})", flush=True)
+    try:
+        asyncio.run(worker.run(args.idle_exit))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        queue.close()
+    print(f"[{worker.worker_id}] 已退出: 完成 {worker.completed} 个任务，失败 {worker.failed} 个")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())